@@ -290,12 +290,6 @@ export class DefaultApiRequestFactory extends BaseAPIRequestFactory {
             localVarFormParams = new URLSearchParams();
         }
 
-        if (file !== undefined) {
-            // TODO: replace .append with .set
-            if (localVarFormParams instanceof FormData) {
-                localVarFormParams.append('file', file, file.name);
-            }
-        }
         if (key !== undefined) {
             // TODO: replace .append with .set
             localVarFormParams.append('key', key as any);
@@ -312,6 +306,13 @@ export class DefaultApiRequestFactory extends BaseAPIRequestFactory {
             // TODO: replace .append with .set
             localVarFormParams.append('visibility', visibility as any);
         }
+        // the file goes last so the worker can stream it without buffering the form
+        if (file !== undefined) {
+            // TODO: replace .append with .set
+            if (localVarFormParams instanceof FormData) {
+                localVarFormParams.append('file', file, file.name);
+            }
+        }
 
         requestContext.setBody(localVarFormParams);
 
@@ -43,18 +43,16 @@ class PutFilesBody:
 
         field_dict: Dict[str, Any] = {}
         field_dict.update(self.additional_properties)
-        field_dict.update(
-            {
-                "file": file,
-                "key": key,
-            }
-        )
+        field_dict["key"] = key
         if upload_id is not UNSET:
             field_dict["upload_id"] = upload_id
         if part is not UNSET:
             field_dict["part"] = part
         if visibility is not UNSET:
             field_dict["visibility"] = visibility
+        # the worker streams the file straight to R2 when every other field
+        # precedes it, instead of buffering the whole form
+        field_dict["file"] = file
 
         return field_dict
 
@@ -77,18 +75,16 @@ class PutFilesBody:
         for prop_name, prop in self.additional_properties.items():
             field_dict[prop_name] = (None, str(prop).encode(), "text/plain")
 
-        field_dict.update(
-            {
-                "file": file,
-                "key": key,
-            }
-        )
+        field_dict["key"] = key
         if upload_id is not UNSET:
             field_dict["upload_id"] = upload_id
         if part is not UNSET:
             field_dict["part"] = part
         if visibility is not UNSET:
             field_dict["visibility"] = visibility
+        # the worker streams the file straight to R2 when every other field
+        # precedes it, instead of buffering the whole form
+        field_dict["file"] = file
 
         return field_dict
 
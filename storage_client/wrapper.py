@@ -15,7 +15,6 @@ from storage_client.src.models import (
     PutFilesBody,
     R2MultipartUploadResponse,
     R2Object,
-    R2ObjectList,
     R2UploadedPartBody,
 )
 from storage_client.src.models import (
@@ -50,6 +49,9 @@ MAX_CONCURRENT_UPLOADS = 6
 MAX_RETRIES = 3
 RETRY_MIN_WAIT = 1  # Minimum wait time between retries in seconds
 RETRY_MAX_WAIT = 10
+MAX_SIGNED_URL_BATCH = 400  # the worker's limit when it issues KV tokens
+# Status codes from workers that predate the raw upload routes.
+RAW_ROUTE_MISSING = (404, 405)
 
 
 @dataclass
@@ -59,6 +61,8 @@ class StorageClient:
 
     def __post_init__(self):
         self.client = AuthenticatedClient(base_url=self.base_url, token=self.jwt)
+        # Raw-body uploads skip multipart encoding; cleared on an older server.
+        self.raw_uploads = True
 
     @staticmethod
     def _parse_visibility(visibility: Union[str, APIVisibility]) -> APIVisibility:
@@ -109,6 +113,17 @@ class StorageClient:
         Returns:
             File: The uploaded file object.
         """
+        if self.raw_uploads:
+            response = self.client.get_httpx_client().put(
+                f"/files/{quote(key)}",
+                params={"visibility": visibility.value},
+                content=file.read(),
+                headers={"Content-Type": mime_type},
+            )
+            if response.status_code not in RAW_ROUTE_MISSING:
+                return put_files._build_response(client=self.client, response=response)
+            self.raw_uploads = False
+            file.seek(0)
         body = PutFilesBody(
             key=key,
             file=File(payload=file, file_name=key, mime_type=mime_type),
@@ -116,7 +131,70 @@ class StorageClient:
         )
         return put_files.sync_detailed(client=self.client, body=body)
 
-    async def _upload_large_file(self, file: io.BytesIO, key: str, visibility: APIVisibility, mime_type: str):
+    async def _upload_raw_part(
+        self, key: str, upload_id: str, part_number: int, chunk: bytes, upload_token: Union[str, None] = None
+    ):
+        """
+        Internal method to upload one part as the raw request body.
+
+        Returns:
+            Response: The part upload response, or None when the server has no raw routes.
+        """
+        response = await self.client.get_async_httpx_client().put(
+            f"/files/{quote(key)}/parts/{part_number}",
+            params={"upload_id": upload_id},
+            content=chunk,
+            headers={"X-Upload-Token": upload_token} if upload_token else None,
+        )
+        if response.status_code in RAW_ROUTE_MISSING:
+            self.raw_uploads = False
+            return None
+        return put_files._build_response(client=self.client, response=response)
+
+    async def resume_upload(
+        self, file: io.BytesIO, key: str, upload_id: str, visibility: Union[str, APIVisibility], mime_type: str
+    ):
+        """
+        Finish a multipart upload started by upload_file, sending only the parts the server has not stored.
+
+        Args:
+            file (io.BytesIO): The same file-like object that was being uploaded.
+            key (str): The key (path) the upload was started for.
+            upload_id (str): The upload ID returned when the upload was started.
+            visibility (Visibility): The visibility setting for the file.
+
+        Returns:
+            File: The uploaded file object.
+        """
+        file.seek(0)
+        return await self._upload_large_file(
+            file, key, self._parse_visibility(visibility), mime_type, resume_upload_id=upload_id
+        )
+
+    def get_upload(self, upload_id: str) -> Dict[str, Any]:
+        """
+        Get the state of an unfinished multipart upload.
+
+        Args:
+            upload_id (str): The upload ID returned when the upload was started.
+
+        Returns:
+            Dict[str, Any]: The upload's key, visibility, stored parts (partNumber and etag)
+                and a fresh uploadToken for the remaining parts.
+        """
+        response = self.client.get_httpx_client().get(f"/files/uploads/{quote(upload_id)}")
+        if response.status_code == 200:
+            return response.json()
+        raise Exception(f"Failed to get upload: {upload_id}")
+
+    async def _upload_large_file(
+        self,
+        file: io.BytesIO,
+        key: str,
+        visibility: APIVisibility,
+        mime_type: str,
+        resume_upload_id: Union[str, None] = None,
+    ):
         """
         Internal method to upload a large file using multipart upload.
 
@@ -124,17 +202,27 @@ class StorageClient:
             file (io.BytesIO): The file-like object to upload.
             key (str): The key (path) to store the file under.
             visibility (Visibility): The visibility setting for the file.
+            resume_upload_id (str, optional): Continue this upload instead of starting a new one.
 
         Returns:
             File: The uploaded file object.
         """
-        start_response = post_files.sync_detailed(
-            client=self.client, body=FileCreateStartBody(key=key, visibility=visibility)
-        )
-        if not isinstance(start_response.parsed, R2MultipartUploadResponse):
-            raise Exception("Failed to start multipart upload")
-
-        upload_id = start_response.parsed.upload_id
+        stored_parts: Dict[int, str] = {}
+        if resume_upload_id is not None:
+            upload = self.get_upload(resume_upload_id)
+            upload_id = resume_upload_id
+            upload_token = upload.get("uploadToken")
+            stored_parts = {part["partNumber"]: part["etag"] for part in upload["parts"]}
+        else:
+            start_response = post_files.sync_detailed(
+                client=self.client, body=FileCreateStartBody(key=key, visibility=visibility)
+            )
+            if not isinstance(start_response.parsed, R2MultipartUploadResponse):
+                raise Exception("Failed to start multipart upload")
+
+            upload_id = start_response.parsed.upload_id
+            # lets each part skip JWT and database checks on the server
+            upload_token = start_response.parsed.additional_properties.get("uploadToken")
         parts: List[R2UploadedPartBody] = []
 
         @retry(
@@ -153,17 +241,23 @@ class StorageClient:
                 )
                 async for attempt in retry_config:
                     with attempt:
-                        body_to_send = PutFilesBody(
-                            key=key,
-                            upload_id=upload_id,
-                            part=part_number,
-                            file=File(payload=chunk, file_name=key, mime_type=mime_type),  # type: ignore
-                            visibility=visibility,
-                        )  # type: ignore
-                        part_response = await put_files.asyncio_detailed(
-                            client=self.client,
-                            body=body_to_send,
-                        )
+                        part_response = None
+                        if self.raw_uploads:
+                            part_response = await self._upload_raw_part(
+                                key, upload_id, part_number, chunk, upload_token
+                            )
+                        if part_response is None:
+                            body_to_send = PutFilesBody(
+                                key=key,
+                                upload_id=upload_id,
+                                part=part_number,
+                                file=File(payload=chunk, file_name=key, mime_type=mime_type),  # type: ignore
+                                visibility=visibility,
+                            )  # type: ignore
+                            part_response = await put_files.asyncio_detailed(
+                                client=self.client,
+                                body=body_to_send,
+                            )
                         if part_response.status_code == 400:
                             print(f"Bad request: {part_response.content.decode('utf-8')}")
                             raise Exception(f"Bad request: {part_response.content.decode('utf-8')}")
@@ -197,9 +291,12 @@ class StorageClient:
             chunk = file.read(MAX_PART_SIZE)
             if not chunk:
                 break
-            upload_tasks.append(upload_part_with_semaphore(part_number, chunk))
+            if part_number in stored_parts:
+                parts.append(R2UploadedPartBody(etag=stored_parts[part_number], part_number=part_number))  # type: ignore
+            else:
+                upload_tasks.append(upload_part_with_semaphore(part_number, chunk))
             part_number += 1
-        parts = await asyncio.gather(*upload_tasks)
+        parts = sorted([*parts, *await asyncio.gather(*upload_tasks)], key=lambda part: part.part_number)
 
         complete_response = post_files.sync_detailed(
             client=self.client,
@@ -246,23 +343,40 @@ class StorageClient:
                 raise Exception(f"Failed to get signed URL for file: {key}")
         raise Exception(f"Failed to get signed URL for file: {key}")
 
+    def get_signed_urls(self, keys: List[str]) -> Dict[str, str]:
+        """
+        Get signed URLs for many files in one request.
+
+        Args:
+            keys (List[str]): The keys (paths) of the files. Sent 400 per request.
+
+        Returns:
+            Dict[str, str]: A signed URL for each key the caller can read. Keys that are
+                missing or not accessible are left out.
+        """
+        urls: Dict[str, str] = {}
+        for start in range(0, len(keys), MAX_SIGNED_URL_BATCH):
+            batch = keys[start : start + MAX_SIGNED_URL_BATCH]
+            response = self.client.get_httpx_client().post("/download/tokens", json=batch)
+            if response.status_code != 200:
+                raise Exception(f"Failed to get signed URLs: {response.text}")
+            urls.update(response.json()["urls"])
+        return urls
+
     def get_file_metadata(self, key: str) -> Dict[str, Any]:
         """
-        Retrieve metadata for a specific file.
+        Retrieve metadata for a specific file without downloading it.
 
         Args:
             key (str): The key (path) of the file.
 
         Returns:
-            Dict[str, Any]: A dictionary containing the file's metadata. Raises an exception if the file is not found.
+            Dict[str, Any]: The file's key, size, etag, httpEtag, uploaded, httpMetadata and customMetadata.
+                Raises an exception if the file is not found or not accessible.
         """
-        response: Any | File | R2Object | R2ObjectList | None = get_files.sync(client=self.client, key=key)
-        if isinstance(response, File):
-            return {
-                "payload": response.payload,
-                "filename": response.file_name,
-                "mime_type": response.mime_type,
-            }
+        response = self.client.get_httpx_client().get("/files", params={"key": key, "meta": 1})
+        if response.status_code == 200:
+            return response.json()
         raise Exception(f"Failed to get file metadata: {key}")
 
     def list_files(self, limit: int = 100) -> List[Dict[str, Any]]:
@@ -0,0 +1,164 @@
+"""D1 round trips per authorization decision, before and after single-statement queries.
+
+"before" replays the previous db_ops sequence (an employee lookup, then the
+access query); "after" is the current db_ops. Both run against the sqlite
+emulator with a simulated per-call latency:
+
+    cd workers && python3.12 bench_d1_round_trips.py --latency-ms 5
+"""
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+from typing import Any, Awaitable, Callable
+
+from emulator import EmulatedEnv, load_worker, measure
+
+db_ops = load_worker("db_ops")
+cf_types = load_worker("cf_types")
+
+
+async def legacy_does_employee_exist(db: Any, employee_id: str, company_id: str) -> bool:
+    if db_ops.is_employee_known(employee_id, company_id):
+        return True
+    result = await db.prepare("SELECT 1 FROM employees WHERE id = ?1 and company_id = ?2").bind(
+        employee_id, company_id
+    ).first()
+    if result is None:
+        return False
+    db_ops.remember_employee(employee_id, company_id)
+    return True
+
+
+async def legacy_insert_file_access(db: Any, file_access: Any) -> bool:
+    if not await legacy_does_employee_exist(db, file_access.employee_id, file_access.company_id):
+        return False
+    query = "INSERT INTO files (id, name, employee_id, company_id, visibility) VALUES (?1, ?2, ?3, ?4, ?5)"
+    binding = db.prepare(query).bind(
+        file_access.key, file_access.key, file_access.employee_id, file_access.company_id, file_access.visibility
+    )
+    result = await binding.run()
+    return result.success
+
+
+async def legacy_check_file_access(db: Any, file_name: str, employee: Any) -> bool:
+    if not await legacy_does_employee_exist(db, employee.id, employee.company_id):
+        return False
+    # the old query, minus the '#' comments SQLite cannot parse
+    query = """
+    select
+     case
+        when file.visibility = 'PUBLIC' then true
+        when file.visibility = 'INTERNAL' and file.company_id = ?3 then true
+        when file.visibility = 'PRIVATE' and file.employee_id = ?2 and file.company_id = ?3 then true
+        else false
+     end
+    from (SELECT * FROM files WHERE files.name = ?1) as file
+    """
+    result = await db.prepare(query).bind(file_name, employee.id, employee.company_id).first()
+    return result is not None
+
+
+async def legacy_check_multiple_file_access(db: Any, file_names: list[str], employee: Any) -> dict[str, bool]:
+    if not await legacy_does_employee_exist(db, employee.id, employee.company_id):
+        return {file_name: False for file_name in file_names}
+    query = """
+    SELECT name,
+     CASE
+        WHEN visibility = 'PUBLIC' THEN 1
+        WHEN visibility = 'INTERNAL' AND company_id = ?2 THEN 1
+        WHEN visibility = 'PRIVATE' AND employee_id = ?1 AND company_id = ?2 THEN 1
+        ELSE 0
+     END as has_access
+    FROM files
+    WHERE name IN ({})
+    """.format(",".join("?" + str(i + 3) for i in range(len(file_names))))
+    results = (await db.prepare(query).bind(employee.id, employee.company_id, *file_names).all()).to_py()
+    return {row["name"]: bool(row["has_access"]) for row in results["results"]}
+
+
+async def seed(db: Any, employees: list[Any], files: int) -> list[str]:
+    for employee in employees:
+        await db_ops.check_and_insert_employee(db, employee)
+    names = []
+    for i in range(files):
+        owner = employees[i % len(employees)]
+        name = f"files/{i:06d}"
+        visibility = ("PUBLIC", "INTERNAL", "PRIVATE")[i % 3]
+        await db_ops.insert_file_access(db, cf_types.FileAccess(name, visibility, owner.id, owner.company_id))
+        names.append(name)
+    return names
+
+
+async def sample(
+    make_call: Callable[[int], Awaitable[Any]], iterations: int, warm: bool, db: Any, employees: list[Any]
+) -> tuple[float, float]:
+    db_ops.employee_cache_clear()
+    if warm:
+        for employee in employees:
+            await legacy_does_employee_exist(db, employee.id, employee.company_id)
+    trips, walls = [], []
+    offset = iterations if warm else 0
+    for i in range(offset, offset + iterations):
+        if not warm:
+            db_ops.employee_cache_clear()
+        _, metrics = await measure(make_call(i))
+        trips.append(metrics.round_trips)
+        walls.append(metrics.wall * 1000)
+    return statistics.fmean(trips), statistics.fmean(walls)
+
+
+async def run(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory(prefix="bench-d1-") as root:
+        env = EmulatedEnv.create(root, secret="bench", latency=args.latency_ms / 1000)
+        db = env.DB
+        employees = [cf_types.Employee(f"employee-{i}", f"company-{i % 3}", 3) for i in range(10)]
+        names = await seed(db, employees, args.files)
+        page = names[: args.page]
+
+        def access(kind: str, i: int) -> cf_types.FileAccess:
+            owner = employees[i % len(employees)]
+            return cf_types.FileAccess(f"bench/{kind}/{i:06d}", "PRIVATE", owner.id, owner.company_id)
+
+        scenarios = [
+            (
+                "check_file_access",
+                lambda i: legacy_check_file_access(db, names[i % len(names)], employees[i % len(employees)]),
+                lambda i: db_ops.check_file_access(db, names[i % len(names)], employees[i % len(employees)]),
+            ),
+            (
+                f"check_multiple_file_access[{len(page)}]",
+                lambda i: legacy_check_multiple_file_access(db, page, employees[i % len(employees)]),
+                lambda i: db_ops.check_multiple_file_access(db, page, employees[i % len(employees)]),
+            ),
+            (
+                "insert_file_access",
+                lambda i: legacy_insert_file_access(db, access("before", i)),
+                lambda i: db_ops.insert_file_access(db, access("after", i)),
+            ),
+        ]
+        print(f"{'decision':<34}{'cache':>7}{'RTs before':>12}{'RTs after':>11}{'ms before':>11}{'ms after':>10}")
+        for name, before, after in scenarios:
+            for warm in (False, True):
+                before_trips, before_ms = await sample(before, args.iterations, warm, db, employees)
+                after_trips, after_ms = await sample(after, args.iterations, warm, db, employees)
+                print(
+                    f"{name:<34}{'warm' if warm else 'cold':>7}{before_trips:>12.2f}{after_trips:>11.2f}"
+                    f"{before_ms:>11.2f}{after_ms:>10.2f}"
+                )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="simulated latency per D1 call")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument(
+        "--page", type=int, default=98, help="names per check_multiple_file_access call (the legacy IN-list stops at 98)"
+    )
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
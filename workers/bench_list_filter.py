@@ -0,0 +1,93 @@
+"""Micro-benchmark for the list branch of get_file on full 1000-object pages.
+
+Compares the previous serialization (to_py with a converter building R2Object
+dataclasses, vars, then to_js for Response.json) with
+filter_accessible_objects, which reads only the requested fields off the JS
+objects, followed by one json.dumps:
+
+    cd workers && python3.12 bench_list_filter.py --objects 1000 --permitted 0.5
+    python3.12 bench_list_filter.py --fields key,size,etag
+"""
+
+import argparse
+import json
+import random
+import timeit
+
+from emulator import load_worker
+from emulator.js_shim import JsArray, Object, to_js, to_json_value
+from emulator.r2 import HeadResult
+
+api_entry = load_worker()
+cf_types = load_worker("cf_types")
+
+
+def legacy_converter(value, convert, cache):
+    if value.constructor.name == "HeadResult":
+        return cf_types.R2Object(
+            storageClass=value.storageClass,
+            key=value.key,
+            etag=value.etag,
+            size=value.size,
+            uploaded=value.uploaded.toGMTString(),
+            checksums={"md5": value.checksums.md5.to_bytes().hex() if value.checksums.md5 else ""},
+            httpEtag=value.httpEtag or "",
+            customMetadata=value.customMetadata.to_py() if value.customMetadata else {},
+            httpMetadata=value.httpMetadata.to_py() if value.httpMetadata else {},
+            version=value.version,
+            range=value.range,
+        )
+    return value
+
+
+def legacy_serialize(page: JsArray, file_accesses: dict[str, bool]) -> str:
+    objects = page.to_py(default_converter=legacy_converter)
+    accessible = [vars(item) for item in objects if file_accesses.get(item.key)]
+    # Response.json stringifies the converted JS object
+    return json.dumps(to_json_value(to_js({"objects": accessible}, dict_converter=Object.fromEntries)))
+
+
+def make_page(count: int) -> JsArray:
+    return JsArray(
+        HeadResult(
+            {
+                "key": f"company/{i:06d}/video.mp4",
+                "version": "0" * 32,
+                "size": random.randint(1, 1 << 30),
+                "etag": "e" * 32,
+                "uploaded": 1792324800,
+                "httpMetadata": {"contentType": "video/mp4"},
+                "customMetadata": {"owner": "employee"},
+                "md5": "e" * 32,
+            }
+        )
+        for i in range(count)
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--objects", type=int, default=1000)
+    parser.add_argument("--permitted", type=float, default=0.5, help="fraction of the page the caller may read")
+    parser.add_argument("--fields", default=None, help="projection for the new serializer, e.g. key,size,etag")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(0)
+    page = make_page(args.objects)
+    fields = api_entry.parse_fields(args.fields, api_entry.OBJECT_FIELDS)
+    file_accesses = {obj.key: True for obj in page if random.random() < args.permitted}
+
+    def current(page: JsArray, file_accesses: dict[str, bool]) -> str:
+        return json.dumps({"objects": api_entry.filter_accessible_objects(list(page), file_accesses, "", fields)})
+
+    legacy_keys = [o["key"] for o in json.loads(legacy_serialize(page, file_accesses))["objects"]]
+    assert legacy_keys == [o["key"] for o in json.loads(current(page, file_accesses))["objects"]]
+
+    for name, func in (("before", legacy_serialize), ("after", current)):
+        runs = timeit.repeat(lambda: func(page, file_accesses), number=1, repeat=args.repeat)
+        print(f"{name:<7} {min(runs) * 1000:10.3f} ms per {args.objects}-object page ({len(file_accesses)} permitted)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Load benchmark for on_fetch against the local emulator.
+
+Fires concurrent requests at every route and reports wall latency and worker
+CPU time (time spent emulating R2/D1/KV is excluded) per route:
+
+    cd workers && python3.12 bench_on_fetch.py --requests 3000 --concurrency 200 --latency-ms 2
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from emulator import LocalWorker, RequestMetrics, encode_multipart, load_worker
+
+
+@dataclass
+class Route:
+    name: str
+    build: Callable[[int], tuple[str, str, dict[str, str], Optional[bytes]]]
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def make_api_key(secret: str, employee_id: str, company_id: str) -> str:
+    return load_worker("jwt").encode_jwt(
+        {"id": employee_id, "company_id": company_id, "exp": time.time() + 86400, "permission_level": 3},
+        secret,
+    )
+
+
+async def seed(worker: LocalWorker, api_keys: list[str], objects: int, size: int) -> list[str]:
+    keys = []
+    for i in range(objects):
+        key = f"seed/{i:06d}.bin"
+        body, content_type = encode_multipart(
+            {"key": key, "visibility": "PUBLIC"}, {"file": (key, random.randbytes(size), "application/octet-stream")}
+        )
+        headers = {"X-API-Key": api_keys[i % len(api_keys)], "content-type": content_type}
+        response = await worker.fetch("PUT", "/files", headers, body)
+        if response.status != 200:
+            raise RuntimeError(f"seeding {key} failed: {await response.text()}")
+        keys.append(key)
+    return keys
+
+
+async def mint_tokens(worker: LocalWorker, api_key: str, keys: list[str]) -> list[tuple[str, str]]:
+    tokens = []
+    for key in keys:
+        response = await worker.fetch("GET", f"/download/{key}/token", {"X-API-Key": api_key})
+        tokens.append((key, (await response.json_py())["token"]))
+    return tokens
+
+
+def build_routes(api_keys: list[str], keys: list[str], tokens: list[tuple[str, str]], size: int, limit: int) -> list[Route]:
+    payload = random.randbytes(size)
+
+    def headers(i: int) -> dict[str, str]:
+        return {"X-API-Key": api_keys[i % len(api_keys)]}
+
+    def get_file(i: int):
+        return "GET", f"/files?key={keys[i % len(keys)]}", headers(i), None
+
+    def list_files(i: int):
+        return "GET", f"/files?limit={limit}", headers(i), None
+
+    def list_files_d1(i: int):
+        return "GET", f"/files?source=d1&limit={limit}", headers(i), None
+
+    def put_file(i: int):
+        body, content_type = encode_multipart(
+            {"key": f"bench/{i:08d}.bin", "visibility": "PRIVATE"},
+            {"file": ("bench.bin", payload, "application/octet-stream")},
+        )
+        return "PUT", "/files", {**headers(i), "content-type": content_type}, body
+
+    def post_file(i: int):
+        body = json.dumps({"key": f"bench-multipart/{i:08d}.bin", "visibility": "PRIVATE"}).encode()
+        return "POST", "/files", headers(i), body
+
+    def download_token(i: int):
+        return "GET", f"/download/{keys[i % len(keys)]}/token", headers(i), None
+
+    def download(i: int):
+        key, token = tokens[i]
+        return "GET", f"/download/{key}?token={token}", {}, None
+
+    return [
+        Route("GET /files?key", get_file),
+        Route("GET /files?limit", list_files),
+        Route("GET /files?source=d1", list_files_d1),
+        Route("PUT /files", put_file),
+        Route("POST /files", post_file),
+        Route("GET /download/<key>/token", download_token),
+        Route("GET /download/<key>?token", download),
+    ]
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory(prefix="bench-on-fetch-") as root, contextlib.redirect_stdout(io.StringIO()):
+        worker = LocalWorker.create(
+            root, secret="bench-secret", latency=args.latency_ms / 1000, SIGNED_URL_MODE=args.signed_url_mode
+        )
+        api_keys = [make_api_key("bench-secret", f"employee-{i}", f"company-{i % 3}") for i in range(args.employees)]
+        keys = await seed(worker, api_keys, args.objects, args.size)
+        per_route = max(1, args.requests // 7)
+        tokens = await mint_tokens(worker, api_keys[0], [keys[i % len(keys)] for i in range(per_route)])
+        routes = build_routes(api_keys, keys, tokens, args.size, args.limit)
+
+        jobs = [(route, i) for route in routes for i in range(per_route)]
+        random.shuffle(jobs)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        samples: dict[str, list[tuple[int, RequestMetrics]]] = defaultdict(list)
+
+        async def fire(route: Route, i: int) -> None:
+            method, path, headers, body = route.build(i)
+            async with semaphore:
+                response, metrics = await worker.fetch_measured(method, path, headers, body)
+                if response.body is not None:
+                    await response.body.read_all()
+            samples[route.name].append((response.status, metrics))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(fire(route, i) for route, i in jobs))
+        elapsed = time.perf_counter() - started
+
+    report: dict[str, Any] = {
+        "elapsed_s": elapsed,
+        "requests": len(jobs),
+        "jwt_cache": worker.module.jwt_cache_info()._asdict(),
+        "routes": {},
+    }
+    for route in routes:
+        results = samples[route.name]
+        wall = [m.wall * 1000 for _, m in results]
+        cpu = [m.worker_cpu * 1000 for _, m in results]
+        report["routes"][route.name] = {
+            "n": len(results),
+            "errors": sum(1 for status, _ in results if status >= 400),
+            "p50_ms": percentile(wall, 50),
+            "p99_ms": percentile(wall, 99),
+            "cpu_p50_ms": percentile(cpu, 50),
+            "cpu_p99_ms": percentile(cpu, 99),
+            "cpu_mean_ms": statistics.fmean(cpu),
+            "round_trips": statistics.fmean(m.round_trips for _, m in results),
+        }
+    return report
+
+
+def print_report(report: dict[str, Any]) -> None:
+    header = f"{'route':<28}{'n':>6}{'err':>6}{'p50 ms':>9}{'p99 ms':>9}{'cpu p50':>9}{'cpu p99':>9}{'cpu avg':>9}{'RTs':>6}"
+    print(header)
+    print("-" * len(header))
+    for name, row in report["routes"].items():
+        print(
+            f"{name:<28}{row['n']:>6}{row['errors']:>6}{row['p50_ms']:>9.2f}{row['p99_ms']:>9.2f}"
+            f"{row['cpu_p50_ms']:>9.3f}{row['cpu_p99_ms']:>9.3f}{row['cpu_mean_ms']:>9.3f}{row['round_trips']:>6.1f}"
+        )
+    cache = report["jwt_cache"]
+    print(f"\nJWT cache: {cache['hits']} hits, {cache['misses']} misses, {cache['currsize']}/{cache['maxsize']} entries")
+    print(f"{report['requests']} requests in {report['elapsed_s']:.2f}s ({report['requests'] / report['elapsed_s']:.0f} req/s)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000, help="total requests, split evenly across routes")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated latency per binding call")
+    parser.add_argument("--objects", type=int, default=300, help="objects seeded before the run")
+    parser.add_argument("--size", type=int, default=4096, help="object / upload size in bytes")
+    parser.add_argument("--limit", type=int, default=100, help="page size for the list route")
+    parser.add_argument("--employees", type=int, default=10)
+    parser.add_argument("--signed-url-mode", choices=["kv", "hmac"], default="kv")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the raw report as JSON")
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Worker CPU per request for the response layer, against an earlier on_fetch.
+
+Loads ``src/`` as of a git revision next to the working tree and sends the
+same requests through both, one at a time. The routes are the ones where
+building the response (CORS headers, JSON error bodies, routing) is most of
+the work. By default the baseline is the commit before src/responses.py was
+added:
+
+    cd workers && python3.12 bench_responses.py --requests 2000
+    python3.12 bench_responses.py --baseline HEAD~3
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib
+import inspect
+import io
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from emulator import WORKER_SRC, EmulatedEnv, ExecutionContext, LocalWorker, encode_multipart, load_worker, measure
+
+SECRET = "bench-secret"
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def git(*args: str) -> str:
+    return subprocess.run(["git", *args], cwd=REPO_ROOT, check=True, capture_output=True, text=True).stdout
+
+
+def default_baseline() -> str:
+    added = git("log", "--diff-filter=A", "--format=%H", "--", "workers/src/responses.py").split()
+    return f"{added[-1]}^" if added else "HEAD"
+
+
+def _drop_worker_modules(root: Path) -> dict[str, Any]:
+    dropped = {}
+    for name, module in list(sys.modules.items()):
+        if str(getattr(module, "__file__", "") or "").startswith(str(root)):
+            dropped[name] = sys.modules.pop(name)
+    return dropped
+
+
+def load_revision(rev: str, into: Path) -> Any:
+    """``api_entry`` as of ``rev``, imported without disturbing the working
+    tree's modules."""
+    load_worker("cf_types")  # installs the js stand-ins
+    for name in git("ls-tree", "--name-only", f"{rev}:workers/src").split():
+        if name.endswith(".py"):
+            (into / name).write_text(git("show", f"{rev}:workers/src/{name}"))
+    current = _drop_worker_modules(WORKER_SRC)
+    sys.path.insert(0, str(into))
+    try:
+        module = importlib.import_module("api_entry")
+    finally:
+        sys.path.remove(str(into))
+        _drop_worker_modules(into)
+        sys.modules.update(current)
+    return module
+
+
+async def call_on_fetch(worker: LocalWorker, method: str, path: str, headers: dict[str, str], body: Optional[bytes]):
+    request = worker.request(method, path, headers, body)
+    on_fetch = worker.module.on_fetch
+    if len(inspect.signature(on_fetch).parameters) > 2:
+        return await on_fetch(request, worker.env, ExecutionContext())
+    return await on_fetch(request, worker.env)
+
+
+async def seed(worker: LocalWorker, headers: dict[str, str]) -> None:
+    body, content_type = encode_multipart(
+        {"key": "bench.txt", "visibility": "PUBLIC"}, {"file": ("bench.txt", b"x" * 1024, "text/plain")}
+    )
+    response = await call_on_fetch(worker, "PUT", "/files", {**headers, "content-type": content_type}, body)
+    if response.status != 200:
+        raise RuntimeError(f"seeding failed: {await response.text()}")
+
+
+def build_routes(headers: dict[str, str]) -> dict[str, tuple[str, str, dict[str, str], Optional[bytes]]]:
+    return {
+        "OPTIONS preflight": ("OPTIONS", "/files", {}, None),
+        "401 no API key": ("GET", "/files?limit=1", {}, None),
+        "404 unknown path": ("GET", "/unknown", headers, None),
+        "400 GET without params": ("GET", "/files", headers, None),
+        "400/405 wrong method": ("POST", "/download/bench.txt", headers, None),
+        "HEAD /files?key": ("HEAD", "/files?key=bench.txt", headers, None),
+        "GET /files?meta": ("GET", "/files?meta=1&key=bench.txt", headers, None),
+        "GET /download/<key>/token": ("GET", "/download/bench.txt/token", headers, None),
+    }
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    api_key = load_worker("jwt").encode_jwt(
+        {"id": "bench", "company_id": "bench", "exp": time.time() + 86400, "permission_level": 3}, SECRET
+    )
+    headers = {"X-API-Key": api_key}
+    routes = build_routes(headers)
+    report: dict[str, Any] = {"baseline": args.baseline, "routes": {}}
+    with contextlib.ExitStack() as stack:
+        roots = [Path(stack.enter_context(tempfile.TemporaryDirectory(prefix="bench-responses-"))) for _ in range(3)]
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        workers = {
+            "baseline": LocalWorker(EmulatedEnv.create(roots[0], SECRET), load_revision(args.baseline, roots[2])),
+            "current": LocalWorker(EmulatedEnv.create(roots[1], SECRET), load_worker()),
+        }
+        for worker in workers.values():
+            await seed(worker, headers)
+        for name, (method, path, route_headers, body) in routes.items():
+            row = {}
+            for label, worker in workers.items():
+                samples = []
+                for _ in range(args.requests):
+                    response, metrics = await measure(call_on_fetch(worker, method, path, route_headers, body))
+                    if response.body is not None:
+                        await response.body.read_all()
+                    samples.append(metrics.worker_cpu * 1e6)
+                row[label] = {"status": response.status, "cpu_us": statistics.median(samples)}
+            report["routes"][name] = row
+    return report
+
+
+def print_report(report: dict[str, Any]) -> None:
+    header = f"{'route':<28}{'status':>10}{'before us':>11}{'after us':>10}{'change':>9}"
+    print(f"baseline: {report['baseline']}\n")
+    print(header)
+    print("-" * len(header))
+    for name, row in report["routes"].items():
+        before, after = row["baseline"], row["current"]
+        change = (after["cpu_us"] - before["cpu_us"]) / before["cpu_us"] * 100
+        status = f"{before['status']}/{after['status']}" if before["status"] != after["status"] else str(after["status"])
+        print(f"{name:<28}{status:>10}{before['cpu_us']:>11.1f}{after['cpu_us']:>10.1f}{change:>+8.0f}%")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per route and worker")
+    parser.add_argument("--baseline", default=None, help="git revision to compare against")
+    parser.add_argument("--json", action="store_true", help="print the raw report as JSON")
+    args = parser.parse_args()
+    if args.baseline is None:
+        args.baseline = default_baseline()
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""In-process emulator for the storage worker.
+
+Runs ``src/api_entry.py`` under CPython with R2 on the local filesystem, D1 on
+sqlite3 and KV in a dict, so routes can be exercised and measured without
+deploying::
+
+    worker = LocalWorker.create(tmp_dir, secret="dev-secret")
+    response = await worker.fetch("GET", "/files?limit=10", headers={"X-API-Key": jwt})
+"""
+
+import importlib
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Optional
+
+from . import js_shim
+from .d1 import SCHEMA_PATH, SqliteD1Database
+from .js_shim import ExecutionContext, Headers, JsObject, ReadableStream, Request, Response, encode_multipart
+from .kv import MemoryKV
+from .metrics import RequestMetrics, measure
+from .r2 import LocalR2Bucket
+
+WORKER_SRC = Path(__file__).resolve().parent.parent / "src"
+BASE_URL = "https://storage.local"
+
+
+def load_worker(module: str = "api_entry", fresh: bool = False) -> Any:
+    """Import a worker module with the JS stand-ins installed.
+
+    ``fresh=True`` drops every previously imported src/ module first, which is
+    what a new isolate looks like: all module-scope caches start empty.
+    """
+    js_shim.install()
+    if str(WORKER_SRC) not in sys.path:
+        sys.path.insert(0, str(WORKER_SRC))
+    if fresh:
+        for name, loaded in list(sys.modules.items()):
+            if str(getattr(loaded, "__file__", "") or "").startswith(str(WORKER_SRC)):
+                del sys.modules[name]
+    return importlib.import_module(module)
+
+
+class EmulatedEnv(JsObject):
+    """The ``env`` passed to ``on_fetch``: bindings from wrangler.toml plus vars."""
+
+    @classmethod
+    def create(
+        cls,
+        root: str | Path,
+        secret: str,
+        latency: float = 0.0,
+        db_path: str | Path = ":memory:",
+        **variables: Any,
+    ) -> "EmulatedEnv":
+        return cls(
+            BUCKET=LocalR2Bucket(Path(root) / "r2", latency=latency),
+            DB=SqliteD1Database(db_path, latency=latency),
+            SIGNED_URL_KEYS=MemoryKV(latency=latency),
+            SECRET=secret,
+            **variables,
+        )
+
+
+class LocalWorker:
+    def __init__(self, env: EmulatedEnv, module: Any = None):
+        self.env = env
+        self.module = module if module is not None else load_worker()
+
+    @classmethod
+    def create(
+        cls,
+        root: Optional[str | Path] = None,
+        secret: str = "emulator-secret",
+        fresh_isolate: bool = False,
+        **kwargs: Any,
+    ) -> "LocalWorker":
+        if root is None:
+            root = tempfile.mkdtemp(prefix="r2-emulator-")
+        return cls(EmulatedEnv.create(root, secret, **kwargs), load_worker(fresh=fresh_isolate))
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        headers: Optional[dict[str, str]] = None,
+        body: Any = None,
+    ) -> Request:
+        if isinstance(body, (bytes, bytearray)):
+            body = ReadableStream.from_bytes(bytes(body))
+        return Request(BASE_URL + path, method, headers, body)
+
+    async def fetch(
+        self,
+        method: str,
+        path: str,
+        headers: Optional[dict[str, str]] = None,
+        body: Any = None,
+    ) -> Response:
+        response, ctx = await self.fetch_with_context(method, path, headers, body)
+        await ctx.drain()
+        return response
+
+    async def fetch_with_context(
+        self,
+        method: str,
+        path: str,
+        headers: Optional[dict[str, str]] = None,
+        body: Any = None,
+    ) -> tuple[Response, ExecutionContext]:
+        """The response as soon as the handler returns, with the context whose
+        ``waitUntil`` work may still be running; ``await ctx.drain()`` it."""
+        ctx = ExecutionContext()
+        response = await self.module.on_fetch(self.request(method, path, headers, body), self.env, ctx)
+        return response, ctx
+
+    async def fetch_measured(
+        self,
+        method: str,
+        path: str,
+        headers: Optional[dict[str, str]] = None,
+        body: Any = None,
+    ) -> tuple[Response, RequestMetrics]:
+        """Wall and CPU time stop at the response. ``waitUntil`` work is drained
+        afterwards; its binding calls are still counted."""
+        request = self.request(method, path, headers, body)
+        ctx = ExecutionContext()
+        response, metrics = await measure(self.module.on_fetch(request, self.env, ctx))
+        await ctx.drain()
+        return response, metrics
+
+    async def scheduled(self, cron: str = "*/30 * * * *") -> Any:
+        """Run the worker's cron handler once, as a Cron Trigger would."""
+        ctx = ExecutionContext()
+        result = await self.module.on_scheduled(JsObject(cron=cron), self.env, ctx)
+        await ctx.drain()
+        return result
+
+    async def scheduled_measured(self, cron: str = "*/30 * * * *") -> tuple[Any, RequestMetrics]:
+        ctx = ExecutionContext()
+        measured = await measure(self.module.on_scheduled(JsObject(cron=cron), self.env, ctx))
+        await ctx.drain()
+        return measured
+
+
+__all__ = [
+    "BASE_URL",
+    "SCHEMA_PATH",
+    "EmulatedEnv",
+    "ExecutionContext",
+    "Headers",
+    "LocalR2Bucket",
+    "LocalWorker",
+    "MemoryKV",
+    "RequestMetrics",
+    "SqliteD1Database",
+    "encode_multipart",
+    "load_worker",
+    "measure",
+]
@@ -0,0 +1,160 @@
+"""D1 database backed by sqlite3.
+
+D1 is SQLite, so statements run unmodified. Results come back as the same JS
+shapes the binding returns (``first`` -> row object, ``all``/``run`` -> D1Result).
+"""
+
+import re
+import sqlite3
+import time
+from collections import Counter
+from enum import Enum
+from pathlib import Path
+from typing import Any, Optional
+
+from .js_shim import JsArray, JsBuffer, JsException, JsObject, JsProxy, js_method, js_options, type_error
+from .metrics import binding_work, round_trip
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "schema.sql"
+# https://developers.cloudflare.com/d1/platform/limits/
+MAX_BOUND_PARAMETERS = 100
+NUMBERED_PARAMETER = re.compile(r"\?\d")
+
+
+def _d1_error(error: sqlite3.Error) -> JsException:
+    code = getattr(error, "sqlite_errorname", "SQLITE_ERROR")
+    return JsException("Error", f"D1_ERROR: {error}: {code}")
+
+
+def _bind_value(value: Any) -> Any:
+    if value is None or isinstance(value, (str, int, float)):
+        return int(value) if isinstance(value, bool) else value
+    if isinstance(value, JsBuffer):
+        return value.to_bytes()
+    kind = type(value).__name__
+    if isinstance(value, Enum):
+        kind = "object"
+    raise JsException("Error", f"D1_TYPE_ERROR: Type '{kind}' not supported for value '{value}'")
+
+
+class D1PreparedStatement(JsProxy):
+    js_name = "D1PreparedStatement"
+
+    def __init__(self, db: "SqliteD1Database", query: str, params: tuple[Any, ...] = ()):
+        self._db = db
+        self.query = query
+        self._params = params
+
+    def bind(self, *values: Any) -> "D1PreparedStatement":
+        if len(values) > MAX_BOUND_PARAMETERS:
+            raise JsException("Error", "D1_ERROR: too many SQL variables: SQLITE_ERROR")
+        return D1PreparedStatement(self._db, self.query, tuple(_bind_value(v) for v in values))
+
+    def _execute(self) -> tuple[list[sqlite3.Row], dict[str, Any]]:
+        start = time.perf_counter()
+        try:
+            params: tuple[Any, ...] | dict[str, Any] = self._params
+            if NUMBERED_PARAMETER.search(self.query):
+                # sqlite3 looks ?NNN parameters up by name
+                params = {str(i): value for i, value in enumerate(self._params, start=1)}
+            cursor = self._db.connection.execute(self.query, params)
+            rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            raise _d1_error(e) from e
+        meta = {
+            "duration": (time.perf_counter() - start) * 1000,
+            "changes": cursor.rowcount if cursor.rowcount > 0 else 0,
+            "last_row_id": cursor.lastrowid or 0,
+            "rows_read": len(rows),
+            "rows_written": cursor.rowcount if cursor.rowcount > 0 else 0,
+        }
+        return rows, meta
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> JsObject:
+        return JsObject({key: row[key] for key in row.keys()})
+
+    def _result(self) -> JsObject:
+        rows, meta = self._execute()
+        return JsObject(results=JsArray(self._row(r) for r in rows), success=True, meta=JsObject(meta))
+
+    async def first(self, column: Optional[str] = None) -> Any:
+        await round_trip("d1.first", self._db.latency)
+        with binding_work():
+            rows, _ = self._execute()
+            if not rows:
+                return None
+            if column is not None:
+                return rows[0][column]
+            return self._row(rows[0])
+
+    async def all(self) -> JsObject:
+        await round_trip("d1.all", self._db.latency)
+        with binding_work():
+            return self._result()
+
+    async def run(self) -> JsObject:
+        await round_trip("d1.run", self._db.latency)
+        with binding_work():
+            return self._result()
+
+    @js_method
+    async def raw(self, options: Any = None) -> JsArray:
+        await round_trip("d1.raw", self._db.latency)
+        with binding_work():
+            rows, _ = self._execute()
+            column_names = js_options(options).get("columnNames", False)
+            result = [JsArray(tuple(row)) for row in rows]
+            if column_names and rows:
+                result.insert(0, JsArray(rows[0].keys()))
+            return JsArray(result)
+
+
+class SqliteD1Database(JsProxy):
+    js_name = "D1Database"
+
+    def __init__(self, path: str | Path = ":memory:", schema: Optional[Path] = SCHEMA_PATH, latency: float = 0.0):
+        self.latency = latency
+        self.prepared: Counter[str] = Counter()
+        self.connection = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        if schema is not None:
+            self.connection.executescript(Path(schema).read_text())
+
+    def prepare(self, query: str) -> D1PreparedStatement:
+        self.prepared[query] += 1
+        return D1PreparedStatement(self, query)
+
+    async def batch(self, statements: Any) -> JsArray:
+        """Run all statements in one transaction and one round trip."""
+        await round_trip("d1.batch", self.latency)
+        with binding_work():
+            if not isinstance(statements, JsArray):
+                raise type_error("statements must be an array; pass lists through to_js()")
+            results = []
+            self.connection.execute("BEGIN")
+            try:
+                for statement in statements:
+                    results.append(statement._result())
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+            return JsArray(results)
+
+    async def exec(self, query: str) -> JsObject:
+        await round_trip("d1.exec", self.latency)
+        with binding_work():
+            start = time.perf_counter()
+            try:
+                self.connection.executescript(query)
+            except sqlite3.Error as e:
+                raise _d1_error(e) from e
+            count = len([q for q in query.split("\n") if q.strip()])
+            return JsObject(count=count, duration=(time.perf_counter() - start) * 1000)
+
+    async def dump(self) -> JsBuffer:
+        await round_trip("d1.dump", self.latency)
+        with binding_work():
+            return JsBuffer("\n".join(self.connection.iterdump()).encode("utf-8"))
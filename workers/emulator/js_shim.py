@@ -0,0 +1,805 @@
+"""Pure-Python stand-ins for the slice of the Workers JS runtime used by src/.
+
+Installed as the ``js`` and ``pyodide.ffi`` modules when the worker is imported
+outside of Pyodide. The goal is to behave like the real FFI wherever src/ can
+observe a difference: keyword arguments to JS calls are folded into a trailing
+options object, raw Python containers and bytes are rejected where Pyodide
+would hand JS an opaque PyProxy, and ``to_py`` only calls ``default_converter``
+for non-plain JS objects.
+"""
+
+import asyncio
+import inspect
+import json
+import sys
+import types
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from enum import Enum
+from typing import Any, AsyncIterator, Callable, Iterable, Optional
+from urllib.parse import parse_qsl
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class JsException(Exception):
+    """Mirror of ``pyodide.ffi.JsException``; ``str()`` is ``"<name>: <message>"``."""
+
+    def __init__(self, name: str, message: str = ""):
+        self.name = name
+        self.message = message
+        super().__init__(f"{name}: {message}")
+
+
+def type_error(message: str) -> JsException:
+    return JsException("TypeError", message)
+
+
+class _Constructor:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class JsProxy:
+    """Base for every stand-in JS value. ``js_name`` is ``value.constructor.name``."""
+
+    js_name = "Object"
+
+    @property
+    def constructor(self) -> _Constructor:
+        return _Constructor(self.js_name)
+
+    def to_py(self, *, depth: int = -1, default_converter: Optional[Callable] = None) -> Any:
+        return _to_py(self, default_converter)
+
+    def to_json(self) -> Any:
+        """What ``JSON.stringify`` would see for this value."""
+        return {}
+
+
+class JsObject(JsProxy):
+    """A plain JS object: attribute access, ``in`` and ``to_py() -> dict``."""
+
+    def __init__(self, fields: Optional[dict[str, Any]] = None, **kwargs: Any):
+        object.__setattr__(self, "_fields", {**(fields or {}), **kwargs})
+
+    def __getattr__(self, name: str) -> Any:
+        fields = object.__getattribute__(self, "_fields")
+        if name in fields:
+            return fields[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        self._fields[name] = value
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._fields
+
+    def __getitem__(self, name: str) -> Any:
+        return self._fields[name]
+
+    def __repr__(self) -> str:
+        return f"JsObject({self._fields!r})"
+
+    def to_json(self) -> Any:
+        return {k: to_json_value(v) for k, v in self._fields.items()}
+
+
+class JsArray(JsProxy):
+    js_name = "Array"
+
+    def __init__(self, items: Iterable[Any] = ()):
+        self._items = list(items)
+
+    @property
+    def length(self) -> int:
+        return len(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __getitem__(self, index: int) -> Any:
+        return self._items[index]
+
+    def __repr__(self) -> str:
+        return f"JsArray({self._items!r})"
+
+    def to_json(self) -> Any:
+        return [to_json_value(v) for v in self._items]
+
+
+class JsBuffer(JsProxy):
+    """ArrayBuffer / Uint8Array. ``to_py()`` gives a memoryview like Pyodide does."""
+
+    js_name = "Uint8Array"
+
+    def __init__(self, data: bytes):
+        self._data = bytes(data)
+
+    @property
+    def byteLength(self) -> int:
+        return len(self._data)
+
+    @property
+    def length(self) -> int:
+        return len(self._data)
+
+    def to_bytes(self) -> bytes:
+        return self._data
+
+    def to_py(self, *, depth: int = -1, default_converter: Optional[Callable] = None) -> Any:
+        return memoryview(self._data)
+
+
+class JsDate(JsProxy):
+    js_name = "Date"
+
+    def __init__(self, value: datetime):
+        self._value = value.astimezone(timezone.utc)
+
+    @classmethod
+    def now(cls) -> float:
+        return datetime.now(timezone.utc).timestamp() * 1000
+
+    def getTime(self) -> float:
+        return self._value.timestamp() * 1000
+
+    def toISOString(self) -> str:
+        return self._value.strftime("%Y-%m-%dT%H:%M:%S.") + f"{self._value.microsecond // 1000:03d}Z"
+
+    def toUTCString(self) -> str:
+        return format_datetime(self._value, usegmt=True)
+
+    toGMTString = toUTCString
+
+    def to_json(self) -> Any:
+        return self.toISOString()
+
+
+def _to_py(value: Any, default_converter: Optional[Callable]) -> Any:
+    def convert(inner: Any) -> Any:
+        return _to_py(inner, default_converter)
+
+    def cache(_js: Any, _py: Any) -> None:
+        return None
+
+    if isinstance(value, JsArray):
+        return [convert(item) for item in value]
+    if type(value) is JsObject:
+        return {k: convert(v) for k, v in value._fields.items()}
+    if isinstance(value, JsBuffer):
+        return value.to_py()
+    if isinstance(value, JsProxy):
+        if default_converter is not None:
+            return default_converter(value, convert, cache)
+        return value
+    return value
+
+
+def to_json_value(value: Any) -> Any:
+    if isinstance(value, JsProxy):
+        return value.to_json()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, dict):
+        return {k: to_json_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json_value(v) for v in value]
+    return value
+
+
+def to_js(
+    obj: Any,
+    *,
+    depth: int = -1,
+    pyproxies: Any = None,
+    create_pyproxies: bool = True,
+    dict_converter: Optional[Callable] = None,
+    default_converter: Optional[Callable] = None,
+) -> Any:
+    def convert(value: Any) -> Any:
+        if isinstance(value, dict):
+            entries = [(k, convert(v)) for k, v in value.items()]
+            if dict_converter is not None:
+                return dict_converter(entries)
+            return JsObject(dict(entries))
+        if isinstance(value, (list, tuple)):
+            return JsArray(convert(v) for v in value)
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return JsBuffer(bytes(value))
+        if default_converter is not None and not isinstance(
+            value, (JsProxy, str, int, float, bool, type(None))
+        ):
+            return default_converter(value, convert, lambda _py, _js: None)
+        return value
+
+    return convert(obj)
+
+
+def create_proxy(obj: Any, **_kwargs: Any) -> Any:
+    return obj
+
+
+def js_options(value: Any, *, what: str = "options") -> dict[str, Any]:
+    """Read an options bag the way a JS binding would.
+
+    A Python dict reaches JS as an opaque PyProxy whose fields the runtime
+    cannot see, so it is rejected here rather than silently ignored.
+    """
+    if value is None:
+        return {}
+    if isinstance(value, dict):
+        raise type_error(f"{what} must be a JS object; pass it through to_js()")
+    if isinstance(value, JsObject):
+        return dict(value._fields)
+    raise type_error(f"{what} must be an object")
+
+
+def js_bytes(value: Any, *, what: str = "value") -> bytes:
+    if isinstance(value, JsBuffer):
+        return value.to_bytes()
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    if value is None:
+        return b""
+    raise type_error(f"{what} must be a string, ArrayBuffer or ReadableStream; got {type(value).__name__}")
+
+
+def js_method(func: Callable) -> Callable:
+    """Fold keyword arguments into a trailing options object, as Pyodide does."""
+
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if kwargs:
+            args = (*args, JsObject(kwargs))
+        return func(*args)
+
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+# CONSOLE / OBJECT / JSON
+
+
+class _Console:
+    def __init__(self):
+        self.lines: list[str] = []
+
+    def _write(self, *args: Any) -> None:
+        self.lines.append(" ".join(str(a) for a in args))
+
+    log = info = warn = error = debug = _write
+
+
+console = _Console()
+
+
+class Object:
+    @staticmethod
+    def fromEntries(entries: Iterable[Any]) -> JsObject:
+        return JsObject({k: v for k, v in entries})
+
+    @staticmethod
+    def keys(obj: JsObject) -> JsArray:
+        return JsArray(obj._fields.keys())
+
+
+class JSON:
+    @staticmethod
+    def stringify(value: Any) -> str:
+        return json.dumps(to_json_value(value), separators=(",", ":"))
+
+    @staticmethod
+    def parse(text: str) -> Any:
+        return to_js(json.loads(text), dict_converter=Object.fromEntries)
+
+
+class Date(JsDate):
+    @classmethod
+    def new(cls, value: Any = None) -> JsDate:
+        if value is None:
+            return JsDate(datetime.now(timezone.utc))
+        return JsDate(datetime.fromtimestamp(float(value) / 1000, timezone.utc))
+
+
+# STREAMS
+
+
+class _ReadResult(JsObject):
+    pass
+
+
+class ReadableStreamDefaultReader(JsProxy):
+    js_name = "ReadableStreamDefaultReader"
+
+    def __init__(self, stream: "ReadableStream"):
+        self._iterator = stream._chunks()
+
+    async def read(self) -> JsObject:
+        try:
+            chunk = await self._iterator.__anext__()
+        except StopAsyncIteration:
+            return _ReadResult(done=True, value=None)
+        return _ReadResult(done=False, value=chunk)
+
+    def releaseLock(self) -> None:
+        return None
+
+
+class ReadableStream(JsProxy):
+    """A one-shot byte stream. ``expected_length`` is None for streams whose
+    size workerd cannot know up front (R2 refuses those on ``put``)."""
+
+    js_name = "ReadableStream"
+
+    def __init__(self, source: Any, expected_length: Optional[int] = None):
+        self._source = source
+        self.expected_length = expected_length
+        self.locked = False
+
+    @classmethod
+    def from_bytes(cls, data: bytes, chunk_size: int = STREAM_CHUNK_SIZE) -> "ReadableStream":
+        chunks = [data[i : i + chunk_size] for i in range(0, len(data), chunk_size)]
+        return cls(chunks, expected_length=len(data))
+
+    async def _chunks(self) -> AsyncIterator[JsBuffer]:
+        if self.locked:
+            raise type_error("This ReadableStream is currently locked to a reader.")
+        self.locked = True
+        source = self._source
+        if hasattr(source, "__aiter__"):
+            async for chunk in source:
+                yield chunk if isinstance(chunk, JsBuffer) else JsBuffer(chunk)
+        else:
+            for chunk in source:
+                yield chunk if isinstance(chunk, JsBuffer) else JsBuffer(chunk)
+
+    def __aiter__(self) -> AsyncIterator[JsBuffer]:
+        return self._chunks()
+
+    def getReader(self) -> ReadableStreamDefaultReader:
+        return ReadableStreamDefaultReader(self)
+
+    async def read_all(self) -> bytes:
+        """Emulator helper: drain the stream into bytes."""
+        return b"".join([chunk.to_bytes() async for chunk in self._chunks()])
+
+
+class WritableStreamDefaultWriter(JsProxy):
+    js_name = "WritableStreamDefaultWriter"
+
+    def __init__(self, stream: "FixedLengthStream"):
+        self._stream = stream
+
+    async def write(self, chunk: Any) -> None:
+        await self._stream._write(js_bytes(chunk, what="chunk"))
+
+    async def close(self) -> None:
+        await self._stream._close()
+
+    async def abort(self, reason: Any = None) -> None:
+        self._stream._abort(reason)
+
+    def releaseLock(self) -> None:
+        return None
+
+
+class WritableStream(JsProxy):
+    js_name = "WritableStream"
+
+    def __init__(self, stream: "FixedLengthStream"):
+        self._stream = stream
+
+    def getWriter(self) -> WritableStreamDefaultWriter:
+        return WritableStreamDefaultWriter(self._stream)
+
+
+class FixedLengthStream(JsProxy):
+    """An identity TransformStream whose readable half declares its length, so
+    R2 accepts it. A write waits until the reader has room for the chunk, as
+    workerd's backpressure does."""
+
+    js_name = "FixedLengthStream"
+
+    def __init__(self, length: int):
+        self.length = length
+        self._written = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self.readable = ReadableStream(self._drain(), expected_length=length)
+        self.writable = WritableStream(self)
+
+    @classmethod
+    @js_method
+    def new(cls, length: Any) -> "FixedLengthStream":
+        return cls(int(length))
+
+    async def _write(self, data: bytes) -> None:
+        self._written += len(data)
+        if self._written > self.length:
+            raise type_error("Attempt to write too many bytes through a FixedLengthStream.")
+        await self._queue.put(data)
+
+    async def _close(self) -> None:
+        if self._written != self.length:
+            raise type_error("FixedLengthStream did not see all expected bytes before close().")
+        await self._queue.put(None)
+
+    def _abort(self, reason: Any) -> None:
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(JsException("Error", str(reason)))
+
+    async def _drain(self) -> AsyncIterator[bytes]:
+        while (item := await self._queue.get()) is not None:
+            if isinstance(item, JsException):
+                raise item
+            yield item
+
+
+async def read_body(body: Any) -> bytes:
+    if isinstance(body, ReadableStream):
+        return await body.read_all()
+    return js_bytes(body, what="body")
+
+
+# HEADERS / FORMDATA
+
+
+class Headers(JsProxy):
+    js_name = "Headers"
+
+    def __init__(self, init: Any = None):
+        self._values: dict[str, tuple[str, str]] = {}
+        if init is None:
+            return
+        if isinstance(init, Headers):
+            pairs = list(init._values.values())
+        elif isinstance(init, JsObject):
+            pairs = list(init._fields.items())
+        elif isinstance(init, dict):
+            pairs = list(init.items())
+        else:
+            pairs = [tuple(pair) for pair in init]
+        for name, value in pairs:
+            self.append(name, value)
+
+    @classmethod
+    def new(cls, init: Any = None) -> "Headers":
+        return cls(init)
+
+    def get(self, name: str) -> Optional[str]:
+        entry = self._values.get(name.lower())
+        return entry[1] if entry else None
+
+    def has(self, name: str) -> bool:
+        return name.lower() in self._values
+
+    def set(self, name: str, value: Any) -> None:
+        self._values[name.lower()] = (name, str(value))
+
+    def append(self, name: str, value: Any) -> None:
+        existing = self.get(name)
+        self.set(name, f"{existing}, {value}" if existing is not None else value)
+
+    def delete(self, name: str) -> None:
+        self._values.pop(name.lower(), None)
+
+    def entries(self) -> Iterable[JsArray]:
+        return iter([JsArray([k, v]) for k, (_, v) in sorted(self._values.items())])
+
+    def keys(self) -> Iterable[str]:
+        return iter(sorted(self._values))
+
+    def __iter__(self):
+        return self.entries()
+
+    def __contains__(self, name: str) -> bool:
+        return self.has(name)
+
+    def __getitem__(self, name: str) -> Optional[str]:
+        return self.get(name)
+
+    def __repr__(self) -> str:
+        return f"Headers({dict((k, v) for k, (_, v) in self._values.items())!r})"
+
+    def to_json(self) -> Any:
+        return {}
+
+
+class Blob(JsProxy):
+    js_name = "Blob"
+
+    def __init__(self, data: bytes, type: str = ""):
+        self._data = data
+        self.type = type
+
+    @property
+    def size(self) -> int:
+        return len(self._data)
+
+    def stream(self) -> ReadableStream:
+        return ReadableStream.from_bytes(self._data)
+
+    async def arrayBuffer(self) -> JsBuffer:
+        return JsBuffer(self._data)
+
+    async def text(self) -> str:
+        return self._data.decode("utf-8")
+
+
+class File(Blob):
+    js_name = "File"
+
+    def __init__(self, data: bytes, name: str, type: str = ""):
+        super().__init__(data, type)
+        self.name = name
+        self.lastModified = JsDate.now()
+
+
+class FormData(JsProxy):
+    js_name = "FormData"
+
+    def __init__(self):
+        self._entries: list[tuple[str, Any]] = []
+
+    @classmethod
+    def new(cls) -> "FormData":
+        return cls()
+
+    def append(self, name: str, value: Any) -> None:
+        self._entries.append((name, value))
+
+    def get(self, name: str) -> Any:
+        return next((v for k, v in self._entries if k == name), None)
+
+    def has(self, name: str) -> bool:
+        return any(k == name for k, _ in self._entries)
+
+    def keys(self) -> Iterable[str]:
+        return iter([k for k, _ in self._entries])
+
+    def entries(self) -> Iterable[JsArray]:
+        return iter([JsArray([k, v]) for k, v in self._entries])
+
+
+def _content_type_params(content_type: str) -> tuple[str, dict[str, str]]:
+    mime, *rest = [part.strip() for part in content_type.split(";")]
+    params = {}
+    for item in rest:
+        if "=" in item:
+            key, value = item.split("=", 1)
+            params[key.strip().lower()] = value.strip().strip('"')
+    return mime.lower(), params
+
+
+def parse_form_data(body: bytes, content_type: Optional[str]) -> FormData:
+    mime, params = _content_type_params(content_type or "")
+    form = FormData()
+    if mime == "application/x-www-form-urlencoded":
+        for key, value in parse_qsl(body.decode("utf-8"), keep_blank_values=True):
+            form.append(key, value)
+        return form
+    if mime != "multipart/form-data" or "boundary" not in params:
+        raise type_error(
+            "Unrecognized Content-Type header value. FormData can only parse the following "
+            "MIME types: multipart/form-data, application/x-www-form-urlencoded."
+        )
+    delimiter = b"--" + params["boundary"].encode("latin-1")
+    for section in body.split(delimiter)[1:]:
+        if section.startswith(b"--"):
+            break
+        head, _, content = section.removeprefix(b"\r\n").partition(b"\r\n\r\n")
+        content = content.removesuffix(b"\r\n")
+        disposition: dict[str, str] = {}
+        part_type = ""
+        for line in head.decode("utf-8").split("\r\n"):
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "content-disposition":
+                disposition = _content_type_params(value)[1]
+            elif name.strip().lower() == "content-type":
+                part_type = value.strip()
+        if "filename" in disposition:
+            form.append(disposition["name"], File(content, disposition["filename"], part_type))
+        else:
+            form.append(disposition["name"], content.decode("utf-8"))
+    return form
+
+
+def encode_multipart(fields: dict[str, Any], files: dict[str, tuple[str, bytes, str]]) -> tuple[bytes, str]:
+    """Build a multipart/form-data body the way ``requests`` does: fields first, then files."""
+    boundary = "emulatorboundary7MA4YWxkTrZu0gW"
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for name, (filename, data, content_type) in files.items():
+        parts.append(
+            (
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                f"Content-Type: {content_type}\r\n\r\n"
+            ).encode()
+            + data
+            + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+# REQUEST / RESPONSE
+
+
+class _StaticOrInstance:
+    """JS lets ``Response.json(data)`` and ``response.json()`` share a name."""
+
+    def __init__(self, static: classmethod, instance: Callable):
+        self._static = static
+        self._instance = instance
+
+    def __get__(self, obj: Any, cls: type) -> Callable:
+        if obj is None:
+            return self._static.__get__(None, cls)
+        return self._instance.__get__(obj, cls)
+
+
+class _Body(JsProxy):
+    body: Optional[ReadableStream]
+
+    @property
+    def bodyUsed(self) -> bool:
+        return self.body is not None and self.body.locked
+
+    async def arrayBuffer(self) -> JsBuffer:
+        return JsBuffer(await self._read())
+
+    async def text(self) -> str:
+        return (await self._read()).decode("utf-8")
+
+    async def json(self) -> Any:
+        return JSON.parse(await self.text())
+
+    async def formData(self) -> FormData:
+        return parse_form_data(await self._read(), self.headers.get("content-type"))
+
+    async def _read(self) -> bytes:
+        if self.body is None:
+            return b""
+        if self.body.locked:
+            raise type_error("Body has already been used.")
+        return await self.body.read_all()
+
+
+def _body_stream(body: Any) -> Optional[ReadableStream]:
+    if body is None or isinstance(body, ReadableStream):
+        return body
+    return ReadableStream.from_bytes(js_bytes(body, what="body"))
+
+
+class Request(_Body):
+    js_name = "Request"
+
+    def __init__(self, url: str, method: str = "GET", headers: Any = None, body: Any = None):
+        self.url = url
+        self.method = method.upper()
+        self.headers = Headers(headers)
+        self.body = _body_stream(body)
+        self.redirect = "follow"
+        self.cf = JsObject()
+        if self.body is not None and self.body.expected_length is not None and not self.headers.has("content-length"):
+            self.headers.set("content-length", self.body.expected_length)
+
+    @classmethod
+    @js_method
+    def new(cls, url: str, init: Any = None) -> "Request":
+        options = js_options(init, what="RequestInit")
+        return cls(url, options.get("method", "GET"), options.get("headers"), options.get("body"))
+
+
+class Response(_Body):
+    js_name = "Response"
+
+    def __init__(self, body: Any = None, status: int = 200, headers: Any = None, statusText: str = ""):
+        self.body = _body_stream(body)
+        self.status = status
+        self.statusText = statusText
+        self.headers = Headers(headers)
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    @classmethod
+    @js_method
+    def new(cls, body: Any = None, init: Any = None) -> "Response":
+        options = js_options(init, what="ResponseInit")
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            raise type_error("Response body must be a string, ArrayBuffer or ReadableStream; pass bytes through to_js()")
+        return cls(body, options.get("status", 200), options.get("headers"), options.get("statusText", ""))
+
+    @classmethod
+    @js_method
+    def _static_json(cls, data: Any, init: Any = None) -> "Response":
+        options = js_options(init, what="ResponseInit")
+        response = cls(
+            json.dumps(to_json_value(data), separators=(",", ":")),
+            options.get("status", 200),
+            options.get("headers"),
+            options.get("statusText", ""),
+        )
+        if not response.headers.has("content-type"):
+            response.headers.set("content-type", "application/json")
+        return response
+
+    json = _StaticOrInstance(_static_json, _Body.json)
+
+    async def json_py(self) -> Any:
+        """Emulator helper: the body parsed as plain Python values."""
+        return json.loads(await self.text())
+
+
+# EXECUTION CONTEXT
+
+
+class ExecutionContext(JsProxy):
+    """The ``ctx`` passed to handlers. Promises given to ``waitUntil`` keep
+    running after the response; ``drain`` awaits them, as the runtime does
+    before it lets the isolate go."""
+
+    js_name = "ExecutionContext"
+
+    def __init__(self):
+        self.pending: list[asyncio.Future] = []
+
+    def waitUntil(self, promise: Any) -> None:
+        if not inspect.isawaitable(promise):
+            raise type_error("waitUntil() expects a Promise")
+        self.pending.append(asyncio.ensure_future(promise))
+
+    def passThroughOnException(self) -> None:
+        pass
+
+    async def drain(self) -> None:
+        while self.pending:
+            pending, self.pending = self.pending, []
+            await asyncio.gather(*pending)
+
+
+# INSTALLATION
+
+
+def install() -> None:
+    """Register the stand-ins as ``js`` and ``pyodide.ffi`` unless running under Pyodide."""
+    if "js" in sys.modules and not getattr(sys.modules["js"], "__emulated__", False):
+        return
+    js = types.ModuleType("js")
+    js.__emulated__ = True
+    for name, value in {
+        "Response": Response,
+        "Request": Request,
+        "Headers": Headers,
+        "ReadableStream": ReadableStream,
+        "FixedLengthStream": FixedLengthStream,
+        "FormData": FormData,
+        "Blob": Blob,
+        "File": File,
+        "Object": Object,
+        "JSON": JSON,
+        "Date": Date,
+        "console": console,
+    }.items():
+        setattr(js, name, value)
+    pyodide = types.ModuleType("pyodide")
+    ffi = types.ModuleType("pyodide.ffi")
+    ffi.JsException = JsException
+    ffi.JsProxy = JsProxy
+    ffi.to_js = to_js
+    ffi.create_proxy = create_proxy
+    ffi.create_once_callable = create_proxy
+    pyodide.ffi = ffi
+    sys.modules["js"] = js
+    sys.modules["pyodide"] = pyodide
+    sys.modules["pyodide.ffi"] = ffi
+
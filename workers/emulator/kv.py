@@ -0,0 +1,86 @@
+"""Workers KV namespace kept in a dict."""
+
+import json
+import time
+from typing import Any, Optional
+
+from .js_shim import JsArray, JsBuffer, JsObject, JsProxy, js_bytes, js_method, js_options, to_js, Object
+from .metrics import binding_work, round_trip
+
+
+class MemoryKV(JsProxy):
+    js_name = "KvNamespace"
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._data: dict[str, tuple[str | bytes, Optional[float], Any]] = {}
+
+    def _live(self, key: str) -> Optional[tuple[str | bytes, Optional[float], Any]]:
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del self._data[key]
+            return None
+        return entry
+
+    @js_method
+    async def get(self, key: str, options: Any = None) -> Any:
+        await round_trip("kv.get", self.latency)
+        with binding_work():
+            value_type = options if isinstance(options, str) else js_options(options).get("type", "text")
+            entry = self._live(key)
+            if entry is None:
+                return None
+            return self._decode(entry[0], value_type)
+
+    @js_method
+    async def getWithMetadata(self, key: str, options: Any = None) -> JsObject:
+        await round_trip("kv.getWithMetadata", self.latency)
+        with binding_work():
+            value_type = options if isinstance(options, str) else js_options(options).get("type", "text")
+            entry = self._live(key)
+            if entry is None:
+                return JsObject(value=None, metadata=None)
+            return JsObject(value=self._decode(entry[0], value_type), metadata=entry[2])
+
+    @staticmethod
+    def _decode(value: str | bytes, value_type: str) -> Any:
+        if value_type == "json":
+            return to_js(json.loads(value), dict_converter=Object.fromEntries)
+        if value_type == "arrayBuffer":
+            return JsBuffer(value if isinstance(value, bytes) else value.encode("utf-8"))
+        return value if isinstance(value, str) else value.decode("utf-8")
+
+    @js_method
+    async def put(self, key: str, value: Any, options: Any = None) -> None:
+        await round_trip("kv.put", self.latency)
+        with binding_work():
+            opts = js_options(options)
+            expires_at = None
+            if opts.get("expiration") is not None:
+                expires_at = float(opts["expiration"])
+            elif opts.get("expirationTtl") is not None:
+                expires_at = time.time() + float(opts["expirationTtl"])
+            stored = value if isinstance(value, str) else js_bytes(value)
+            self._data[key] = (stored, expires_at, opts.get("metadata"))
+
+    async def delete(self, key: str) -> None:
+        await round_trip("kv.delete", self.latency)
+        with binding_work():
+            self._data.pop(key, None)
+
+    @js_method
+    async def list(self, options: Any = None) -> JsObject:
+        await round_trip("kv.list", self.latency)
+        with binding_work():
+            opts = js_options(options)
+            prefix = opts.get("prefix") or ""
+            limit = int(opts.get("limit") or 1000)
+            start = opts.get("cursor") or ""
+            names = sorted(k for k in list(self._data) if k.startswith(prefix) and k > start and self._live(k))
+            page = names[:limit]
+            complete = len(names) <= limit
+            keys = [JsObject(name=name, expiration=self._data[name][1], metadata=self._data[name][2]) for name in page]
+            result = JsObject(keys=JsArray(keys), list_complete=complete)
+            if not complete:
+                result.cursor = page[-1]
+            return result
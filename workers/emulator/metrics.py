@@ -0,0 +1,132 @@
+"""Per-request accounting for the emulator.
+
+Every binding call is a simulated round trip: it is counted, optionally delayed
+by the binding's ``latency`` and the Python time spent emulating it (sqlite,
+disk) is booked separately so it can be subtracted from the worker's own CPU.
+"""
+
+import asyncio
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Iterator, Optional
+
+
+@dataclass
+class RequestMetrics:
+    calls: Counter = field(default_factory=Counter)
+    cpu: float = 0.0
+    binding_cpu: float = 0.0
+    wall: float = 0.0
+
+    @property
+    def worker_cpu(self) -> float:
+        """CPU spent in worker code, excluding time spent emulating bindings."""
+        return max(self.cpu - self.binding_cpu, 0.0)
+
+    @property
+    def round_trips(self) -> int:
+        return sum(self.calls.values())
+
+
+current_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar("current_metrics", default=None)
+
+
+async def round_trip(name: str, latency: float = 0.0) -> None:
+    """Record one remote call and yield to the event loop like real I/O would."""
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.calls[name] += 1
+    await asyncio.sleep(latency)
+
+
+@contextmanager
+def binding_work() -> Iterator[None]:
+    start = time.thread_time()
+    try:
+        yield
+    finally:
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.binding_cpu += time.thread_time() - start
+
+
+class _CpuMetered:
+    """Await a coroutine while timing each slice it runs on the event loop.
+
+    Other requests interleave between slices, so summing per-slice thread time
+    gives this request's CPU even under heavy concurrency.
+    """
+
+    def __init__(self, awaitable: Awaitable[Any], metrics: RequestMetrics):
+        self._awaitable = awaitable
+        self._metrics = metrics
+
+    def __await__(self):
+        generator = self._awaitable.__await__()
+        value: Any = None
+        error: Optional[BaseException] = None
+        while True:
+            start = time.thread_time()
+            try:
+                if error is not None:
+                    yielded = generator.throw(error)
+                else:
+                    yielded = generator.send(value)
+            except StopIteration as stop:
+                self._metrics.cpu += time.thread_time() - start
+                return stop.value
+            except BaseException:
+                self._metrics.cpu += time.thread_time() - start
+                raise
+            self._metrics.cpu += time.thread_time() - start
+            try:
+                value, error = (yield yielded), None
+            except BaseException as e:
+                value, error = None, e
+
+
+async def _metered(coro: Awaitable[Any], metrics: RequestMetrics) -> Any:
+    return await _CpuMetered(coro, metrics)
+
+
+def _install_task_factory(loop: asyncio.AbstractEventLoop) -> None:
+    """Meter tasks created while a request's metrics are bound.
+
+    Tasks copy the context, so ``asyncio.gather`` and ``create_task`` inside a
+    request run its work in children that ``measure`` never steps; their
+    slices are timed here instead, while their bindings still book
+    ``binding_cpu`` against the same request.
+    """
+    previous = loop.get_task_factory()
+    if getattr(previous, "metered", False):
+        return
+
+    def factory(loop, coro, **kwargs):
+        context = kwargs.get("context")
+        metrics = context.get(current_metrics) if context is not None else current_metrics.get()
+        if metrics is not None:
+            coro = _metered(coro, metrics)
+        if previous is not None:
+            return previous(loop, coro, **kwargs)
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    factory.metered = True
+    loop.set_task_factory(factory)
+
+
+async def measure(awaitable: Awaitable[Any]) -> tuple[Any, RequestMetrics]:
+    """Run ``awaitable`` with fresh metrics bound to the current context,
+    including any tasks it spawns."""
+    _install_task_factory(asyncio.get_running_loop())
+    metrics = RequestMetrics()
+    token = current_metrics.set(metrics)
+    start = time.perf_counter()
+    try:
+        result = await _CpuMetered(awaitable, metrics)
+    finally:
+        metrics.wall = time.perf_counter() - start
+        current_metrics.reset(token)
+    return result, metrics
@@ -0,0 +1,450 @@
+"""R2 bucket stored on the local filesystem.
+
+Each object is ``<root>/objects/<sha256(key)>`` plus a ``.json`` sidecar with
+its metadata; an in-memory sorted index of keys serves ``list``. Multipart
+parts are staged under ``<root>/multipart/<upload_id>/`` until ``complete``.
+"""
+
+import base64
+import bisect
+import hashlib
+import json
+import shutil
+import uuid
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Optional
+
+from .js_shim import (
+    Headers,
+    JsArray,
+    JsBuffer,
+    JsDate,
+    JsException,
+    JsObject,
+    JsProxy,
+    ReadableStream,
+    js_bytes,
+    js_method,
+    js_options,
+    to_json_value,
+    type_error,
+)
+from .metrics import binding_work, round_trip
+
+MAX_LIST_LIMIT = 1000
+MAX_DELETE_KEYS = 1000
+
+
+def _r2_error(message: str, code: int) -> JsException:
+    return JsException("Error", f"{message} ({code})")
+
+
+class R2Checksums(JsProxy):
+    js_name = "R2Checksums"
+
+    def __init__(self, md5: Optional[str]):
+        self.md5 = JsBuffer(bytes.fromhex(md5)) if md5 else None
+
+    def to_json(self) -> Any:
+        return {"md5": self.md5.to_bytes().hex()} if self.md5 else {}
+
+
+class HeadResult(JsProxy):
+    """R2Object as returned by ``head``/``list``/``put`` (no body)."""
+
+    js_name = "HeadResult"
+
+    def __init__(self, meta: dict[str, Any], range: Optional[dict[str, int]] = None, include_metadata: bool = True):
+        self.key = meta["key"]
+        self.version = meta["version"]
+        self.size = meta["size"]
+        self.etag = meta["etag"]
+        self.httpEtag = f'"{meta["etag"]}"'
+        self.uploaded = JsDate(datetime.fromtimestamp(meta["uploaded"], timezone.utc))
+        self.httpMetadata = JsObject(meta["httpMetadata"]) if include_metadata else None
+        self.customMetadata = JsObject(meta["customMetadata"]) if include_metadata else None
+        self.range = JsObject(range) if range is not None else None
+        self.checksums = R2Checksums(meta.get("md5"))
+        self.storageClass = "Standard"
+
+    def writeHttpMetadata(self, headers: Headers) -> None:
+        names = {
+            "contentType": "content-type",
+            "contentLanguage": "content-language",
+            "contentDisposition": "content-disposition",
+            "contentEncoding": "content-encoding",
+            "cacheControl": "cache-control",
+        }
+        for field, header in names.items():
+            value = getattr(self.httpMetadata, field, None) if self.httpMetadata is not None else None
+            if value:
+                headers.set(header, value)
+
+    def to_json(self) -> Any:
+        data = {
+            "storageClass": self.storageClass,
+            "key": self.key,
+            "version": self.version,
+            "size": self.size,
+            "etag": self.etag,
+            "httpEtag": self.httpEtag,
+            "uploaded": self.uploaded.toISOString(),
+            "checksums": self.checksums.to_json(),
+        }
+        if self.httpMetadata is not None:
+            data["httpMetadata"] = to_json_value(self.httpMetadata)
+        if self.customMetadata is not None:
+            data["customMetadata"] = to_json_value(self.customMetadata)
+        if self.range is not None:
+            data["range"] = to_json_value(self.range)
+        return data
+
+
+class GetResult(HeadResult):
+    """R2ObjectBody: an R2Object plus a one-shot body stream."""
+
+    js_name = "GetResult"
+
+    def __init__(self, meta: dict[str, Any], data: bytes, range: Optional[dict[str, int]] = None):
+        super().__init__(meta, range)
+        self.body = ReadableStream.from_bytes(data)
+
+    @property
+    def bodyUsed(self) -> bool:
+        return self.body.locked
+
+    async def arrayBuffer(self) -> JsBuffer:
+        return JsBuffer(await self.body.read_all())
+
+    async def text(self) -> str:
+        return (await self.body.read_all()).decode("utf-8")
+
+    async def json(self) -> Any:
+        return json.loads(await self.text())
+
+
+class R2MultipartUpload(JsProxy):
+    js_name = "R2MultipartUpload"
+
+    def __init__(self, bucket: "LocalR2Bucket", key: str, upload_id: str):
+        self.key = key
+        self.uploadId = upload_id
+        self._bucket = bucket
+
+    def to_json(self) -> Any:
+        return {"key": self.key, "uploadId": self.uploadId}
+
+    def _staging(self) -> Path:
+        staging = self._bucket.root / "multipart" / self.uploadId
+        manifest = staging / "upload.json"
+        if not manifest.exists() or json.loads(manifest.read_text())["key"] != self.key:
+            raise _r2_error("The specified multipart upload does not exist.", 10024)
+        return staging
+
+    async def uploadPart(self, partNumber: Any, value: Any) -> JsObject:
+        await round_trip("r2.uploadPart", self._bucket.latency)
+        data = await self._bucket._read_value(value)
+        with binding_work():
+            part_number = int(partNumber)
+            if part_number < 1 or part_number > 10000:
+                raise _r2_error("Part number must be between 1 and 10000.", 10034)
+            staging = self._staging()
+            (staging / f"{part_number}.part").write_bytes(data)
+            etag = hashlib.md5(data).hexdigest()
+            return JsObject(partNumber=part_number, etag=etag)
+
+    async def abort(self) -> None:
+        await round_trip("r2.abortMultipartUpload", self._bucket.latency)
+        with binding_work():
+            shutil.rmtree(self._staging())
+
+    async def complete(self, uploadedParts: Any) -> HeadResult:
+        await round_trip("r2.completeMultipartUpload", self._bucket.latency)
+        with binding_work():
+            if not isinstance(uploadedParts, JsArray):
+                raise type_error("uploadedParts must be an array; pass it through to_js()")
+            staging = self._staging()
+            manifest = json.loads((staging / "upload.json").read_text())
+            parts = sorted(uploadedParts, key=lambda p: int(p.partNumber))
+            chunks, digests = [], []
+            for part in parts:
+                path = staging / f"{int(part.partNumber)}.part"
+                if not path.exists():
+                    raise _r2_error("One or more of the specified parts could not be found.", 10025)
+                data = path.read_bytes()
+                if hashlib.md5(data).hexdigest() != part.etag:
+                    raise _r2_error("One or more of the specified parts could not be found.", 10025)
+                chunks.append(data)
+                digests.append(hashlib.md5(data).digest())
+            etag = f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(parts)}"
+            meta = self._bucket._store(
+                self.key, b"".join(chunks), manifest["httpMetadata"], manifest["customMetadata"], etag, md5=None
+            )
+            shutil.rmtree(staging)
+            return HeadResult(meta)
+
+
+class LocalR2Bucket(JsProxy):
+    """Filesystem-backed stand-in for the R2 bucket binding."""
+
+    js_name = "R2Bucket"
+
+    def __init__(self, root: str | Path, latency: float = 0.0):
+        self.root = Path(root)
+        self.latency = latency
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+        (self.root / "multipart").mkdir(parents=True, exist_ok=True)
+        self._index: dict[str, dict[str, Any]] = {}
+        for sidecar in (self.root / "objects").glob("*.json"):
+            meta = json.loads(sidecar.read_text())
+            self._index[meta["key"]] = meta
+        self._keys = sorted(self._index)
+
+    # storage helpers
+
+    def _path(self, key: str) -> Path:
+        return self.root / "objects" / hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _store(
+        self,
+        key: str,
+        data: bytes,
+        http_metadata: dict[str, Any],
+        custom_metadata: dict[str, Any],
+        etag: str,
+        md5: Optional[str],
+    ) -> dict[str, Any]:
+        meta = {
+            "key": key,
+            "version": uuid.uuid4().hex,
+            "size": len(data),
+            "etag": etag,
+            "md5": md5,
+            "uploaded": datetime.now(timezone.utc).timestamp(),
+            "httpMetadata": http_metadata,
+            "customMetadata": custom_metadata,
+        }
+        path = self._path(key)
+        path.write_bytes(data)
+        path.with_suffix(".json").write_text(json.dumps(meta))
+        if key not in self._index:
+            bisect.insort(self._keys, key)
+        self._index[key] = meta
+        return meta
+
+    def _remove(self, key: str) -> None:
+        if self._index.pop(key, None) is None:
+            return
+        self._keys.pop(bisect.bisect_left(self._keys, key))
+        path = self._path(key)
+        path.unlink(missing_ok=True)
+        path.with_suffix(".json").unlink(missing_ok=True)
+
+    async def _read_value(self, value: Any) -> bytes:
+        if isinstance(value, ReadableStream):
+            if value.expected_length is None:
+                raise type_error(
+                    "Provided readable stream must have a known length (request/response body or "
+                    "readable half of FixedLengthStream)"
+                )
+            data = await value.read_all()
+            if len(data) != value.expected_length:
+                raise type_error("ReadableStream did not produce the expected number of bytes")
+            return data
+        return js_bytes(value)
+
+    @staticmethod
+    def _metadata(value: Any) -> dict[str, Any]:
+        if value is None:
+            return {}
+        if isinstance(value, Headers):
+            names = {
+                "content-type": "contentType",
+                "content-language": "contentLanguage",
+                "content-disposition": "contentDisposition",
+                "content-encoding": "contentEncoding",
+                "cache-control": "cacheControl",
+            }
+            return {field: value.get(header) for header, field in names.items() if value.has(header)}
+        return js_options(value, what="metadata")
+
+    @staticmethod
+    def _conditional_holds(meta: dict[str, Any], only_if: Any) -> bool:
+        if only_if is None:
+            return True
+        if isinstance(only_if, Headers):
+            conditions = {
+                "etagMatches": only_if.get("if-match"),
+                "etagDoesNotMatch": only_if.get("if-none-match"),
+                "uploadedAfter": only_if.get("if-modified-since"),
+                "uploadedBefore": only_if.get("if-unmodified-since"),
+            }
+        else:
+            conditions = js_options(only_if, what="onlyIf")
+        uploaded = int(meta["uploaded"])
+
+        def etags(value: str) -> set[str]:
+            return {tag.strip().removeprefix("W/").strip('"') for tag in str(value).split(",")}
+
+        def seconds(value: Any) -> float:
+            if isinstance(value, JsDate):
+                return value.getTime() / 1000
+            return parsedate_to_datetime(str(value)).timestamp()
+
+        if conditions.get("etagMatches") and not etags(conditions["etagMatches"]) & {meta["etag"], "*"}:
+            return False
+        if conditions.get("etagDoesNotMatch") and etags(conditions["etagDoesNotMatch"]) & {meta["etag"], "*"}:
+            return False
+        if conditions.get("uploadedAfter") and not uploaded > seconds(conditions["uploadedAfter"]):
+            # If-Modified-Since is ignored when If-None-Match is present
+            if not (isinstance(only_if, Headers) and conditions.get("etagDoesNotMatch")):
+                return False
+        if conditions.get("uploadedBefore") and not uploaded < seconds(conditions["uploadedBefore"]):
+            return False
+        return True
+
+    @staticmethod
+    def _resolve_range(size: int, range_option: Any) -> Optional[dict[str, int]]:
+        if range_option is None:
+            return None
+        if isinstance(range_option, Headers):
+            header = range_option.get("range")
+            if not header:
+                return None
+            unit, _, spec = header.partition("=")
+            start, _, end = spec.split(",")[0].strip().partition("-")
+            if unit.strip() != "bytes":
+                return None
+            if start == "":
+                range_option = JsObject(suffix=int(end))
+            elif end == "":
+                range_option = JsObject(offset=int(start))
+            else:
+                range_option = JsObject(offset=int(start), length=int(end) - int(start) + 1)
+        opts = js_options(range_option, what="range")
+        if "suffix" in opts:
+            length = min(int(opts["suffix"]), size)
+            return {"offset": size - length, "length": length}
+        offset = int(opts.get("offset") or 0)
+        if offset > size or (offset == size and size > 0):
+            raise _r2_error("get: The requested range is not satisfiable", 10039)
+        length = int(opts["length"]) if opts.get("length") is not None else size - offset
+        return {"offset": offset, "length": min(length, size - offset)}
+
+    # binding API
+
+    async def head(self, key: str) -> Optional[HeadResult]:
+        await round_trip("r2.head", self.latency)
+        with binding_work():
+            meta = self._index.get(key)
+            return HeadResult(meta) if meta else None
+
+    @js_method
+    async def get(self, key: str, options: Any = None) -> Optional[HeadResult]:
+        await round_trip("r2.get", self.latency)
+        with binding_work():
+            opts = js_options(options)
+            meta = self._index.get(key)
+            if meta is None:
+                return None
+            if not self._conditional_holds(meta, opts.get("onlyIf")):
+                return HeadResult(meta)
+            resolved = self._resolve_range(meta["size"], opts.get("range"))
+            data = self._path(key).read_bytes()
+            if resolved is not None:
+                data = data[resolved["offset"] : resolved["offset"] + resolved["length"]]
+            return GetResult(meta, data, resolved)
+
+    @js_method
+    async def put(self, key: str, value: Any, options: Any = None) -> Optional[HeadResult]:
+        await round_trip("r2.put", self.latency)
+        data = await self._read_value(value)
+        with binding_work():
+            opts = js_options(options)
+            existing = self._index.get(key)
+            if opts.get("onlyIf") is not None and existing and not self._conditional_holds(existing, opts["onlyIf"]):
+                return None
+            md5 = hashlib.md5(data).hexdigest()
+            if opts.get("md5") and str(opts["md5"]) != md5:
+                raise _r2_error("put: The Content-MD5 you specified did not match what was received.", 10037)
+            meta = self._store(
+                key, data, self._metadata(opts.get("httpMetadata")), self._metadata(opts.get("customMetadata")), md5, md5
+            )
+            return HeadResult(meta)
+
+    async def delete(self, keys: Any) -> None:
+        await round_trip("r2.delete", self.latency)
+        with binding_work():
+            if isinstance(keys, str):
+                keys = [keys]
+            elif not isinstance(keys, JsArray):
+                raise type_error("keys must be a string or an array; pass lists through to_js()")
+            if len(keys) > MAX_DELETE_KEYS:
+                raise _r2_error(f"delete: You can only delete up to {MAX_DELETE_KEYS} keys at once.", 10041)
+            for key in keys:
+                self._remove(key)
+
+    @js_method
+    async def list(self, options: Any = None) -> JsObject:
+        await round_trip("r2.list", self.latency)
+        with binding_work():
+            opts = js_options(options)
+            limit = int(opts.get("limit") or MAX_LIST_LIMIT)
+            if limit < 1 or limit > MAX_LIST_LIMIT:
+                raise _r2_error("list: MaxKeys params must be positive integer <= 1000.", 10022)
+            prefix = opts.get("prefix") or ""
+            delimiter = opts.get("delimiter")
+            include = set(opts.get("include") or [])
+            start = bisect.bisect_left(self._keys, prefix)
+            if opts.get("cursor"):
+                after = base64.urlsafe_b64decode(opts["cursor"].encode()).decode("utf-8")
+                start = max(start, bisect.bisect_right(self._keys, after))
+            if opts.get("startAfter"):
+                start = max(start, bisect.bisect_right(self._keys, opts["startAfter"]))
+            objects: list[HeadResult] = []
+            prefixes: list[str] = []
+            last_key = None
+            truncated = False
+            for index in range(start, len(self._keys)):
+                key = self._keys[index]
+                if not key.startswith(prefix):
+                    break
+                if len(objects) + len(prefixes) >= limit:
+                    truncated = True
+                    break
+                last_key = key
+                if delimiter and delimiter in key[len(prefix) :]:
+                    common = key[: len(prefix) + key[len(prefix) :].index(delimiter) + len(delimiter)]
+                    if common not in prefixes:
+                        prefixes.append(common)
+                    continue
+                objects.append(
+                    HeadResult(
+                        self._index[key], include_metadata=bool(include & {"httpMetadata", "customMetadata"})
+                    )
+                )
+            result = JsObject(objects=JsArray(objects), truncated=truncated, delimitedPrefixes=JsArray(prefixes))
+            if truncated and last_key is not None:
+                result.cursor = base64.urlsafe_b64encode(last_key.encode("utf-8")).decode()
+            return result
+
+    @js_method
+    async def createMultipartUpload(self, key: str, options: Any = None) -> R2MultipartUpload:
+        await round_trip("r2.createMultipartUpload", self.latency)
+        with binding_work():
+            opts = js_options(options)
+            upload_id = uuid.uuid4().hex
+            staging = self.root / "multipart" / upload_id
+            staging.mkdir(parents=True)
+            manifest = {
+                "key": key,
+                "httpMetadata": self._metadata(opts.get("httpMetadata")),
+                "customMetadata": self._metadata(opts.get("customMetadata")),
+            }
+            (staging / "upload.json").write_text(json.dumps(manifest))
+            return R2MultipartUpload(self, key, upload_id)
+
+    def resumeMultipartUpload(self, key: str, uploadId: str) -> R2MultipartUpload:
+        return R2MultipartUpload(self, key, uploadId)
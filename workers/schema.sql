@@ -0,0 +1,66 @@
+-- D1 schema used by src/db_ops.py. Apply with:
+--   wrangler d1 execute <database_name> --file=schema.sql
+-- The local emulator (emulator/d1.py) loads this file into sqlite3.
+
+CREATE TABLE IF NOT EXISTS employees (
+    id TEXT NOT NULL,
+    company_id TEXT NOT NULL,
+    permission_level INTEGER NOT NULL,
+    PRIMARY KEY (id, company_id)
+);
+
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    employee_id TEXT NOT NULL,
+    company_id TEXT NOT NULL,
+    visibility TEXT NOT NULL CHECK (visibility IN ('PUBLIC', 'INTERNAL', 'PRIVATE'))
+);
+
+-- Uses of signed URLs minted with max_uses; expires_at is the token's expiry
+-- (unix seconds), after which the row can be dropped.
+CREATE TABLE IF NOT EXISTS signed_url_uses (
+    token_id TEXT PRIMARY KEY,
+    uses INTEGER NOT NULL,
+    expires_at INTEGER NOT NULL
+);
+
+-- Multipart uploads in progress and the parts stored so far, so a client
+-- can resume after a failure (GET /files/uploads/<upload_id>). created_at is
+-- unix seconds. Both are cleared when the upload is completed.
+CREATE TABLE IF NOT EXISTS uploads (
+    upload_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    employee_id TEXT NOT NULL,
+    company_id TEXT NOT NULL,
+    visibility TEXT NOT NULL CHECK (visibility IN ('PUBLIC', 'INTERNAL', 'PRIVATE')),
+    created_at INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS upload_parts (
+    upload_id TEXT NOT NULL,
+    part_number INTEGER NOT NULL,
+    etag TEXT NOT NULL,
+    PRIMARY KEY (upload_id, part_number)
+);
+
+-- Scheduled garbage collection (api_entry.collect_garbage). gc_state keeps
+-- the reconciliation cursor between runs; gc_orphans holds files rows seen
+-- without an R2 object, which are dropped once still missing after a grace
+-- period (seen_at is unix seconds).
+CREATE TABLE IF NOT EXISTS gc_state (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS gc_orphans (
+    name TEXT PRIMARY KEY,
+    seen_at INTEGER NOT NULL
+);
+
+-- Keyset listing (db_ops.list_visible_files) walks one index per
+-- visibility rule in name order.
+CREATE INDEX IF NOT EXISTS files_visibility_name ON files (visibility, name);
+CREATE INDEX IF NOT EXISTS files_company_visibility_name ON files (company_id, visibility, name);
+CREATE INDEX IF NOT EXISTS files_company_employee_visibility_name ON files (company_id, employee_id, visibility, name);
+CREATE INDEX IF NOT EXISTS uploads_created_at ON uploads (created_at);
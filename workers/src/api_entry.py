@@ -1,17 +1,27 @@
 # type: ignore
-from js import Response, console, ReadableStream, Object, Headers
-from base64 import b64encode
-from jwt import decode_jwt
+from js import Response, console, ReadableStream, Object, Headers, FixedLengthStream
+from base64 import b64decode, b64encode, urlsafe_b64encode
+from jwt import decode_jwt, encode_signed_token, decode_signed_token, UPLOAD_TOKEN_CONTEXT
+from multipart import FilePart, MultipartError, MultipartReader, multipart_boundary
+from responses import (
+    cors_headers,
+    download_headers,
+    empty_response,
+    error_response,
+    json_response,
+    json_text_response,
+    preflight_response,
+)
 from cf_types import (
     Method,
     Env,
+    ExecutionContext,
     WorkerRequestType,
     JwtPayload,
     D1Database,
     R2ListOptions,
     FileCreate,
     FileCreatePart,
-    FileId,
     R2Object,
     R2ObjectBody,
     R2Bucket,
@@ -20,21 +30,47 @@ from cf_types import (
     Visibility,
     R2MultipartUpload,
     FileAccess,
+    PermissionLevel,
 )
 from db_ops import (
     check_and_insert_employee,
     insert_file_access,
+    remove_file_access,
     check_file_access,
     get_employee,
+    get_file_visibility,
+    record_signed_url_use,
     check_multiple_file_access,
+    get_multiple_file_visibilities,
+    get_deletable_file_names,
+    remove_file_accesses,
+    record_upload,
+    record_upload_part,
+    get_upload,
+    forget_uploads,
+    list_stale_uploads,
+    prune_expired_rows,
+    list_file_names,
+    get_gc_cursor,
+    set_gc_cursor,
+    mark_orphan_candidates,
+    list_orphan_candidates,
+    remove_orphans,
+    list_unprefixed_file_names,
+    list_unprefixed_files,
+    get_unmigrated_file_visibility,
+    list_visible_files,
+    rename_file_accesses,
 )
-from typing import Optional, Any
+from typing import Optional, Any, AsyncIterator, Awaitable, NamedTuple
+from collections import OrderedDict
 from enum import Enum
-from datetime import datetime
 from dataclasses import field, dataclass, asdict
 from pyodide.ffi import JsException, to_js as _to_js
-from urllib.parse import urlparse, parse_qs, unquote
+from urllib.parse import urlparse, parse_qs, quote, unquote
+import asyncio
 import json
+import re
 import uuid
 import time
 
@@ -48,109 +84,456 @@ def to_js(obj):
     return _to_js(obj, dict_converter=Object.fromEntries)
 
 
-def get_body(value, convert, cache):
-    if value.constructor.name == "GetResult":
-        return value.body
+# Tasks deferred without an execution context, kept so they are not
+# garbage collected before they finish.
+_detached_tasks: set[asyncio.Task] = set()
+
+
+async def _run_deferred(awaitable: Awaitable[Any]):
+    try:
+        await awaitable
+    except Exception as e:
+        print(f"Deferred task failed: {e}")
+
+
+def defer(ctx: ExecutionContext | None, awaitable: Awaitable[Any]):
+    """Run work the response doesn't depend on after it has been sent. It
+    starts now; ``ctx.waitUntil`` keeps the isolate alive until it is done."""
+    task = asyncio.ensure_future(_run_deferred(awaitable))
+    if ctx is not None:
+        ctx.waitUntil(task)
     else:
-        pass
+        _detached_tasks.add(task)
+        task.add_done_callback(_detached_tasks.discard)
+
+
+async def log_request_headers(request: WorkerRequestType):
+    print(request.headers)
+
+
+SIGNED_URL_TTL = 300
+MAX_SIGNED_URL_TTL = 7 * 24 * 60 * 60
+MAX_SIGNED_URL_USES = 1000
+
+
+def signed_url_mode(env: Env) -> str:
+    """``SIGNED_URL_MODE``: "kv" (default) for strictly single-use tokens
+    stored in KV, "hmac" for stateless tokens checked without any KV or D1
+    call."""
+    return getattr(env, "SIGNED_URL_MODE", None) or "kv"
+
+
+@dataclass
+class SignedUrlOptions:
+    single_use: bool = False
+    max_uses: Optional[int] = None
+    expires_in: int = SIGNED_URL_TTL
+
+    def __post_init__(self):
+        if self.max_uses is not None and not 1 <= self.max_uses <= MAX_SIGNED_URL_USES:
+            raise ValueError(f"max_uses must be between 1 and {MAX_SIGNED_URL_USES}")
+        if not 1 <= self.expires_in <= MAX_SIGNED_URL_TTL:
+            raise ValueError(f"expires_in must be between 1 and {MAX_SIGNED_URL_TTL} seconds")
+        if self.single_use and self.max_uses is not None:
+            raise ValueError("single_use and max_uses cannot be combined")
+
+    @classmethod
+    def from_params(cls, params: dict[str, Any]) -> "SignedUrlOptions":
+        try:
+            max_uses = int(params["max_uses"]) if params.get("max_uses") is not None else None
+            expires_in = int(params.get("expires_in") or SIGNED_URL_TTL)
+        except (TypeError, ValueError):
+            raise ValueError("max_uses and expires_in must be integers")
+        single_use = str(params.get("single_use", "")).lower() in ("1", "true")
+        return cls(single_use=single_use, max_uses=max_uses, expires_in=expires_in)
+
+
+def generate_hmac_signed_url_token(
+    env: Env,
+    file_key,
+    employee_id,
+    company_id,
+    visibility,
+    expiration_seconds=SIGNED_URL_TTL,
+    max_uses: int | None = None,
+) -> str:
+    payload = {
+        "k": file_key,
+        "e": int(time.time()) + expiration_seconds,
+        "i": employee_id,
+        "c": company_id,
+        "v": visibility,
+    }
+    if max_uses is not None:
+        # uses are counted in D1 under this id
+        payload["m"] = max_uses
+        payload["n"] = uuid.uuid4().hex
+    return encode_signed_token(payload, env.SECRET)
+
+
+async def validate_hmac_signed_url(env: Env, token, file_key: str):
+    """Check an HMAC token's signature, expiry and key in memory. Counted
+    tokens then take one atomic D1 increment; the rest may be reused until
+    they expire."""
+    payload = decode_signed_token(token, env.SECRET)
+    if int(time.time()) > payload["e"]:
+        return None
+    check_signed_key(env, payload["k"], payload["c"], file_key)
+    if "m" in payload and not await record_signed_url_use(env.DB, payload["n"], payload["m"], payload["e"]):
+        print("Token use limit reached")
+        return None
+    employee = Employee(id=payload["i"], company_id=payload["c"], permission_level=PermissionLevel.READ)
+    return payload["k"], employee
 
 
 async def generate_signed_url_token(
-    env: Env, file_key, employee_id, company_id, expiration_seconds=300
+    env: Env, file_key, employee_id, company_id, expiration_seconds=SIGNED_URL_TTL
 ):
     token = str(uuid.uuid4())
     expiration = int(time.time()) + expiration_seconds
     value = f"{expiration}|{file_key}|{employee_id}|{company_id}"
     await env.SIGNED_URL_KEYS.put(token, value)
-    test_get = await env.SIGNED_URL_KEYS.get(token)
-    if not test_get:
-        raise ValueError("Failed to generate signed URL token")
     return token
 
 
-async def validate_signed_url(env: Env, token):
+def issues_kv_tokens(env: Env, options: SignedUrlOptions) -> bool:
+    return options.max_uses is None and (signed_url_mode(env) != "hmac" or options.single_use)
+
+
+async def issue_signed_url_token(
+    env: Env, file_key: str, employee: Employee, visibility: str, options: SignedUrlOptions
+) -> str:
+    """A counted HMAC token when ``max_uses`` is set, otherwise the token kind
+    picked by SIGNED_URL_MODE (``single_use`` forces KV)."""
+    if issues_kv_tokens(env, options):
+        return await generate_signed_url_token(
+            env, file_key, employee_id=employee.id, company_id=employee.company_id, expiration_seconds=options.expires_in
+        )
+    return generate_hmac_signed_url_token(
+        env, file_key, employee.id, employee.company_id, visibility, options.expires_in, options.max_uses
+    )
+
+
+# Lifetime of the token returned when a multipart upload is started. Long
+# enough for a few GB over a slow link; the upload itself lives in R2 for
+# seven days.
+UPLOAD_SESSION_TTL = 6 * 60 * 60
+
+
+@dataclass
+class UploadSession:
+    key: str
+    upload_id: str
+    employee: Employee
+    visibility: str
+
+
+def generate_upload_session_token(
+    env: Env, key: str, upload_id: str, employee: Employee, visibility: str, expiration_seconds=UPLOAD_SESSION_TTL
+) -> str:
+    payload = {
+        "k": key,
+        "u": upload_id,
+        "i": employee.id,
+        "c": employee.company_id,
+        "p": int(employee.permission_level),
+        "v": visibility,
+        "e": int(time.time()) + expiration_seconds,
+    }
+    return encode_signed_token(payload, env.SECRET, UPLOAD_TOKEN_CONTEXT)
+
+
+def validate_upload_session_token(env: Env, token: str) -> UploadSession:
+    """The session an ``X-Upload-Token`` was issued for, checked in memory;
+    parts uploaded with it need neither the JWT nor D1."""
+    payload = decode_signed_token(token, env.SECRET, UPLOAD_TOKEN_CONTEXT)
+    if int(time.time()) > payload["e"]:
+        raise ValueError("Upload token expired")
+    employee = Employee(id=payload["i"], company_id=payload["c"], permission_level=payload["p"])
+    return UploadSession(key=payload["k"], upload_id=payload["u"], employee=employee, visibility=payload["v"])
+
+
+def check_upload_session(session: UploadSession | None, key: str, upload_id: str | None):
+    """Upload tokens only cover parts of the upload they were issued for."""
+    if session is not None and (session.key != key or session.upload_id != upload_id):
+        raise PermissionError("Upload token does not cover this upload")
+
+
+# Keys per POST /download/tokens. They reach D1 as one JSON parameter, so the
+# access check stays a single query up to a full R2 list page.
+MAX_SIGNED_URL_BATCH = 1000
+# Each KV token is one put, and an invocation may make at most 1000 KV
+# operations, so KV batches are capped well below that.
+MAX_KV_SIGNED_URL_BATCH = 400
+
+
+def parse_signed_url_keys(body: Any, limit: int = MAX_SIGNED_URL_BATCH) -> list[str]:
+    if not isinstance(body, list) or not all(isinstance(key, str) and key for key in body):
+        raise ValueError("Body must be a JSON list of file keys")
+    if not 1 <= len(body) <= limit:
+        raise ValueError(f"Between 1 and {limit} keys are required")
+    return list(dict.fromkeys(body))
+
+
+async def issue_signed_urls(
+    env: Env, origin: str, keys: list[str], employee: Employee, prefix: str, options: SignedUrlOptions
+) -> dict[str, Any]:
+    """Signed download URLs for each of ``keys`` the employee may read.
+
+    Access to every key is decided by one D1 query; the tokens are then issued
+    concurrently. Missing and unreadable keys are listed in ``denied``.
+    """
+    visibilities = await get_multiple_file_visibilities(env.DB, [prefix + key for key in keys], employee)
+    allowed = [key for key in keys if prefix + key in visibilities]
+    tokens = await asyncio.gather(
+        *(
+            issue_signed_url_token(env, prefix + key, employee, visibilities[prefix + key], options)
+            for key in allowed
+        )
+    )
+    urls = {key: f"{origin}/download/{quote(key)}?token={quote(token)}" for key, token in zip(allowed, tokens)}
+    return {"urls": urls, "denied": [key for key in keys if key not in urls]}
+
+
+def check_signed_key(env: Env, signed_key: str, company_id: str, file_key: str):
+    """A token only covers the key it was issued for. Checked before a use is
+    counted or a KV token deleted, so requests for other keys cannot spend it.
+    Tokens for files not yet moved under the company prefix carry the old
+    name."""
+    if signed_key not in (company_key_prefix(env, company_id) + file_key, file_key):
+        raise FileNotFoundError("Invalid or expired token")
+
+
+async def validate_signed_url(env: Env, token, file_key: str, ctx: ExecutionContext | None = None):
+    """The signed key and employee of a token for ``file_key``, or None when it
+    is invalid, expired or used up."""
+    # KV tokens are uuid4s, HMAC tokens are payload.signature
+    if "." in token:
+        return await validate_hmac_signed_url(env, token, file_key)
     value = await env.SIGNED_URL_KEYS.get(token)
     if not value:
         return None
 
-    expiration, file_key, employee_id, company_id = value.split("|", 3)
-    employee = await get_employee(env.DB, employee_id, company_id)
+    expiration, signed_key, employee_id, company_id = value.split("|", 3)
+    check_signed_key(env, signed_key, company_id, file_key)
+    # the token is spent either way; its delete needn't delay the response
+    defer(ctx, env.SIGNED_URL_KEYS.delete(token))
     if int(time.time()) > int(expiration):
         print("Token expired")
-        await env.SIGNED_URL_KEYS.delete(token)
         return None
+    employee = await get_employee(env.DB, employee_id, company_id)
+    return signed_key, employee
 
-    await env.SIGNED_URL_KEYS.delete(token)
-    return file_key, employee
-
-
-def r2object_converter(value, convert, cache):
-    if value.constructor.name == "HeadResult":
-        customMetadata = {}
-        httpEtag = ""
-        httpMetadata = {}
-        if value.customMetadata:
-            customMetadata = value.customMetadata.to_py()
-        if value.httpEtag:
-            httpEtag = value.httpEtag
-        if value.httpMetadata:
-            httpMetadata = value.httpMetadata.to_py()
-        if value.checksums.md5:
-            checksum = value.checksums.md5.to_bytes().hex()
-        else:
-            checksum = ""
-        r2_object = R2Object(
-            storageClass=value.storageClass,
-            key=value.key,
-            etag=value.etag,
-            size=value.size,
-            uploaded=value.uploaded.toGMTString(),
-            checksums={"md5": checksum},
-            httpEtag=httpEtag,
-            customMetadata=customMetadata,
-            httpMetadata=httpMetadata,
-            version=value.version,
-            range=value.range,
-        )
-        return r2_object
-    return value
+
+def _js_mapping(value) -> dict[str, Any]:
+    """httpMetadata or customMetadata, ready for json.dumps (a cacheExpiry
+    Date becomes its ISO string, as JSON.stringify would write it)."""
+    if not value:
+        return {}
+    return {
+        name: item.toISOString() if hasattr(item, "toISOString") else item
+        for name, item in value.to_py(depth=1).items()
+    }
+
+
+def _range(obj) -> dict[str, int] | None:
+    value = getattr(obj, "range", None)
+    return value.to_py() if value else None
+
+
+def _md5_hex(obj) -> str:
+    md5 = obj.checksums.md5
+    return md5.to_bytes().hex() if md5 else ""
+
+
+# How each R2 object field is read off the JS object, in the order responses
+# list them. Only the requested fields are read, so e.g. ?fields=key,size
+# never touches the metadata maps or the checksum buffer.
+OBJECT_FIELDS = {
+    "key": lambda obj: obj.key,
+    "version": lambda obj: obj.version,
+    "size": lambda obj: obj.size,
+    "etag": lambda obj: obj.etag,
+    "httpEtag": lambda obj: obj.httpEtag or "",
+    "uploaded": lambda obj: obj.uploaded.toGMTString(),
+    "httpMetadata": lambda obj: _js_mapping(getattr(obj, "httpMetadata", None)),
+    "customMetadata": lambda obj: _js_mapping(getattr(obj, "customMetadata", None)),
+    "range": _range,
+    "checksums": lambda obj: {"md5": _md5_hex(obj)},
+    "storageClass": lambda obj: obj.storageClass,
+}
+# Fields only returned by R2 list calls that ask for them with ``include``.
+LIST_INCLUDE_FIELDS = ("httpMetadata", "customMetadata")
+INDEX_FIELDS = ("key", "visibility")
+
+
+def parse_fields(value: str | None, allowed) -> tuple[str, ...] | None:
+    """The field names of ``?fields=key,size,...``, or None for every field."""
+    if value is None:
+        return None
+    fields = tuple(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+    unknown = [name for name in fields if name not in allowed]
+    if not fields or unknown:
+        raise ValueError(f"fields must be a comma-separated subset of {', '.join(allowed)}")
+    return fields
+
+
+def object_serializer(fields: tuple[str, ...] | None = None, prefix: str = ""):
+    """A function turning an R2 object (the JS proxy) into a dict of plain
+    values with just ``fields``, read straight off the proxy."""
+    readers = [(name, OBJECT_FIELDS[name]) for name in (fields or OBJECT_FIELDS)]
+
+    def serialize(obj) -> dict[str, Any]:
+        data = {name: read(obj) for name, read in readers}
+        if prefix and "key" in data:
+            data["key"] = data["key"].removeprefix(prefix)
+        return data
+
+    return serialize
+
+
+def list_include(fields: tuple[str, ...] | None) -> dict[str, Any]:
+    """``include`` for bucket.list, when the projection asks for metadata."""
+    include = [name for name in LIST_INCLUDE_FIELDS if fields is not None and name in fields]
+    return {"include": to_js(include)} if include else {}
+
+
+def key_prefix(env: Env, employee: Employee) -> str:
+    """Where the employee's keys live in R2 and D1.
+
+    With ``KEY_PREFIX_MODE = "company"`` every company gets its own
+    ``<company_id>/`` namespace, so listing scans only the caller's objects.
+    Otherwise keys are stored exactly as the client sent them.
+    """
+    return company_key_prefix(env, employee.company_id)
+
+
+def company_key_prefix(env: Env, company_id: str) -> str:
+    if getattr(env, "KEY_PREFIX_MODE", None) == "company":
+        return f"{company_id}/"
+    return ""
 
 
-class File:
-    lastModified: int
-    name: str
-    size: int
-    type: str
+async def unmigrated_key(d1: D1Database, key: str, employee: Employee, prefix: str) -> str:
+    """The old name of a file denied under ``key``, when it is one of the
+    employee's company files the migration has not moved under ``prefix``
+    yet. Only denied reads pay for this query. Raises PermissionError
+    otherwise."""
+    name = key.removeprefix(prefix)
+    if prefix and await get_unmigrated_file_visibility(d1, name, employee, prefix) is not None:
+        return name
+    raise PermissionError("File access denied")
 
-    async def arrayBuffer(self): ...
 
-    async def stream(self) -> ReadableStream: ...
+def object_metadata(value, prefix: str = "", fields: tuple[str, ...] | None = None) -> dict[str, Any]:
+    return object_serializer(fields, prefix)(value)
 
 
-class MultipartData:
-    file: File
-    metadata: dict[str, Any]
+def client_object(value, prefix: str):
+    """An R2 object or multipart upload as the client sees it, without the
+    storage prefix."""
+    if not prefix or value is None:
+        return value
+    if hasattr(value, "uploadId"):
+        return to_js({"key": value.key.removeprefix(prefix), "uploadId": value.uploadId})
+    return to_js(object_metadata(value, prefix))
 
 
-async def parse_multipart_data(request):
-    form = await request.formData()
-    metadata_keys = [key for key in form.keys() if key != "file"]
-    metadata = {key: form.get(key) for key in metadata_keys}
-    file = form.get("file")
+async def body_chunks(stream: ReadableStream) -> AsyncIterator[bytes]:
+    async for chunk in stream:
+        yield chunk.to_bytes()
+
+
+async def parse_multipart_data(request) -> tuple[FilePart | None, dict[str, str]]:
+    """The form fields sent before the file, and the file part positioned at
+    the start of its data. Nothing past the file's headers has been read."""
+    if request.body is None:
+        raise MultipartError("Multipart form-data required")
+    reader = MultipartReader(
+        body_chunks(request.body),
+        multipart_boundary(request.headers.get("content-type")),
+        int(request.headers.get("content-length")),
+    )
+    metadata, file = await reader.read_fields()
     return file, metadata
 
 
+async def stream_file_part(file: FilePart, write) -> Any:
+    """Pipe the file's data into ``write`` (an R2 put or uploadPart) through a
+    FixedLengthStream, so R2 sees a stream of known length and at most a
+    chunk or two of the upload is held in memory."""
+    stream = FixedLengthStream.new(file.length)
+    writer = stream.writable.getWriter()
+
+    async def pump():
+        try:
+            async for chunk in file.chunks():
+                await writer.write(to_js(chunk))
+        except BaseException as e:
+            await writer.abort(str(e))
+            raise
+        await writer.close()
+
+    written, pumped = await asyncio.gather(write(stream.readable), pump(), return_exceptions=True)
+    # the parser's error says more than the aborted put's
+    for outcome in (pumped, written):
+        if isinstance(outcome, BaseException):
+            raise outcome
+    return written
+
+
 # CORE WORKER
+# Verified tokens live for the lifetime of the isolate. Clients reuse one
+# X-API-Key for every part of an upload, so most requests skip the decode.
+JWT_CACHE_SIZE = 1024
+
+
+class JwtCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+_jwt_cache: OrderedDict[tuple[str, str], tuple[float, Employee]] = OrderedDict()
+_jwt_cache_hits = 0
+_jwt_cache_misses = 0
+
+
+def jwt_cache_info() -> JwtCacheInfo:
+    return JwtCacheInfo(_jwt_cache_hits, _jwt_cache_misses, JWT_CACHE_SIZE, len(_jwt_cache))
+
+
+def jwt_cache_clear():
+    global _jwt_cache_hits, _jwt_cache_misses
+    _jwt_cache.clear()
+    _jwt_cache_hits = _jwt_cache_misses = 0
+
+
 # can't connect with hyperdrive due to rls - hyperdrive doesn't support SET.
 async def authenticate_employee(jwt, env: Env):
+    global _jwt_cache_hits, _jwt_cache_misses
+    cache_key = (jwt, env.SECRET)
+    cached = _jwt_cache.get(cache_key)
+    if cached is not None:
+        exp, employee = cached
+        if exp > time.time():
+            _jwt_cache.move_to_end(cache_key)
+            _jwt_cache_hits += 1
+            return employee
+        del _jwt_cache[cache_key]
+    _jwt_cache_misses += 1
     payload: JwtPayload = decode_jwt(jwt, env.SECRET)
     assert payload["id"] is not None
     assert payload["company_id"] is not None
-    assert datetime.fromtimestamp(payload["exp"]) > datetime.now()
+    assert payload["exp"] > time.time()
     assert payload["permission_level"] is not None
     employee_args = payload.copy()
     employee_args.pop("exp")
     employee = Employee(**employee_args)
+    _jwt_cache[cache_key] = (payload["exp"], employee)
+    if len(_jwt_cache) > JWT_CACHE_SIZE:
+        _jwt_cache.popitem(last=False)
     return employee
 
 
@@ -167,6 +550,120 @@ async def base64_encode(data: bytes) -> str:
     return b64encode(data).decode("utf-8")
 
 
+BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(value: str | None) -> dict[str, int] | None:
+    """R2 ``range`` options for a single byte range ``Range`` header.
+
+    Absent, malformed and multi-range headers give None and the whole object
+    is served, which RFC 9110 allows.
+    """
+    if not value:
+        return None
+    match = BYTE_RANGE.match(value.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if start == "":
+        if end == "" or int(end) == 0:
+            return None
+        return {"suffix": int(end)}
+    if end == "":
+        return {"offset": int(start)}
+    if int(end) < int(start):
+        return None
+    return {"offset": int(start), "length": int(end) - int(start) + 1}
+
+
+def served_range(byte_range: dict[str, int] | None, size: int) -> tuple[int, int] | None:
+    """(offset, length) of ``byte_range`` within an object of ``size`` bytes."""
+    if byte_range is None or size == 0:
+        return None
+    if "suffix" in byte_range:
+        length = min(byte_range["suffix"], size)
+        return size - length, length
+    offset = byte_range["offset"]
+    length = min(byte_range.get("length", size - offset), size - offset)
+    return offset, length
+
+
+def conditional_headers(request_headers) -> Any:
+    """The request's If-None-Match / If-Modified-Since as an R2 ``onlyIf``,
+    or None when it sent neither."""
+    conditions = None
+    for name in ("If-None-Match", "If-Modified-Since"):
+        value = request_headers.get(name)
+        if value:
+            if conditions is None:
+                conditions = Headers.new()
+            conditions.set(name, value)
+    return conditions
+
+
+def set_validator_headers(file, headers):
+    if file.httpEtag:
+        headers.set("ETag", file.httpEtag)
+    headers.set("Last-Modified", file.uploaded.toGMTString())
+
+
+def write_object_headers(file, headers):
+    """Validators plus the stored HTTP metadata (Content-Type, Cache-Control,
+    ...), which R2 writes onto ``headers`` itself."""
+    set_validator_headers(file, headers)
+    file.writeHttpMetadata(headers)
+    if not headers.has("Content-Type"):
+        headers.set("Content-Type", "application/octet-stream")
+
+
+def not_modified_response(file, headers=None):
+    """304 for an object whose ``onlyIf`` failed, so R2 sent no body."""
+    if headers is None:
+        headers = Headers.new()
+    set_validator_headers(file, headers)
+    return Response.new(None, headers=headers, status=304)
+
+
+def file_response(file, filename: str, byte_range: dict[str, int] | None, headers=None):
+    """Stream an R2 object body, as 206 with Content-Range when a range was served.
+
+    Uploaders choose the stored Content-Type, so bodies are always sent as
+    attachments with ``nosniff``: an uploaded HTML or script file must never
+    render on the worker's origin.
+    """
+    if headers is None:
+        headers = Headers.new()
+    write_object_headers(file, headers)
+    quoted = filename.replace("\\", "\\\\").replace('"', '\\"')
+    headers.set("Content-Disposition", f'attachment; filename="{quoted}"')
+    headers.set("X-Content-Type-Options", "nosniff")
+    headers.set("Accept-Ranges", "bytes")
+    # the body stream goes to the Response as is, never through Python
+    size = file.size
+    served = served_range(byte_range, size)
+    if served is None:
+        headers.set("Content-Length", str(size))
+        return Response.new(file.body, headers=headers, status=200)
+    offset, length = served
+    headers.set("Content-Range", f"bytes {offset}-{offset + length - 1}/{size}")
+    headers.set("Content-Length", str(length))
+    return Response.new(file.body, headers=headers, status=206)
+
+
+async def range_not_satisfiable_response(bucket: R2Bucket, key: str, headers=None):
+    if headers is None:
+        headers = Headers.new()
+    head = await bucket.head(key)
+    if head is not None:
+        headers.set("Content-Range", f"bytes */{head.size}")
+    headers.set("Accept-Ranges", "bytes")
+    return Response.json(to_js({"error": "Range not satisfiable"}), status=416, headers=headers)
+
+
 @dataclass
 class GetOptions:
     onlyIf: dict[str, Any]
@@ -178,6 +675,9 @@ class ListOptions:
     limit: int
     _limit: Optional[int] = field(default=100, init=False)
     cursor: Optional[str] = field(default=None)
+    fill: bool = field(default=False)
+    source: str = field(default="r2")
+    fields: Optional[tuple[str, ...]] = field(default=None)
 
     @property
     def limit(self):
@@ -210,20 +710,175 @@ def get_url_path_and_params(url: str) -> tuple[str, dict[str, str]]:
         file_path = "/".join(url_path.split("/")[1:])  # Exclude 'download'
         params["file_name"] = file_path
         url_path = "download"
+    elif url_path.startswith("files/"):
+        params["file_name"] = url_path.removeprefix("files/")
+        url_path = "files/raw"
     return url_path, params
 
 
+# Upper bound on R2 objects a single fill-mode list request examines.
+LIST_FILL_MAX_SCAN = 5000
+# Smallest R2 page pulled per fill iteration, so sparse access does not
+# degrade into one list call per accessible object.
+LIST_FILL_PAGE_SIZE = 100
+
+
+def encode_list_cursor(last_key: str) -> str:
+    return urlsafe_b64encode(last_key.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_list_cursor(cursor: str) -> str:
+    # validate=True rejects stray characters instead of skipping them, so a
+    # mangled cursor fails rather than restarting the listing
+    try:
+        return b64decode(cursor + "=" * (-len(cursor) % 4), altchars=b"-_", validate=True).decode("utf-8")
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+def filter_accessible_objects(
+    objects, file_accesses: dict[str, bool], prefix: str = "", fields: tuple[str, ...] | None = None
+) -> list[dict[str, Any]]:
+    """Serialize the listed objects the caller may read, in one pass over the
+    JS objects."""
+    serialize = object_serializer(fields, prefix)
+    return [serialize(item) for item in objects if file_accesses.get(item.key)]
+
+
+async def list_accessible_files(
+    employee: Employee,
+    bucket: R2Bucket,
+    d1: D1Database,
+    limit: int,
+    cursor: str | None = None,
+    max_scan: int | None = None,
+    prefix: str = "",
+    fields: tuple[str, ...] | None = None,
+) -> dict[str, Any]:
+    """List up to ``limit`` objects the employee can read, pulling as many R2
+    pages as needed.
+
+    The returned cursor names the last object examined (accessible or not), so
+    the next call resumes right after it via ``startAfter``. At most
+    ``max_scan`` objects (default ``LIST_FILL_MAX_SCAN``) are examined per
+    call; hitting the cap returns a short page with ``truncated`` set.
+    """
+    if max_scan is None:
+        max_scan = LIST_FILL_MAX_SCAN
+    start_after = decode_list_cursor(cursor) if cursor else None
+    serialize = object_serializer(fields, prefix)
+    accessible: list[dict[str, Any]] = []
+    scanned = 0
+    exhausted = False
+    while len(accessible) < limit and scanned < max_scan:
+        list_options = {
+            "limit": min(max(limit - len(accessible), LIST_FILL_PAGE_SIZE), 1000, max_scan - scanned)
+        }
+        if start_after is not None:
+            list_options["startAfter"] = start_after
+        if prefix:
+            list_options["prefix"] = prefix
+        page = await bucket.list(**list_options, **list_include(fields))
+        objects = list(page.objects)
+        if len(objects) == 0:
+            exhausted = True
+            break
+        keys = [obj.key for obj in objects]
+        file_accesses = await check_multiple_file_access(d1, keys, employee)
+        for item, key in zip(objects, keys):
+            scanned += 1
+            start_after = key
+            if file_accesses.get(key):
+                accessible.append(serialize(item))
+                if len(accessible) == limit:
+                    break
+        if not page.truncated and start_after == keys[-1]:
+            exhausted = True
+            break
+    return {
+        "objects": accessible,
+        "truncated": not exhausted,
+        "cursor": None if exhausted or start_after is None else encode_list_cursor(start_after),
+        "scanned": scanned,
+    }
+
+
+def prefix_upper_bound(prefix: str) -> str | None:
+    """The smallest string greater than every key starting with ``prefix``."""
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+async def list_files_from_index(
+    employee: Employee,
+    d1: D1Database,
+    limit: int,
+    cursor: str | None = None,
+    prefix: str = "",
+    fields: tuple[str, ...] | None = None,
+) -> dict[str, Any]:
+    """List the files the employee can read from the D1 files table alone.
+
+    One keyset query per page and no R2 calls, so each entry carries the key
+    and visibility but none of the R2 metadata (size, etag, ...).
+    """
+    after = max(decode_list_cursor(cursor), prefix) if cursor else prefix
+    rows = await list_visible_files(d1, employee, limit + 1, after, prefix_upper_bound(prefix))
+    truncated = len(rows) > limit
+    rows = rows[:limit]
+    objects = [{"key": row["name"].removeprefix(prefix), "visibility": row["visibility"]} for row in rows]
+    if fields is not None:
+        objects = [{name: item[name] for name in fields} for item in objects]
+    return {
+        "objects": objects,
+        "truncated": truncated,
+        "cursor": encode_list_cursor(rows[-1]["name"]) if truncated else None,
+    }
+
+
 async def get_file(
     key: str | None,
     employee: Employee,
     bucket: R2Bucket,
     d1: D1Database,
     options: GetOptions | R2ListOptions | None,
+    prefix: str = "",
+    byte_range: dict[str, int] | None = None,
+    conditions: Any = None,
+    check_access: bool = True,
 ):
-    # Check file access?
+    """A file, a ranged or conditional read of one, or a list page.
+
+    Reads of a key are checked against the ACL before R2 is touched, unless
+    ``check_access`` is False because a signed URL already authorized them.
+    """
+    if key is not None:
+        key = prefix + key
     if options is None and key is not None:
-        object: R2Object | R2ObjectBody = await bucket.get(key)
-        return object
+        if check_access and not await check_file_access(d1, key, employee):
+            key = await unmigrated_key(d1, key, employee, prefix)
+        get_options = {}
+        if byte_range is not None:
+            get_options["range"] = to_js(byte_range)
+        if conditions is not None:
+            # a failed condition returns the object without a body
+            get_options["onlyIf"] = conditions
+        if not get_options:
+            object: R2Object | R2ObjectBody = await bucket.get(key)
+            return object
+        try:
+            return await bucket.get(key, **get_options)
+        except JsException as e:
+            if "(10039)" in str(e):
+                raise RangeNotSatisfiable(key)
+            raise
+    if isinstance(options, ListOptions) and options.source == "d1":
+        return await list_files_from_index(employee, d1, options.limit, options.cursor, prefix, options.fields)
+    if isinstance(options, ListOptions) and options.fill:
+        return await list_accessible_files(
+            employee, bucket, d1, options.limit, options.cursor, prefix=prefix, fields=options.fields
+        )
     decoded_options: dict[str, Any] = asdict(options)
     if "limit" in decoded_options or "cursor" in decoded_options:
         # LIST PATH
@@ -231,30 +886,19 @@ async def get_file(
             "limit": decoded_options.get("limit", 100),
             "cursor": decoded_options.get("cursor", None),
         }
-        objects = await bucket.list(**final_options_dict)
-        objects = objects.to_py(default_converter=r2object_converter)
-        if len(objects["objects"]) == 0:
+        if prefix:
+            final_options_dict["prefix"] = prefix
+        listed = await bucket.list(**final_options_dict, **list_include(options.fields))
+        objects = list(listed.objects)
+        if len(objects) == 0:
             raise FileNotFoundError("No objects found")
-        file_accesses = await check_multiple_file_access(
-            d1, [obj.key for obj in objects["objects"]], employee
-        )
-        filtered_dict = {"objects": []}
-        for item in objects["objects"]:
-            item_dict = asdict(item)
-            name = item_dict["key"]
-            if name in file_accesses:
-                result = next(
-                    (asdict(item) for item in objects["objects"] if name <= item.key),
-                    None,
-                )
-                filtered_dict["objects"].append(result)
-        return to_js(filtered_dict)
+        file_accesses = await check_multiple_file_access(d1, [obj.key for obj in objects], employee)
+        return {"objects": filter_accessible_objects(objects, file_accesses, prefix, options.fields)}
     elif key is not None and (
         "range" in decoded_options or "onlyIf" in decoded_options
     ):
-        file_access = await check_file_access(d1, key, employee)
-        if not file_access:
-            raise PermissionError("File access denied")
+        if check_access and not await check_file_access(d1, key, employee):
+            key = await unmigrated_key(d1, key, employee, prefix)
         object: R2Object | R2ObjectBody = await bucket.get(key, options=decoded_options)
     else:
         raise ValueError("Invalid request")
@@ -266,6 +910,36 @@ async def get_file(
         raise ValueError("Invalid object - options failed")
 
 
+async def head_file(
+    key: str,
+    employee: Employee,
+    bucket: R2Bucket,
+    d1: D1Database,
+    prefix: str = "",
+):
+    """Object metadata after the ACL check, without reading the body."""
+    key = prefix + key
+    if not await check_file_access(d1, key, employee):
+        key = await unmigrated_key(d1, key, employee, prefix)
+    object: R2Object | None = await bucket.head(key)
+    if object is None:
+        raise FileNotFoundError("File not found")
+    return object
+
+
+def metadata_headers(file, headers=None):
+    """An object's size, validators and metadata as response headers."""
+    if headers is None:
+        headers = Headers.new()
+    write_object_headers(file, headers)
+    headers.set("Content-Length", str(file.size))
+    headers.set("Accept-Ranges", "bytes")
+    if file.customMetadata:
+        for name, value in file.customMetadata.to_py().items():
+            headers.set(f"X-Meta-{name}", value)
+    return headers
+
+
 def content_validator(content: str | bytes):
     if content is None or content == "" or len(content) < 2:
         raise ValueError("Content is required")
@@ -371,43 +1045,110 @@ class R2UploadedPartBody(R2UploadedPart):
         self._part_number = value
 
 
+async def put_new_file(employee: Employee, key: str, visibility: str, d1: D1Database, put) -> Any:
+    """Record the file access row, then run ``put``. The row is removed again
+    if the put fails, so the key can be retried."""
+    file_access = FileAccess(
+        key=key,
+        employee_id=employee.id,
+        company_id=employee.company_id,
+        visibility=visibility,
+    )
+    if not await insert_file_access(d1, file_access):
+        raise ValueError("Failed to insert file access")
+    try:
+        return await put()
+    except BaseException:
+        await remove_file_access(d1, file_access)
+        raise
+
+
 async def upload_file(
     employee: Employee,
-    file: File,
+    file: FilePart | None,
     metadata: dict[str, Any],
     bucket: R2Bucket,
     d1: D1Database,
+    prefix: str = "",
+    session: UploadSession | None = None,
 ):
-    key = metadata.get("key")
+    if file is None:
+        raise ValueError("A file field is required")
+    buffered = None
+    if not metadata.get("key") or file.length is None:
+        # the key arrives after the file (or the length is unknown), so the
+        # data has to be read before it can be stored
+        data, trailing_fields = await file.read(DataSize.MB_100.value)
+        metadata = {**metadata, **trailing_fields}
+        buffered = to_js(data)
+    if not metadata.get("key"):
+        raise ValueError("A key field is required")
+    key = prefix + metadata["key"]
     visibility = metadata.get("visibility", Visibility.PRIVATE.value)
+    check_upload_session(session, key, metadata.get("upload_id"))
+
+    async def store(write):
+        if buffered is not None:
+            return await write(buffered)
+        return await stream_file_part(file, write)
+
     if not metadata.get("upload_id"):
-        file_access: bool = await insert_file_access(
-            d1,
-            FileAccess(
-                key=key,
-                employee_id=employee.id,
-                company_id=employee.company_id,
-                visibility=visibility,
-            ),
+        returned_file = await put_new_file(
+            employee, key, visibility, d1, lambda: store(lambda value: bucket.put(key, value))
         )
-        if not file_access:
-            raise ValueError("Failed to insert file access")
-        returned_file = await bucket.put(key, file.stream())
-        return returned_file, 200
+        return client_object(returned_file, prefix), 200
     elif metadata.get("upload_id"):
         # resume multi-part upload and store
         resumed_upload = bucket.resumeMultipartUpload(
             key,
             metadata.get("upload_id"),
         )
-        returned_file_part = await resumed_upload.uploadPart(
-            metadata.get("part"), file.stream()
+        returned_file_part = await store(lambda value: resumed_upload.uploadPart(metadata.get("part"), value))
+        await record_upload_part(
+            d1, metadata["upload_id"], returned_file_part.partNumber, returned_file_part.etag
         )
         return returned_file_part, 201
     else:
         raise ValueError("Invalid request")
 
 
+RAW_PART_PATH = re.compile(r"^(.+)/parts/(\d+)$")
+
+
+async def upload_raw(
+    employee: Employee,
+    file_key: str,
+    body: ReadableStream | None,
+    params: dict[str, str],
+    bucket: R2Bucket,
+    d1: D1Database,
+    prefix: str = "",
+    content_type: str | None = None,
+    session: UploadSession | None = None,
+):
+    """PUT /files/<key>, or /files/<key>/parts/<n>?upload_id=<id>. The request
+    body is the file or part itself and is handed to R2 untouched."""
+    upload_id = params.get("upload_id", None)
+    if upload_id:
+        match = RAW_PART_PATH.match(file_key)
+        if match is None:
+            raise ValueError("Parts are uploaded to /files/<key>/parts/<part number>")
+        key, part = match.groups()
+        check_upload_session(session, prefix + key, upload_id)
+        resumed_upload = bucket.resumeMultipartUpload(prefix + key, upload_id)
+        returned_file_part = await resumed_upload.uploadPart(int(part), body)
+        await record_upload_part(d1, upload_id, returned_file_part.partNumber, returned_file_part.etag)
+        return returned_file_part, 201
+    key = prefix + file_key
+    check_upload_session(session, key, None)
+    visibility = params.get("visibility", Visibility.PRIVATE.value)
+    http_metadata = to_js({"contentType": content_type} if content_type else {})
+    returned_file = await put_new_file(
+        employee, key, visibility, d1, lambda: bucket.put(key, body, httpMetadata=http_metadata)
+    )
+    return client_object(returned_file, prefix), 200
+
+
 @dataclass
 class FileCreateStartBody:
     key: str
@@ -448,25 +1189,48 @@ async def make_multi_part_upload(
     upload_id: str | None = None,
     key_param: str | None = None,
     key_visibility: Visibility | None = None,
+    prefix: str = "",
+    env: Env | None = None,
 ):
-    """Create or resolve multi-part upload"""
+    """Create or resolve multi-part upload. With ``env``, a new upload comes
+    with an ``uploadToken`` that authorizes its parts."""
     multi_part_body = file_create_start_factory(multi_part_body_raw)
     if not isinstance(multi_part_body, (FileCreateStartBody, list)):
         raise ValueError(f"Invalid request body {multi_part_body}")
     match multi_part_body:
         case FileCreateStartBody():
-            key = multi_part_body.key
+            key = prefix + multi_part_body.key
             new_multi_part_upload = await bucket.createMultipartUpload(key)
-            return new_multi_part_upload
+            visibility = getattr(multi_part_body.visibility, "value", multi_part_body.visibility)
+            await record_upload(d1, new_multi_part_upload.uploadId, key, employee, visibility)
+            if env is None:
+                return client_object(new_multi_part_upload, prefix)
+            upload_token = generate_upload_session_token(
+                env, key, new_multi_part_upload.uploadId, employee, visibility
+            )
+            return to_js(
+                {
+                    "key": new_multi_part_upload.key.removeprefix(prefix),
+                    "uploadId": new_multi_part_upload.uploadId,
+                    "uploadToken": upload_token,
+                }
+            )
         case list():
             if upload_id is None or len(upload_id) <= 1:
                 raise ValueError("Upload ID is required")
             if key_param is None:
                 raise ValueError("Key is required")
+            key_param = prefix + key_param
             object_to_upload_to = bucket.resumeMultipartUpload(
                 key_param,
                 upload_id,
             )
+            if not multi_part_body:
+                # complete with the parts recorded as they were stored
+                upload = await get_upload(d1, upload_id, employee)
+                if upload is None:
+                    raise ValueError("Upload not found")
+                multi_part_body_raw = upload["parts"]
             js_body = to_js(multi_part_body_raw)
             access = await insert_file_access(
                 d1,
@@ -480,225 +1244,557 @@ async def make_multi_part_upload(
             if not access:
                 raise ValueError("Failed to insert file access")
             final_file: R2Object = await object_to_upload_to.complete(js_body)
-            return final_file
+            await forget_uploads(d1, [upload_id])
+            return client_object(final_file, prefix)
         case _:
             raise ValueError("Invalid request")
 
 
+async def upload_status(env: Env, upload_id: str, employee: Employee, prefix: str = "") -> dict[str, Any] | None:
+    """GET /files/uploads/<upload_id>: the parts stored so far, so a client can
+    send only the missing ones, plus a fresh upload token for them."""
+    upload = await get_upload(env.DB, upload_id, employee)
+    if upload is None:
+        return None
+    return {
+        "key": upload["name"].removeprefix(prefix),
+        "uploadId": upload_id,
+        "visibility": upload["visibility"],
+        "parts": upload["parts"],
+        "uploadToken": generate_upload_session_token(
+            env, upload["name"], upload_id, employee, upload["visibility"]
+        ),
+    }
+
+
+# Keys per DELETE request, and per R2 delete call (the R2 maximum).
+MAX_DELETE_KEYS = 10000
+R2_DELETE_BATCH_SIZE = 1000
+
+
+def parse_delete_keys(body: Any) -> list[str]:
+    if not isinstance(body, list) or not all(isinstance(key, str) and key for key in body):
+        raise ValueError("Body must be a JSON list of file keys")
+    if not 1 <= len(body) <= MAX_DELETE_KEYS:
+        raise ValueError(f"Between 1 and {MAX_DELETE_KEYS} keys are required")
+    return list(dict.fromkeys(body))
+
+
 async def delete(
-    files: list[FileId] | FileId,
+    keys: list[str],
     employee: Employee,
     bucket: R2Bucket,
-):
-    raise NotImplementedError("Not implemented")
-
-
-def handle_cors_preflight():
-    headers = Headers.new()
-    headers.set("Access-Control-Allow-Origin", "*")
-    headers.set("Access-Control-Allow-Methods", "GET, POST, PUT, DELETE, OPTIONS")
-    headers.set("Access-Control-Allow-Headers", "Content-Type, Authorization, X-API-Key")
-    headers.set("Access-Control-Max-Age", "86400")
-    return Response.new(None, status=204, headers=headers)
-
-def get_cors_headers():
-    headers = Headers.new()
-    headers.set("Access-Control-Allow-Origin", "*")
-    headers.set("Access-Control-Allow-Methods", "GET, POST, PUT, DELETE, OPTIONS")
-    headers.set("Access-Control-Allow-Headers", "Content-Type, Authorization, X-API-Key")
-    return headers
+    d1: D1Database,
+    prefix: str = "",
+) -> dict[str, list[str]]:
+    """Delete the files in ``keys`` the employee owns (any company file for
+    an ADMIN).
+
+    One D1 query authorizes every key, R2 deletes up to 1000 keys per call,
+    and the file access rows go in one batch after the objects, so a failed
+    run leaves no object without its row and can be repeated. Missing and
+    forbidden keys are returned in ``denied``.
+    """
+    if employee.permission_level < PermissionLevel.WRITE:
+        raise PermissionError("Write permission required")
+    deletable = await get_deletable_file_names(d1, [prefix + key for key in keys], employee)
+    deleted = [key for key in keys if prefix + key in deletable]
+    names = [prefix + key for key in deleted]
+    await asyncio.gather(
+        *(
+            bucket.delete(to_js(names[start : start + R2_DELETE_BATCH_SIZE]))
+            for start in range(0, len(names), R2_DELETE_BATCH_SIZE)
+        )
+    )
+    await remove_file_accesses(d1, names)
+    return {"deleted": deleted, "denied": [key for key in keys if prefix + key not in deletable]}
+
+
+# Objects copied per migration request; each costs a get and a put.
+KEY_MIGRATION_BATCH_SIZE = 50
+# Objects copied per cron run, well inside the subrequest limit.
+SCHEDULED_KEY_MIGRATION_SIZE = 200
+
+
+async def migrate_company_keys(
+    employee: Employee,
+    bucket: R2Bucket,
+    d1: D1Database,
+    prefix: str,
+    limit: int | None = None,
+) -> dict[str, Any]:
+    """Move up to ``limit`` of the employee's company files under ``prefix``.
+
+    Objects are copied first, then their file access rows renamed in one
+    batch, then the originals deleted. A run that dies part way leaves every
+    file readable under one of its names and is safe to repeat. Call until
+    ``remaining`` is false. Multipart uploads started before the switch must
+    be restarted.
+    """
+    if limit is None:
+        limit = KEY_MIGRATION_BATCH_SIZE
+    names = await list_unprefixed_file_names(d1, employee.company_id, prefix, limit + 1)
+    remaining = len(names) > limit
+    copied, missing = await move_files(bucket, d1, [(prefix + name, name) for name in names[:limit]])
+    return {"migrated": copied, "missing": missing, "remaining": remaining}
+
+
+async def migrate_keys(env: Env, limit: int | None = None) -> dict[str, Any]:
+    """Move up to ``limit`` files of any company under their company prefix.
+    Run by ``on_scheduled`` while ``KEY_PREFIX_MODE = "company"``, so every
+    company is migrated whether or not it has an ADMIN key."""
+    if limit is None:
+        limit = SCHEDULED_KEY_MIGRATION_SIZE
+    files = await list_unprefixed_files(env.DB, limit + 1)
+    moves = [(company_key_prefix(env, company_id) + name, name) for name, company_id in files[:limit]]
+    copied, missing = await move_files(env.BUCKET, env.DB, moves)
+    return {"migratedKeys": copied, "missingKeys": len(missing), "keysRemaining": len(files) > limit}
+
+
+async def move_files(bucket: R2Bucket, d1: D1Database, moves: list[tuple[str, str]]) -> tuple[int, list[str]]:
+    """Apply ``(new_name, old_name)`` moves to objects and their rows. Returns
+    the number of objects copied and the old names that had no object."""
+    copied, missing = [], []
+    for new_name, old_name in moves:
+        source = await bucket.get(old_name)
+        if source is None:
+            missing.append(old_name)
+            continue
+        await bucket.put(
+            new_name,
+            source.body,
+            httpMetadata=source.httpMetadata,
+            customMetadata=source.customMetadata,
+        )
+        copied.append(old_name)
+    await rename_file_accesses(d1, moves)
+    if copied:
+        await bucket.delete(to_js(copied))
+    return len(copied), missing
+
+
+# Scheduled garbage collection. A run spends at most GC_PAGE_BUDGET pages,
+# each being one D1 page of GC_PAGE_SIZE rows or one round of up to
+# GC_PAGE_SIZE concurrent heads or aborts, so it stays well inside the CPU
+# limit however large the bucket is, and under 1000 subrequests.
+GC_PAGE_SIZE = 100
+GC_PAGE_BUDGET = 16
+# Multipart uploads are aborted after a day; R2 would keep the parts (and
+# bill for them) for seven.
+STALE_UPLOAD_AGE = 24 * 60 * 60
+# How long a files row must have been without its object before it is
+# dropped. Rows are written before the put or complete they describe, so
+# uploads in flight must not look orphaned.
+GC_ORPHAN_GRACE = 60 * 60
+
+
+async def abort_stale_uploads(bucket: R2Bucket, d1: D1Database, now: int) -> int:
+    stale = await list_stale_uploads(d1, now - STALE_UPLOAD_AGE, GC_PAGE_SIZE)
+
+    async def abort(upload):
+        try:
+            await bucket.resumeMultipartUpload(upload["name"], upload["upload_id"]).abort()
+        except JsException as e:
+            # already completed, aborted or expired in R2
+            print(f"GC abort {upload['upload_id']}: {e}")
+
+    await asyncio.gather(*(abort(upload) for upload in stale))
+    await forget_uploads(d1, [upload["upload_id"] for upload in stale])
+    return len(stale)
+
+
+async def drop_orphan_rows(bucket: R2Bucket, d1: D1Database, now: int) -> int:
+    """Re-check candidates older than the grace period and drop the rows whose
+    object is still missing."""
+    candidates = await list_orphan_candidates(d1, now - GC_ORPHAN_GRACE, GC_PAGE_SIZE)
+    heads = await asyncio.gather(*(bucket.head(name) for name in candidates))
+    orphans = [name for name, head in zip(candidates, heads) if head is None]
+    recovered = [name for name, head in zip(candidates, heads) if head is not None]
+    await remove_orphans(d1, orphans, recovered)
+    return len(orphans)
+
+
+async def scan_for_orphans(bucket: R2Bucket, d1: D1Database, now: int, pages: int) -> int:
+    """Walk the files table from the saved cursor, heading each page's objects
+    concurrently and noting rows without one. Every page moves the cursor,
+    however many objects without rows sit in the bucket. Returns the number
+    of rows checked; the cursor wraps to the start once the table is done."""
+    cursor = await get_gc_cursor(d1)
+    checked = 0
+    while pages >= 2:  # one D1 page and its round of heads
+        names = await list_file_names(d1, cursor, GC_PAGE_SIZE)
+        pages -= 1
+        if not names:
+            cursor = ""
+            break
+        heads = await asyncio.gather(*(bucket.head(name) for name in names))
+        pages -= 1
+        await mark_orphan_candidates(
+            d1,
+            [name for name, head in zip(names, heads) if head is None],
+            [name for name, head in zip(names, heads) if head is not None],
+            now,
+        )
+        checked += len(names)
+        cursor = names[-1]
+    await set_gc_cursor(d1, cursor)
+    return checked
+
+
+async def collect_garbage(env: Env, page_budget: int | None = None) -> dict[str, int]:
+    if page_budget is None:
+        page_budget = GC_PAGE_BUDGET
+    now = int(time.time())
+    aborted = await abort_stale_uploads(env.BUCKET, env.DB, now)
+    await prune_expired_rows(env.DB, now)
+    dropped = await drop_orphan_rows(env.BUCKET, env.DB, now)
+    # the fixed steps above take four pages: two D1 pages, aborts and heads
+    checked = await scan_for_orphans(env.BUCKET, env.DB, now, page_budget - 4)
+    return {"abortedUploads": aborted, "orphanRows": dropped, "checkedRows": checked}
+
 
-async def on_fetch(request: WorkerRequestType, env: Env):
-    method = Method(request.method)
+async def on_scheduled(event, env: Env, ctx=None):
+    """Cron Trigger entry point (the Python Workers name for ``scheduled``)."""
+    result = await collect_garbage(env)
+    if getattr(env, "KEY_PREFIX_MODE", None) == "company":
+        result.update(await migrate_keys(env))
+    print(f"GC {getattr(event, 'cron', '')}: {result}")
+    return result
+
+
+@dataclass
+class RouteContext:
+    """What a route handler gets once the request is authenticated. For signed
+    URL downloads ``employee`` is None; the token names the employee."""
+
+    request: WorkerRequestType
+    env: Env
+    ctx: ExecutionContext | None
+    params: dict[str, str]
+    employee: Employee | None = None
+    prefix: str = ""
+    upload_session: UploadSession | None = None
+
+
+async def handle_upload_status(call: RouteContext):
+    status = await upload_status(call.env, call.params["upload_id"], call.employee, call.prefix)
+    if status is None:
+        return error_response(404, "Upload not found")
+    return json_response(to_js(status))
+
+
+async def handle_migrate_keys(call: RouteContext):
+    if call.employee.permission_level < PermissionLevel.ADMIN:
+        return error_response(403, "Admin permission required")
+    if not call.prefix:
+        return error_response(400, "KEY_PREFIX_MODE is not enabled")
+    result = await migrate_company_keys(call.employee, call.env.BUCKET, call.env.DB, call.prefix)
+    return json_response(to_js(result))
+
+
+async def handle_download(call: RouteContext):
+    """/download/<file_key>?token=<token> serves the file; without a token,
+    /download/<file_key>/token issues one."""
+    env, params, request = call.env, call.params, call.request
+    print(f"Params: {params}")
+    file_key = params.get("file_name")
+    token = params.get("token")
+    if not token:
+        signed_key = call.prefix + file_key
+        visibility = await get_file_visibility(env.DB, signed_key, call.employee)
+        if visibility is None and call.prefix:
+            signed_key = file_key
+            visibility = await get_unmigrated_file_visibility(env.DB, file_key, call.employee, call.prefix)
+        if visibility is None:
+            return error_response(403, "File access denied")
+        try:
+            token_options = SignedUrlOptions.from_params(params)
+        except ValueError as e:
+            return error_response(400, str(e))
+        token = await issue_signed_url_token(env, signed_key, call.employee, visibility, token_options)
+        if not token:
+            return error_response(500, "Failed to generate token")
+        return json_response(to_js({"token": token}))
+    try:
+        key_plus_employee = await validate_signed_url(env, token, file_key, call.ctx)
+        if key_plus_employee is None:
+            raise ValueError("Invalid or expired token")
+        signed_key, employee_authorized = key_plus_employee
+    except ValueError as e:
+        print(f"Error: {e}")
+        return error_response(400, str(e))
+    except FileNotFoundError as e:
+        print(f"File key: {file_key}")
+        return error_response(404, str(e))
+    byte_range = parse_range_header(request.headers.get("Range"))
+    conditions = conditional_headers(request.headers)
+    try:
+        file = await get_file(
+            signed_key, employee_authorized, env.BUCKET, env.DB, None, "", byte_range, conditions, check_access=False
+        )
+        if file is None:
+            raise FileNotFoundError("File not found")
+        if not hasattr(file, "body"):
+            return not_modified_response(file, download_headers())
+        return file_response(file, file_key, byte_range, download_headers())
+    except RangeNotSatisfiable:
+        return await range_not_satisfiable_response(env.BUCKET, signed_key, cors_headers())
+    except Exception as e:
+        return error_response(404, str(e))
+
+
+async def handle_get_files(call: RouteContext):
+    env, params, request, employee, prefix = call.env, call.params, call.request, call.employee, call.prefix
+    if params == {}:
+        return error_response(400, "Invalid request - no params on GET.")
+    source = params.get("source", "r2")
+    if source not in ("r2", "d1"):
+        return error_response(400, "source must be r2 or d1")
+    meta = params.get("meta", "").lower() in ("1", "true") and "key" in params
+    try:
+        # metadata always comes from R2, whichever source a list would use
+        fields = parse_fields(params.get("fields"), INDEX_FIELDS if source == "d1" and not meta else OBJECT_FIELDS)
+    except ValueError as e:
+        return error_response(400, str(e))
+    if meta:
+        try:
+            file = await head_file(params["key"], employee, env.BUCKET, env.DB, prefix)
+        except PermissionError as e:
+            return error_response(403, str(e))
+        except FileNotFoundError as e:
+            return error_response(404, str(e))
+        return json_text_response(json.dumps(object_metadata(file, prefix, fields)))
+    limit = params.get("limit", None)
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return error_response(400, "Limit must be an integer")
+    cursor = params.get("cursor", None)
+    fill = params.get("fill", "").lower() in ("1", "true")
+    # ?range= takes the Range header syntax, for clients that cannot set headers
+    byte_range = parse_range_header(request.headers.get("Range") or params.get("range"))
+    conditions = conditional_headers(request.headers)
+    onlyIf = params.get("onlyIf", None)
+    get_key = params.get("key", None)
+    if get_key is None and cursor is None and limit is None and not fill and source == "r2":
+        return error_response(400)
+    try:
+        if fill or source == "d1":
+            options = ListOptions(limit=limit or 100, cursor=cursor, fill=fill, source=source, fields=fields)
+        elif limit is not None or cursor is not None:
+            options = ListOptions(limit=limit, cursor=cursor, fields=fields)
+        elif onlyIf is not None:
+            options = GetOptions(range=byte_range, onlyIf=onlyIf)
+        else:
+            options = None
+        file = await get_file(get_key, employee, env.BUCKET, env.DB, options, prefix, byte_range, conditions)
+        if file is None:
+            raise FileNotFoundError("File not found")
+    except RangeNotSatisfiable:
+        return await range_not_satisfiable_response(env.BUCKET, prefix + get_key, cors_headers())
+    except ValueError as e:
+        print(f"GET Value error: {e}")
+        return error_response(400, str(e))
+    except PermissionError as e:
+        print(f"GET Permission error: {e}")
+        return error_response(403, str(e))
+    except FileNotFoundError as e:
+        print(f"GET File not found error: {e}")
+        return error_response(404, str(e))
+    if hasattr(file, "body"):
+        return file_response(file, file.key.removeprefix(prefix), byte_range)
+    if options is None:
+        return not_modified_response(file)
+    return json_text_response(json.dumps(file), status=206)
+
+
+async def handle_head_files(call: RouteContext):
+    if "key" not in call.params:
+        return empty_response(400)
+    try:
+        file = await head_file(call.params["key"], call.employee, call.env.BUCKET, call.env.DB, call.prefix)
+    except PermissionError:
+        return empty_response(403)
+    except FileNotFoundError:
+        return empty_response(404)
+    return empty_response(200, metadata_headers(file, cors_headers()))
+
+
+async def handle_download_tokens(call: RouteContext):
+    request = call.request
+    try:
+        if request.body is None:
+            raise ValueError("Body must be a JSON list of file keys")
+        token_options = SignedUrlOptions.from_params(call.params)
+        limit = MAX_KV_SIGNED_URL_BATCH if issues_kv_tokens(call.env, token_options) else MAX_SIGNED_URL_BATCH
+        keys = parse_signed_url_keys(await stream_to_json(request.body), limit)
+    except ValueError as e:
+        return error_response(400, str(e))
+    parsed_url = urlparse(request.url)
+    signed_urls = await issue_signed_urls(
+        call.env, f"{parsed_url.scheme}://{parsed_url.netloc}", keys, call.employee, call.prefix, token_options
+    )
+    return json_response(to_js(signed_urls))
+
+
+async def handle_post_files(call: RouteContext):
+    params = call.params
+    try:
+        multi_part_body = await stream_to_json(call.request.body)
+        file = await make_multi_part_upload(
+            call.employee,
+            multi_part_body_raw=multi_part_body,
+            bucket=call.env.BUCKET,
+            d1=call.env.DB,
+            upload_id=params.get("upload_id", None),
+            key_param=params.get("key", None),
+            key_visibility=params.get("visibility", None),
+            prefix=call.prefix,
+            env=call.env,
+        )
+    except (ValueError, JsException) as e:
+        print(f"Error: {e}")
+        return error_response(400, str(e))
+    return json_response(file)
+
+
+async def handle_put_raw(call: RouteContext):
+    request = call.request
+    try:
+        if int(request.headers.get("content-length") or 0) > DataSize.MB_100.value:
+            raise ValueError("File size too large")
+        file, status = await upload_raw(
+            call.employee,
+            call.params["file_name"],
+            request.body,
+            call.params,
+            call.env.BUCKET,
+            call.env.DB,
+            call.prefix,
+            request.headers.get("content-type"),
+            call.upload_session,
+        )
+    except PermissionError as e:
+        return error_response(403, str(e))
+    except (ValueError, JsException) as e:
+        print(f"PUT Error: {e}")
+        return error_response(400, str(e))
+    return json_response(file, status=status)
+
+
+async def handle_put_files(call: RouteContext):
+    request = call.request
+    try:
+        if int(request.headers["content-length"]) > DataSize.MB_100.value:
+            raise ValueError("File size too large")
+        file, metadata = await parse_multipart_data(request)
+        file, status = await upload_file(
+            call.employee,
+            file=file,
+            metadata=metadata,
+            bucket=call.env.BUCKET,
+            d1=call.env.DB,
+            prefix=call.prefix,
+            session=call.upload_session,
+        )
+    except PermissionError as e:
+        return error_response(403, str(e))
+    except (ValueError, TypeError, JsException) as e:
+        print(f"PUT Error: {e}")
+        if "TypeError" in str(e):
+            return error_response(400, "Multipart form-data required")
+        return error_response(400, str(e))
+    return json_response(file, status=status)
+
+
+async def handle_delete_files(call: RouteContext):
+    # DELETE /files?key=<key> for one file, or a JSON list of keys in the body
+    delete_key = call.params.get("key", None)
+    try:
+        if delete_key is not None:
+            keys = [delete_key]
+        elif call.request.body is not None:
+            keys = parse_delete_keys(await stream_to_json(call.request.body))
+        else:
+            raise ValueError("A key or a JSON list of keys is required")
+        result = await delete(keys, call.employee, call.env.BUCKET, call.env.DB, call.prefix)
+    except ValueError as e:
+        return error_response(400, str(e))
+    except PermissionError as e:
+        return error_response(403, str(e))
+    if delete_key is not None and not result["deleted"]:
+        return error_response(404, "File not found or access denied")
+    return json_response(to_js(result))
+
+
+# (method, route) -> handler. get_url_path_and_params and on_fetch reduce a
+# URL to one of these routes, and a route listed under other methods only
+# gets 405.
+ROUTES = {
+    (Method.GET, "files"): handle_get_files,
+    (Method.HEAD, "files"): handle_head_files,
+    (Method.POST, "files"): handle_post_files,
+    (Method.PUT, "files"): handle_put_files,
+    (Method.DELETE, "files"): handle_delete_files,
+    (Method.PUT, "files/raw"): handle_put_raw,
+    (Method.GET, "files/uploads"): handle_upload_status,
+    (Method.GET, "download"): handle_download,
+    (Method.POST, "download/tokens"): handle_download_tokens,
+    (Method.POST, "admin/migrate-keys"): handle_migrate_keys,
+}
+ROUTE_PATHS = frozenset(path for _, path in ROUTES)
+
+
+async def on_fetch(request: WorkerRequestType, env: Env, ctx: ExecutionContext | None = None):
+    try:
+        method = Method(request.method)
+    except ValueError:
+        return error_response(405, "Invalid method")
     if method == Method.OPTIONS:
-        return handle_cors_preflight()
+        return preflight_response()
     url_path, params = get_url_path_and_params(request.url)
+    if method == Method.POST and url_path == "download" and params.get("file_name") == "tokens":
+        url_path = "download/tokens"
+    if method == Method.GET and url_path == "files/raw" and params["file_name"].startswith("uploads/"):
+        params["upload_id"] = params.pop("file_name").removeprefix("uploads/")
+        url_path = "files/uploads"
+    call = RouteContext(request, env, ctx, params)
     auth_with_token = (url_path == "download" and "token" in params)
+    if method == Method.PUT and "X-Upload-Token" in request.headers:
+        try:
+            call.upload_session = validate_upload_session_token(env, request.headers["X-Upload-Token"])
+        except ValueError as e:
+            print(f"Unauthorized: {e}")
+            return error_response(401)
+        # the session was authorized when the upload was started
+        auth_with_token = True
+        call.employee = call.upload_session.employee
     if "X-API-Key" not in request.headers and not auth_with_token:
-        print(request.headers)
+        defer(ctx, log_request_headers(request))
         print("No X-API-Key")
-        js_error = json.dumps({"error": "Unauthorized"})
-        return Response.json(js_error, status=401, headers=get_cors_headers())
-    try:
-        method = Method(request.method)
-    except ValueError:
-        js_error = json.dumps({"error": "Invalid method"})
-        return Response.json(js_error, status=405, headers=get_cors_headers())
-    if url_path not in ["files", "download"]:
-        js_error = json.dumps({"error": "Not found"})
-        return Response.json(js_error, status=404, headers=get_cors_headers())
-    try:
-        if not auth_with_token:
-            employee = await authenticate_employee(request.headers["X-API-Key"], env)
-        else:
-            pass
-    except (AssertionError, ValueError) as e:
-        print(f"Unauthorized: {e}")
-        js_error = json.dumps({"error": "Unauthorized"})
-        return Response.json(js_error, status=401, headers=get_cors_headers())
-    except Exception as e:
-        print(f"Error: {e}")
-        js_error = json.dumps({"error": "Internal server error"})
-        return Response.json(js_error, status=500, headers=get_cors_headers())
+        return error_response(401)
+    if url_path not in ROUTE_PATHS:
+        return error_response(404)
+    handler = ROUTES.get((method, url_path))
     if not auth_with_token:
         try:
-            employee_registered = await check_and_insert_employee(env.DB, employee)
+            call.employee = await authenticate_employee(request.headers["X-API-Key"], env)
+        except (AssertionError, ValueError) as e:
+            print(f"Unauthorized: {e}")
+            return error_response(401)
+        except Exception as e:
+            print(f"Error: {e}")
+            return error_response(500)
+        try:
+            employee_registered = await check_and_insert_employee(env.DB, call.employee)
             if not employee_registered:
-                return Response.json(
-                    {"error": "Employee registration failed, check jwt"}, status=400, headers=get_cors_headers()
-                )
+                return error_response(400, "Employee registration failed, check jwt")
         except ValueError as e:
             print(f"Error: {e}")
-            js_error = json.dumps({"error": str(e)})
-            return Response.json(js_error, status=400, headers=get_cors_headers())
-    match method:
-        case Method.GET:
-            if url_path == "download":
-                print(f"Params: {params}")
-                # /download/<file_key>?token=<token>
-                file_key = params.get("file_name")
-                token = params.get("token")
-                if token:
-                    try:
-                        key_plus_employee = await validate_signed_url(
-                            env, token
-                        )
-                        if key_plus_employee is None:
-                            raise ValueError("Invalid or expired token")
-                        validated_key = key_plus_employee[0]
-                        employee_authorized = key_plus_employee[1]
-                    except ValueError as e:
-                        print(f"Error: {e}")
-                        js_error = json.dumps({"error": str(e)})
-                        return Response.json(js_error, status=400, headers=get_cors_headers())
-                    if validated_key != file_key:
-                        print(f"File key: {file_key}")
-                        return Response.json(
-                            to_js({"error": "Invalid or expired token"}), status=404, headers=get_cors_headers()
-                        )
-                    try:
-                        file = await get_file(
-                            file_key, employee_authorized, env.BUCKET, env.DB, None
-                        )
-                        if file is None:
-                            raise FileNotFoundError("File not found")
-                        headers = Headers.new()
-                        headers.set("Content-Disposition", f'filename="{file.key}"')
-                        readable_stream = file.to_py(default_converter=get_body)
-                        headers.set("Content-Type", "application/octet-stream")
-                        headers.set("Access-Control-Allow-Origin", "*")
-                        headers.set("Access-Control-Allow-Methods", "GET")
-                        headers.set("Access-Control-Allow-Headers", "Content-Type, Authorization, X-API-Key")
-                        return Response.new(
-                            readable_stream, headers=headers, status=200
-                        )
-                    except Exception as e:
-                        return Response.json(to_js({"error": str(e)}), status=404, headers=get_cors_headers())
-                elif not token:
-                    token = await generate_signed_url_token(
-                        env,
-                        file_key,
-                        employee_id=employee.id,
-                        company_id=employee.company_id,
-                    )
-                    if not token:
-                        return Response.json(
-                            to_js({"error": "Failed to generate token"}), status=500
-                        )
-                    return Response.json(to_js({"token": token}), status=200, headers=get_cors_headers())
-                else:
-                    return Response.json(
-                        to_js({"error": "Invalid request."}), status=400
-                    )
-            if params == {}:
-                js_error = json.dumps({"error": "Invalid request - no params on GET."})
-                return Response.json(js_error, status=400, headers=get_cors_headers())
-            limit = params.get("limit", None)
-            if limit is not None:
-                limit = int(limit)
-            cursor = params.get("cursor", None)
-            range = params.get("range", None)
-            onlyIf = params.get("onlyIf", None)
-            get_key = params.get("key", None)
-            if get_key is None and cursor is None and range is None and limit is None:
-                js_error = json.dumps({"error": "Invalid request"})
-                return Response.json(js_error, status=400, headers=get_cors_headers())
-            if limit is not None or cursor is not None:
-                options = ListOptions(limit=limit, cursor=cursor)
-            elif range is not None or onlyIf is not None:
-                options = GetOptions(range=range, onlyIf=onlyIf)
-            else:
-                options = None
-            try:
-                file = await get_file(get_key, employee, env.BUCKET, env.DB, options)
-                if file is None:
-                    raise FileNotFoundError("File not found")
-            except ValueError as e:
-                print(f"GET Value error: {e}")
-                js_error = json.dumps({"error": str(e)})
-                return Response.json(js_error, status=400, headers=get_cors_headers())
-            except PermissionError as e:
-                print(f"GET Permission error: {e}")
-                js_error = json.dumps({"error": str(e)})
-                return Response.json(js_error, status=403, headers=get_cors_headers())
-            except FileNotFoundError as e:
-                print(f"GET File not found error: {e}")
-                js_error = json.dumps({"error": str(e)})
-                return Response.json(js_error, status=404, headers=get_cors_headers())
-            if hasattr(file, "body"):
-                headers = Headers.new()
-                headers.set("Content-Disposition", f'filename="{file.key}"')
-                readable_stream = file.to_py(default_converter=get_body)
-                headers.set("Content-Type", "application/octet-stream")
-                response = Response.new(readable_stream, headers=headers, status=200)
-                return response
-            return Response.json(file, status=206)
-        case Method.POST:
-            if url_path != "files":
-                return Response.json(to_js({"error": "Invalid request"}), status=400, headers=get_cors_headers())
-            try:
-                multi_part_body = await stream_to_json(request.body)
-                upload_id = params.get("upload_id", None)
-                key_param = params.get("key", None)
-                key_visibility = params.get("visibility", None)
-                file = await make_multi_part_upload(
-                    employee,
-                    multi_part_body_raw=multi_part_body,
-                    bucket=env.BUCKET,
-                    d1=env.DB,
-                    upload_id=upload_id,
-                    key_param=key_param,
-                    key_visibility=key_visibility,
-                )
-            except (ValueError, JsException) as e:
-                print(f"Error: {e}")
-                js_error = json.dumps({"error": str(e)})
-                return Response.json(js_error, status=400, headers=get_cors_headers())
-            return Response.json(file, headers=get_cors_headers())
-        case Method.PUT:
-            if url_path != "files":
-                return Response.json(to_js({"error": "Invalid request"}), status=400, headers=get_cors_headers())
-            try:
-                if int(request.headers["content-length"]) > DataSize.MB_100.value:
-                    raise ValueError("File size too large")
-                file, metadata = await parse_multipart_data(request)
-                file, status = await upload_file(
-                    employee, file=file, metadata=metadata, bucket=env.BUCKET, d1=env.DB
-                )
-            except (ValueError, TypeError, JsException) as e:
-                print(f"PUT Error: {e}")
-                if "TypeError" in str(e):
-                    js_error = to_js({"error": "Multipart form-data required"})
-                    return Response.json(js_error, status=400, headers=get_cors_headers())
-                js_error = to_js({"error": str(e)})
-                return Response.json(js_error, status=400, headers=get_cors_headers())
-
-            return Response.json(file, status=status, headers=get_cors_headers())
-        case Method.DELETE:
-            if url_path != "files":
-                return Response.json(to_js({"error": "Invalid request"}), status=400, headers=get_cors_headers())
-            # file = await delete(request.body, employee, env.BUCKET)
-            return Response.json({"message": "Not implemented"}, status=501, headers=get_cors_headers())
-        case _:
-            js_error = json.dumps({"error": "Method not allowed"})
-            return Response.json(js_error, status=405, headers=get_cors_headers())
+            return error_response(400, str(e))
+    if handler is None:
+        return error_response(405)
+    if call.employee is not None:
+        call.prefix = key_prefix(env, call.employee)
+    return await handler(call)
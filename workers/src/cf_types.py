@@ -1,5 +1,6 @@
 from typing import (
     Any,
+    Awaitable,
     Dict,
     List,
     Optional,
@@ -111,6 +112,7 @@ class Method(Enum):
     PUT = "PUT"
     DELETE = "DELETE"
     OPTIONS = "OPTIONS"
+    HEAD = "HEAD"
 
 
 class Headers(Protocol):
@@ -334,6 +336,7 @@ class R2ListOptions(Protocol):
     limit: Optional[int]
     prefix: Optional[str]
     cursor: Optional[str]
+    startAfter: Optional[str]
     delimiter: Optional[str]
     include: Optional[List[str]]
 
@@ -407,7 +410,43 @@ class D1Database(Generic[T]):
     ) -> List[D1Result[T]]: ...
 
 
+# KV
+
+
+class KVNamespaceListKey(Protocol):
+    name: str
+    expiration: Optional[int]
+    metadata: Optional[Any]
+
+
+class KVNamespaceListResult(Protocol):
+    keys: List[KVNamespaceListKey]
+    list_complete: bool
+    cursor: Optional[str]
+
+
+class KVNamespace(Protocol):
+    async def get(
+        self, key: str, options: Optional[Union[str, Dict[str, Any]]] = None
+    ) -> Optional[Any]: ...
+    async def put(
+        self, key: str, value: Union[str, bytes], options: Optional[Dict[str, Any]] = None
+    ) -> None: ...
+    async def delete(self, key: str) -> None: ...
+    async def list(
+        self, options: Optional[Dict[str, Any]] = None
+    ) -> KVNamespaceListResult: ...
+
+
+class ExecutionContext(Protocol):
+    def waitUntil(self, promise: Awaitable[Any]) -> None: ...
+    def passThroughOnException(self) -> None: ...
+
+
 class Env(Protocol):
-    MY_BUCKET: R2Bucket
+    BUCKET: R2Bucket
     DB: D1Database[Any]
+    SIGNED_URL_KEYS: KVNamespace
     SECRET: str
+    KEY_PREFIX_MODE: Optional[str]
+    SIGNED_URL_MODE: Optional[str]
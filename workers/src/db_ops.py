@@ -1,19 +1,42 @@
-from cf_types import D1Database, Employee, FileAccess
+from cf_types import D1Database, Employee, FileAccess, PermissionLevel
 from typing import Dict, Any, TypeVar
+from pyodide.ffi import to_js
+import json
+import time
 
 
 ############
 ###DB OPERATIONS - for authorization and authentication
 ############
 
-async def does_employee_exist(db: D1Database[Employee], employee_id: str, company_id: str) -> bool:
-    check_if_exists_query = "SELECT * FROM employees WHERE id = ?1 and company_id = ?2"
-    check_if_exists_statement = db.prepare(check_if_exists_query)
-    check_if_exists_binding = check_if_exists_statement.bind(
-        employee_id, company_id
-    )
-    check_if_exists_result = await check_if_exists_binding.first()
-    return check_if_exists_result is not None
+# Employees are only ever inserted, so a positive lookup can be reused for the
+# lifetime of the isolate. The TTL bounds how long a row deleted in D1 is still
+# treated as registered.
+EMPLOYEE_CACHE_TTL = 300
+EMPLOYEE_CACHE_SIZE = 4096
+_known_employees: dict[tuple[str, str], float] = {}
+
+
+def is_employee_known(employee_id: str, company_id: str) -> bool:
+    expires_at = _known_employees.get((employee_id, company_id))
+    if expires_at is None:
+        return False
+    if expires_at <= time.monotonic():
+        del _known_employees[(employee_id, company_id)]
+        return False
+    return True
+
+
+def remember_employee(employee_id: str, company_id: str):
+    _known_employees.pop((employee_id, company_id), None)
+    if len(_known_employees) >= EMPLOYEE_CACHE_SIZE:
+        del _known_employees[next(iter(_known_employees))]
+    _known_employees[(employee_id, company_id)] = time.monotonic() + EMPLOYEE_CACHE_TTL
+
+
+def employee_cache_clear():
+    _known_employees.clear()
+
 
 async def get_employee(db: D1Database[Employee], employee_id: str, company_id: str) -> Employee:
     query = "SELECT * FROM employees WHERE id = ?1 and company_id = ?2"
@@ -31,20 +54,25 @@ async def check_and_insert_employee(db: D1Database[Employee], employee: Employee
         raise ValueError("Employee ID is required")
     if not employee.company_id:
         raise ValueError("Employee company ID is required")
-    employee_exists = await does_employee_exist(db, employee.id, employee.company_id)
-    if employee_exists:
-        return employee_exists
-    if not employee_exists:
-        try:
-            query = "INSERT INTO employees (id, company_id, permission_level) VALUES (?1, ?2, ?3)"
-            statement = db.prepare(query)
-            binding = statement.bind(
-                employee.id, employee.company_id, employee.permission_level
-            )
-            result = await binding.run()
-            return result.success
-        except Exception as e:
-            raise ValueError(f"Error inserting employee: {e}")
+    if is_employee_known(employee.id, employee.company_id):
+        return True
+    try:
+        query = "INSERT INTO employees (id, company_id, permission_level) VALUES (?1, ?2, ?3) ON CONFLICT DO NOTHING"
+        statement = db.prepare(query)
+        binding = statement.bind(
+            employee.id, employee.company_id, employee.permission_level
+        )
+        result = await binding.run()
+    except Exception as e:
+        raise ValueError(f"Error inserting employee: {e}")
+    if result.success:
+        remember_employee(employee.id, employee.company_id)
+    return result.success
+
+
+# Authorization decisions are one statement each: the employee check is an
+# EXISTS inside the same query, so every decision is a single D1 round trip.
+EMPLOYEE_EXISTS = "EXISTS (SELECT 1 FROM employees WHERE employees.id = ?{id} AND employees.company_id = ?{company_id})"
 
 
 async def insert_file_access(db: D1Database[FileAccess], file_access: FileAccess) -> bool:
@@ -52,10 +80,12 @@ async def insert_file_access(db: D1Database[FileAccess], file_access: FileAccess
         for key, value in file_access.__dict__.items():
             if value is None:
                 raise ValueError(f"File access {key} is required")
-    if not await does_employee_exist(db, file_access.employee_id, file_access.company_id): # type: ignore
-        return False
     try:
-        query = "INSERT INTO files (id, name, employee_id, company_id, visibility) VALUES (?1, ?2, ?3, ?4, ?5)"
+        query = f"""
+        INSERT INTO files (id, name, employee_id, company_id, visibility)
+        SELECT ?1, ?2, ?3, ?4, ?5
+        WHERE {EMPLOYEE_EXISTS.format(id=3, company_id=4)}
+        """
         statement = db.prepare(query)
         binding = statement.bind(
             file_access.key,
@@ -70,7 +100,8 @@ async def insert_file_access(db: D1Database[FileAccess], file_access: FileAccess
             raise ValueError("File access already exists")
         else:
             raise ValueError(f"Failed to insert file due to: {e}")
-    return result.success
+    # no row is written when the employee is not registered
+    return bool(result.success and result.meta.changes)
 
 
 async def check_file_access(
@@ -82,63 +113,433 @@ async def check_file_access(
         raise ValueError("Employee ID is required")
     if not employee.company_id:
         raise ValueError("Employee company ID is required")
-    if not await does_employee_exist(db, employee.id, employee.company_id): # type: ignore
-        return False
-    query = """
-    select
-     case
-        when file.visibility = 'PUBLIC' then true # public
-        when file.visibility = 'INTERNAL' and file.company_id = ?3 then true # internal
-        when file.visibility = 'PRIVATE' and file.employee_id = ?2 and file.company_id = ?3 then true # private
-        else false
-     end
-    from (
-        SELECT *
-        FROM files
-        WHERE files.name = ?1
-    ) as file
+    query = f"""
+    SELECT
+     CASE
+        WHEN visibility = 'PUBLIC' THEN 1
+        WHEN visibility = 'INTERNAL' AND company_id = ?3 THEN 1
+        WHEN visibility = 'PRIVATE' AND employee_id = ?2 AND company_id = ?3 THEN 1
+        ELSE 0
+     END AS has_access
+    FROM files
+    WHERE name = ?1 AND {EMPLOYEE_EXISTS.format(id=2, company_id=3)}
     """
     statement = db.prepare(query)
     binding = statement.bind(file_name, employee.id, employee.company_id)
-    result: bool | None = await binding.first()
-    if result is None:
-        return False
-    return result
+    result: int | None = await binding.first("has_access")
+    return bool(result)
+
+
+async def get_file_visibility(
+    db: D1Database[str], file_name: str, employee: Employee
+) -> str | None:
+    """The file's visibility when the employee may read it, otherwise None."""
+    query = f"""
+    SELECT visibility,
+     CASE
+        WHEN visibility = 'PUBLIC' THEN 1
+        WHEN visibility = 'INTERNAL' AND company_id = ?3 THEN 1
+        WHEN visibility = 'PRIVATE' AND employee_id = ?2 AND company_id = ?3 THEN 1
+        ELSE 0
+     END AS has_access
+    FROM files
+    WHERE name = ?1 AND {EMPLOYEE_EXISTS.format(id=2, company_id=3)}
+    """
+    statement = db.prepare(query)
+    binding = statement.bind(file_name, employee.id, employee.company_id)
+    result = await binding.first()
+    if result is None or not result.has_access:
+        return None
+    return result.visibility
+
+
+async def record_signed_url_use(
+    db: D1Database[int], token_id: str, max_uses: int, expires_at: int
+) -> bool:
+    """Count one use of a signed URL. False once ``max_uses`` is reached.
+
+    The upsert is a single statement, so concurrent requests cannot both take
+    the last use.
+    """
+    query = """
+    INSERT INTO signed_url_uses (token_id, uses, expires_at) VALUES (?1, 1, ?3)
+    ON CONFLICT (token_id) DO UPDATE SET uses = uses + 1 WHERE uses < ?2
+    RETURNING uses
+    """
+    statement = db.prepare(query)
+    binding = statement.bind(token_id, max_uses, expires_at)
+    uses: int | None = await binding.first("uses")
+    return uses is not None
+
+
+async def record_upload(
+    db: D1Database, upload_id: str, name: str, employee: Employee, visibility: str
+) -> bool:
+    query = """
+    INSERT INTO uploads (upload_id, name, employee_id, company_id, visibility, created_at)
+    VALUES (?1, ?2, ?3, ?4, ?5, ?6)
+    """
+    statement = db.prepare(query)
+    binding = statement.bind(upload_id, name, employee.id, employee.company_id, visibility, int(time.time()))
+    result = await binding.run()
+    return result.success
+
+
+async def record_upload_part(db: D1Database, upload_id: str, part_number: int, etag: str) -> bool:
+    """Remember a stored part; uploading the same part again replaces it."""
+    query = """
+    INSERT INTO upload_parts (upload_id, part_number, etag) VALUES (?1, ?2, ?3)
+    ON CONFLICT (upload_id, part_number) DO UPDATE SET etag = excluded.etag
+    """
+    statement = db.prepare(query)
+    binding = statement.bind(upload_id, part_number, etag)
+    result = await binding.run()
+    return result.success
+
+
+async def get_upload(
+    db: D1Database[Dict[str, Any]], upload_id: str, employee: Employee
+) -> dict[str, Any] | None:
+    """The employee's upload with its stored parts in part order, in one
+    query. None when the upload is unknown or started by someone else."""
+    query = """
+    SELECT uploads.name, uploads.visibility, upload_parts.part_number, upload_parts.etag
+    FROM uploads LEFT JOIN upload_parts ON upload_parts.upload_id = uploads.upload_id
+    WHERE uploads.upload_id = ?1 AND uploads.employee_id = ?2 AND uploads.company_id = ?3
+    ORDER BY upload_parts.part_number
+    """
+    statement = db.prepare(query)
+    binding = statement.bind(upload_id, employee.id, employee.company_id)
+    rows = make_py(await binding.all())["results"]
+    if not rows:
+        return None
+    return {
+        "name": rows[0]["name"],
+        "visibility": rows[0]["visibility"],
+        "parts": [
+            {"partNumber": row["part_number"], "etag": row["etag"]}
+            for row in rows
+            if row["part_number"] is not None
+        ],
+    }
+
+
+async def forget_uploads(db: D1Database, upload_ids: list[str]):
+    """Drop uploads and their parts in one batch (one transaction)."""
+    if not upload_ids:
+        return
+    ids = json.dumps(upload_ids)
+    await db.batch(
+        to_js(
+            [
+                db.prepare("DELETE FROM upload_parts WHERE upload_id IN (SELECT value FROM json_each(?1))").bind(ids),
+                db.prepare("DELETE FROM uploads WHERE upload_id IN (SELECT value FROM json_each(?1))").bind(ids),
+            ]
+        )
+    )
+
+
+############
+###GARBAGE COLLECTION - see api_entry.collect_garbage
+############
+
+GC_FILES_CURSOR = "files_cursor"
+
+
+async def list_stale_uploads(db: D1Database[Dict[str, Any]], created_before: int, limit: int) -> list[dict[str, Any]]:
+    query = "SELECT upload_id, name FROM uploads WHERE created_at < ?1 ORDER BY created_at LIMIT ?2"
+    statement = db.prepare(query)
+    binding = statement.bind(created_before, limit)
+    return make_py(await binding.all())["results"]
+
+
+async def prune_expired_rows(db: D1Database, now: int):
+    """Expired signed URL counters, and parts whose upload is gone."""
+    await db.batch(
+        to_js(
+            [
+                db.prepare("DELETE FROM signed_url_uses WHERE expires_at < ?1").bind(now),
+                db.prepare(
+                    "DELETE FROM upload_parts WHERE upload_id NOT IN (SELECT upload_id FROM uploads)"
+                ).bind(),
+            ]
+        )
+    )
+
+
+async def list_file_names(db: D1Database[Dict[str, Any]], after: str, limit: int) -> list[str]:
+    statement = db.prepare("SELECT name FROM files WHERE name > ?1 ORDER BY name LIMIT ?2")
+    binding = statement.bind(after, limit)
+    return [row["name"] for row in make_py(await binding.all())["results"]]
+
+
+async def get_gc_cursor(db: D1Database[str]) -> str:
+    statement = db.prepare("SELECT value FROM gc_state WHERE name = ?1")
+    cursor: str | None = await statement.bind(GC_FILES_CURSOR).first("value")
+    return cursor or ""
+
+
+async def set_gc_cursor(db: D1Database, cursor: str):
+    query = "INSERT INTO gc_state (name, value) VALUES (?1, ?2) ON CONFLICT (name) DO UPDATE SET value = excluded.value"
+    await db.prepare(query).bind(GC_FILES_CURSOR, cursor).run()
+
+
+async def mark_orphan_candidates(db: D1Database, missing: list[str], present: list[str], now: int):
+    """Note rows seen without an object (keeping when they were first seen),
+    and forget earlier candidates whose object has since appeared."""
+    statements = []
+    if missing:
+        statements.append(
+            db.prepare(
+                "INSERT OR IGNORE INTO gc_orphans (name, seen_at) SELECT value, ?2 FROM json_each(?1)"
+            ).bind(json.dumps(missing), now)
+        )
+    if present:
+        statements.append(
+            db.prepare("DELETE FROM gc_orphans WHERE name IN (SELECT value FROM json_each(?1))").bind(
+                json.dumps(present)
+            )
+        )
+    if statements:
+        await db.batch(to_js(statements))
+
+
+async def list_orphan_candidates(db: D1Database[Dict[str, Any]], seen_before: int, limit: int) -> list[str]:
+    statement = db.prepare("SELECT name FROM gc_orphans WHERE seen_at < ?1 ORDER BY seen_at LIMIT ?2")
+    binding = statement.bind(seen_before, limit)
+    return [row["name"] for row in make_py(await binding.all())["results"]]
+
+
+async def remove_orphans(db: D1Database, orphans: list[str], recovered: list[str]):
+    """Delete the files rows of confirmed orphans and clear every checked
+    candidate, in one batch."""
+    statements = []
+    if orphans:
+        statements.append(
+            db.prepare("DELETE FROM files WHERE name IN (SELECT value FROM json_each(?1))").bind(json.dumps(orphans))
+        )
+    if orphans or recovered:
+        statements.append(
+            db.prepare("DELETE FROM gc_orphans WHERE name IN (SELECT value FROM json_each(?1))").bind(
+                json.dumps(orphans + recovered)
+            )
+        )
+    if statements:
+        await db.batch(to_js(statements))
 
 
 T = TypeVar('T')
 def make_py(input: T) -> T:
     return input.to_py()
 
+# The names travel as one JSON array parameter, so every page size up to the
+# R2 list maximum of 1000 shares this statement and stays far below D1's
+# 100 bound parameter limit.
+CHECK_MULTIPLE_FILE_ACCESS = f"""
+    SELECT name, visibility,
+     CASE
+        WHEN visibility = 'PUBLIC' THEN 1
+        WHEN visibility = 'INTERNAL' AND company_id = ?2 THEN 1
+        WHEN visibility = 'PRIVATE' AND employee_id = ?1 AND company_id = ?2 THEN 1
+        ELSE 0
+     END as has_access
+    FROM files
+    WHERE name IN (SELECT value FROM json_each(?3)) AND {EMPLOYEE_EXISTS.format(id=1, company_id=2)}
+    """
+
+
 async def check_multiple_file_access(
     db: D1Database[Dict[str, Any]], file_names: list[str], employee: Employee
 ) -> dict[str, bool]:
     if not file_names or not employee.id or not employee.company_id:
         raise ValueError("File names, employee ID, and company ID are required")
-    
-    if not await does_employee_exist(db, employee.id, employee.company_id): # type: ignore
-        return {file_name: False for file_name in file_names}
 
+    statement = db.prepare(CHECK_MULTIPLE_FILE_ACCESS)
+    binding = statement.bind(employee.id, employee.company_id, json.dumps(file_names))
+    results = make_py(await binding.all())
+
+    return {row['name']: bool(row['has_access']) for row in results['results']}
+
+
+async def get_multiple_file_visibilities(
+    db: D1Database[Dict[str, Any]], file_names: list[str], employee: Employee
+) -> dict[str, str]:
+    """Visibility of each named file the employee may read, in one query.
+    Missing and unreadable files are left out."""
+    if not file_names or not employee.id or not employee.company_id:
+        raise ValueError("File names, employee ID, and company ID are required")
+
+    statement = db.prepare(CHECK_MULTIPLE_FILE_ACCESS)
+    binding = statement.bind(employee.id, employee.company_id, json.dumps(file_names))
+    results = make_py(await binding.all())
+
+    return {row['name']: row['visibility'] for row in results['results'] if row['has_access']}
+
+# Files may be deleted by their owner, or by an ADMIN of the owning company.
+CHECK_MULTIPLE_FILE_DELETE = f"""
+    SELECT name FROM files
+    WHERE name IN (SELECT value FROM json_each(?3))
+      AND company_id = ?2
+      AND (employee_id = ?1 OR ?4 >= {int(PermissionLevel.ADMIN)})
+      AND {EMPLOYEE_EXISTS.format(id=1, company_id=2)}
+    """
+
+
+async def get_deletable_file_names(
+    db: D1Database[Dict[str, Any]], file_names: list[str], employee: Employee
+) -> set[str]:
+    if not file_names or not employee.id or not employee.company_id:
+        raise ValueError("File names, employee ID, and company ID are required")
+
+    statement = db.prepare(CHECK_MULTIPLE_FILE_DELETE)
+    binding = statement.bind(
+        employee.id, employee.company_id, json.dumps(file_names), int(employee.permission_level)
+    )
+    results = make_py(await binding.all())
+
+    return {row['name'] for row in results['results']}
+
+
+async def list_visible_files(
+    db: D1Database[Dict[str, Any]],
+    employee: Employee,
+    limit: int,
+    after: str = "",
+    before: str | None = None,
+) -> list[dict[str, Any]]:
+    """The first ``limit`` files after ``after`` (by name) the employee can read.
+
+    Same rules as check_multiple_file_access, but split into one branch per
+    visibility so each branch is an ordered range scan on its own index.
+    ``before`` bounds the names from above, e.g. to stay inside a key prefix.
+    """
+    upper = "AND name < ?5" if before is not None else ""
+    query = f"""
+    SELECT name, visibility FROM (
+        SELECT * FROM (
+            SELECT name, visibility FROM files
+            WHERE visibility = 'PUBLIC' AND name > ?3 {upper}
+            ORDER BY name LIMIT ?4
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT name, visibility FROM files
+            WHERE company_id = ?2 AND visibility = 'INTERNAL' AND name > ?3 {upper}
+            ORDER BY name LIMIT ?4
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT name, visibility FROM files
+            WHERE company_id = ?2 AND employee_id = ?1 AND visibility = 'PRIVATE' AND name > ?3 {upper}
+            ORDER BY name LIMIT ?4
+        )
+    )
+    WHERE {EMPLOYEE_EXISTS.format(id=1, company_id=2)}
+    ORDER BY name
+    LIMIT ?4
+    """
+    params = [employee.id, employee.company_id, after, limit]
+    if before is not None:
+        params.append(before)
+    statement = db.prepare(query)
+    binding = statement.bind(*params)
+    results = make_py(await binding.all())
+    return results["results"]
+
+
+async def list_unprefixed_file_names(
+    db: D1Database[Dict[str, Any]], company_id: str, prefix: str, limit: int
+) -> list[str]:
+    """Names of the company's files not yet stored under ``prefix``.
+
+    Names whose prefixed form is already taken are left out; migrating them
+    would clobber the newer object.
+    """
+    query = """
+    SELECT name FROM files
+    WHERE company_id = ?1
+      AND substr(name, 1, length(?2)) != ?2
+      AND NOT EXISTS (SELECT 1 FROM files AS taken WHERE taken.name = ?2 || files.name)
+    ORDER BY name
+    LIMIT ?3
+    """
+    statement = db.prepare(query)
+    binding = statement.bind(company_id, prefix, limit)
+    results = make_py(await binding.all())
+    return [row["name"] for row in results["results"]]
+
+
+async def list_unprefixed_files(db: D1Database[Dict[str, Any]], limit: int) -> list[tuple[str, str]]:
+    """``(name, company_id)`` of files of every company not yet stored under
+    their ``<company_id>/`` prefix, skipping names whose prefixed form is taken."""
     query = """
-    SELECT name,
+    SELECT name, company_id FROM files
+    WHERE substr(name, 1, length(company_id) + 1) != company_id || '/'
+      AND NOT EXISTS (SELECT 1 FROM files AS taken WHERE taken.name = files.company_id || '/' || files.name)
+    ORDER BY name
+    LIMIT ?1
+    """
+    statement = db.prepare(query)
+    binding = statement.bind(limit)
+    results = make_py(await binding.all())
+    return [(row["name"], row["company_id"]) for row in results["results"]]
+
+
+async def get_unmigrated_file_visibility(
+    db: D1Database[str], file_name: str, employee: Employee, prefix: str
+) -> str | None:
+    """Like ``get_file_visibility`` for a file of the employee's company that
+    still waits to be moved under ``prefix``."""
+    query = f"""
+    SELECT visibility,
      CASE
-        WHEN visibility = 'PUBLIC' THEN 1
-        WHEN visibility = 'INTERNAL' AND company_id = ?2 THEN 1
-        WHEN visibility = 'PRIVATE' AND employee_id = ?1 AND company_id = ?2 THEN 1
+        WHEN visibility IN ('PUBLIC', 'INTERNAL') THEN 1
+        WHEN visibility = 'PRIVATE' AND employee_id = ?2 THEN 1
         ELSE 0
-     END as has_access
+     END AS has_access
     FROM files
-    WHERE name IN ({})
-    """.format(','.join(['?'+str(i+3) for i in range(len(file_names))]))
-
+    WHERE name = ?1 AND company_id = ?3
+      AND substr(name, 1, length(?4)) != ?4
+      AND NOT EXISTS (SELECT 1 FROM files AS taken WHERE taken.name = ?4 || files.name)
+      AND {EMPLOYEE_EXISTS.format(id=2, company_id=3)}
+    """
     statement = db.prepare(query)
-    binding = statement.bind(employee.id, employee.company_id, *file_names)
-    results = make_py(await binding.all())
+    binding = statement.bind(file_name, employee.id, employee.company_id, prefix)
+    result = await binding.first()
+    if result is None or not result.has_access:
+        return None
+    return result.visibility
+
+
+async def rename_file_accesses(db: D1Database[FileAccess], renames: list[tuple[str, str]]):
+    """Apply ``(new_name, old_name)`` renames in one batch (one transaction)."""
+    if not renames:
+        return
+    statement = db.prepare("UPDATE files SET id = ?1, name = ?1 WHERE name = ?2")
+    await db.batch(to_js([statement.bind(new_name, old_name) for new_name, old_name in renames]))
+
+
+# Names per DELETE statement; each chunk is one JSON parameter.
+REMOVE_FILE_ACCESS_CHUNK = 1000
+
+
+async def remove_file_accesses(db: D1Database[FileAccess], file_names: list[str]):
+    """Delete the rows for ``file_names`` in one batch (one transaction)."""
+    if not file_names:
+        return
+    statement = db.prepare("DELETE FROM files WHERE name IN (SELECT value FROM json_each(?1))")
+    await db.batch(
+        to_js(
+            [
+                statement.bind(json.dumps(file_names[start : start + REMOVE_FILE_ACCESS_CHUNK]))
+                for start in range(0, len(file_names), REMOVE_FILE_ACCESS_CHUNK)
+            ]
+        )
+    )
 
-    return {row['name']: bool(row['has_access']) for row in results['results']}
 
 async def remove_file_access(db: D1Database[FileAccess], file_access: FileAccess):
-    query = "DELETE FROM files WHERE file_id = ?1 and employee_id = ?2 and company_id = ?3"
+    query = "DELETE FROM files WHERE name = ?1 and employee_id = ?2 and company_id = ?3"
     statement = db.prepare(query)
     binding = statement.bind(
         file_access.key, file_access.employee_id, file_access.company_id
@@ -32,4 +32,31 @@ def encode_jwt(payload: Dict[str, Any], secret: str) -> str:
     message = f"{header_b64}.{payload_b64}".encode()
     signature = hmac.new(secret.encode(), message, hashlib.sha256).digest()
     signature_b64 = base64.urlsafe_b64encode(signature).rstrip(b'=').decode()
-    return f"{header_b64}.{payload_b64}.{signature_b64}"
\ No newline at end of file
+    return f"{header_b64}.{payload_b64}.{signature_b64}"
+
+
+# Signed download URLs and upload sessions share SECRET with the JWTs; the
+# context keeps a token of one kind from verifying as another.
+SIGNED_TOKEN_CONTEXT = b"signed-url."
+UPLOAD_TOKEN_CONTEXT = b"upload-session."
+
+
+def encode_signed_token(payload: Dict[str, Any], secret: str, context: bytes = SIGNED_TOKEN_CONTEXT) -> str:
+    payload_b64 = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).rstrip(b'=').decode()
+    signature = hmac.new(secret.encode(), context + payload_b64.encode(), hashlib.sha256).digest()
+    signature_b64 = base64.urlsafe_b64encode(signature).rstrip(b'=').decode()
+    return f"{payload_b64}.{signature_b64}"
+
+
+def decode_signed_token(token: str, secret: str, context: bytes = SIGNED_TOKEN_CONTEXT) -> Dict[str, Any]:
+    try:
+        payload_b64, signature_b64 = token.split('.')
+        signature = base64.urlsafe_b64decode(signature_b64 + '==')
+        expected_signature = hmac.new(
+            secret.encode('utf-8'), context + payload_b64.encode('utf-8'), hashlib.sha256
+        ).digest()
+        if not hmac.compare_digest(signature, expected_signature):
+            raise ValueError("Invalid signature")
+        return json.loads(base64.urlsafe_b64decode(payload_b64 + '==').decode('utf-8'))
+    except Exception as e:
+        raise ValueError(f"Decoding signed token: {e}")
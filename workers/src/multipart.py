@@ -0,0 +1,155 @@
+"""Incremental multipart/form-data reading, so uploads can be piped into R2
+without holding the whole body in memory."""
+
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+CRLF = b"\r\n"
+# Largest preamble, part header block or plain form field read into memory.
+MAX_FIELD_SIZE = 64 * 1024
+
+
+class MultipartError(ValueError):
+    pass
+
+
+def multipart_boundary(content_type: str | None) -> bytes:
+    mime_type, _, params = (content_type or "").partition(";")
+    if mime_type.strip().lower() != "multipart/form-data":
+        raise MultipartError("Multipart form-data required")
+    for param in params.split(";"):
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary" and value:
+            return value.strip('"').encode("latin-1")
+    raise MultipartError("Multipart boundary missing")
+
+
+def parse_part_headers(block: bytes) -> tuple[str, str | None, str]:
+    """``(name, filename, content_type)`` from a part's header block."""
+    name, filename, content_type = None, None, "application/octet-stream"
+    for line in block.decode("utf-8").split("\r\n"):
+        header, _, value = line.partition(":")
+        header = header.strip().lower()
+        if header == "content-type":
+            content_type = value.strip()
+        elif header == "content-disposition":
+            for param in value.split(";")[1:]:
+                key, _, param_value = param.strip().partition("=")
+                if key.lower() == "name":
+                    name = param_value.strip('"')
+                elif key.lower() == "filename":
+                    filename = param_value.strip('"')
+    if name is None:
+        raise MultipartError("Form part without a name")
+    return name, filename, content_type
+
+
+class MultipartReader:
+    """Reads a multipart body from an async iterator of byte chunks.
+
+    ``read_fields`` returns the plain fields that come before the first file,
+    leaving the reader at the start of the file's data. The file can then be
+    streamed with ``FilePart.chunks`` while only about one chunk is held.
+    """
+
+    def __init__(self, chunks: AsyncIterator[bytes], boundary: bytes, content_length: int | None = None):
+        self._chunks = chunks
+        self._buffer = bytearray()
+        self._delimiter = b"--" + boundary
+        self._consumed = 0
+        self.content_length = content_length
+        self.closing = CRLF + self._delimiter + b"--" + CRLF
+
+    async def _fill(self) -> bool:
+        try:
+            chunk = await anext(self._chunks)
+        except StopAsyncIteration:
+            return False
+        self._buffer += chunk
+        return True
+
+    def _take(self, size: int) -> bytes:
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self._consumed += size
+        return data
+
+    async def _read_exact(self, size: int) -> bytes:
+        while len(self._buffer) < size:
+            if not await self._fill():
+                raise MultipartError("Unexpected end of form data")
+        return self._take(size)
+
+    async def _read_until(self, marker: bytes, limit: int = MAX_FIELD_SIZE) -> bytes:
+        """The bytes before ``marker``; the marker itself is consumed too."""
+        start = 0
+        while (index := self._buffer.find(marker, start)) < 0:
+            if len(self._buffer) > limit:
+                raise MultipartError("Form field too large")
+            start = max(0, len(self._buffer) - len(marker) + 1)
+            if not await self._fill():
+                raise MultipartError("Unexpected end of form data")
+        data = self._take(index)
+        self._take(len(marker))
+        return data
+
+    async def _next_part(self) -> tuple[str, str | None, str] | None:
+        """Headers of the next part, or None after the closing delimiter."""
+        after_delimiter = await self._read_exact(2)
+        if after_delimiter == b"--":
+            return None
+        if after_delimiter != CRLF:
+            raise MultipartError("Malformed form data")
+        return parse_part_headers(await self._read_until(CRLF + CRLF))
+
+    async def _read_fields_until_file(self, fields: dict[str, str]) -> tuple[dict[str, str], "FilePart | None"]:
+        while (part := await self._next_part()) is not None:
+            name, filename, content_type = part
+            if filename is not None:
+                return fields, FilePart(self, name, filename, content_type)
+            fields[name] = (await self._read_until(CRLF + self._delimiter)).decode("utf-8")
+        return fields, None
+
+    async def read_fields(self) -> tuple[dict[str, str], "FilePart | None"]:
+        await self._read_until(self._delimiter)
+        return await self._read_fields_until_file({})
+
+
+@dataclass
+class FilePart:
+    reader: MultipartReader
+    name: str
+    filename: str
+    type: str
+
+    @property
+    def length(self) -> int | None:
+        """Size of the file's data, assuming it is the last part and the body
+        ends with the usual CRLF after the closing delimiter."""
+        if self.reader.content_length is None:
+            return None
+        length = self.reader.content_length - self.reader._consumed - len(self.reader.closing)
+        if length < 0:
+            raise MultipartError("Content-Length is shorter than the form data")
+        return length
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """The file's data as it arrives. The closing delimiter is held back
+        and checked once the body ends; anything else after the file raises."""
+        reader = self.reader
+        tail = len(reader.closing)
+        while True:
+            if len(reader._buffer) > tail:
+                yield reader._take(len(reader._buffer) - tail)
+            if not await reader._fill():
+                break
+        if bytes(reader._buffer) != reader.closing:
+            raise MultipartError("The file must be the last form field")
+
+    async def read(self, limit: int) -> tuple[bytes, dict[str, str]]:
+        """The file's data and any plain fields sent after it, all buffered."""
+        data = await self.reader._read_until(CRLF + self.reader._delimiter, limit)
+        fields, another_file = await self.reader._read_fields_until_file({})
+        if another_file is not None:
+            raise MultipartError("Only one file can be uploaded per request")
+        return data, fields
@@ -0,0 +1,84 @@
+# type: ignore
+"""Response building shared by every route.
+
+CORS headers are converted to JS objects once per isolate and error bodies are
+serialized once per status, so a response costs one ``Response`` call instead
+of a ``Headers`` object, three ``set`` calls and a ``to_js`` conversion.
+"""
+
+from js import Headers, Object, Response
+from pyodide.ffi import to_js
+import json
+
+ALLOW_HEADERS = "Content-Type, Authorization, X-API-Key, Range, If-None-Match, If-Modified-Since"
+EXPOSE_HEADERS = "Content-Range, Content-Length, Accept-Ranges, ETag, Last-Modified"
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, HEAD, POST, PUT, DELETE, OPTIONS",
+    "Access-Control-Allow-Headers": ALLOW_HEADERS,
+}
+PREFLIGHT_HEADERS = {**CORS_HEADERS, "Access-Control-Max-Age": "86400"}
+DOWNLOAD_HEADERS = {
+    **CORS_HEADERS,
+    "Access-Control-Allow-Methods": "GET",
+    "Access-Control-Expose-Headers": EXPOSE_HEADERS,
+}
+JSON_HEADERS = {**CORS_HEADERS, "Content-Type": "application/json"}
+
+ERROR_MESSAGES = {
+    400: "Invalid request",
+    401: "Unauthorized",
+    403: "Permission denied",
+    404: "Not found",
+    405: "Method not allowed",
+    500: "Internal server error",
+}
+
+
+def _js_headers(headers: dict[str, str]):
+    return to_js(headers, dict_converter=Object.fromEntries)
+
+
+# Response and Headers constructors copy their init, so these are never mutated.
+_CORS_INIT = _js_headers(CORS_HEADERS)
+_PREFLIGHT_INIT = _js_headers(PREFLIGHT_HEADERS)
+_DOWNLOAD_INIT = _js_headers(DOWNLOAD_HEADERS)
+_JSON_INIT = _js_headers(JSON_HEADERS)
+ERROR_BODIES = {status: json.dumps({"error": message}) for status, message in ERROR_MESSAGES.items()}
+
+
+def cors_headers():
+    """A fresh ``Headers`` with the CORS headers, for responses that add more."""
+    return Headers.new(_CORS_INIT)
+
+
+def download_headers():
+    """CORS headers for signed URL downloads, which also expose range and
+    validator headers to browsers."""
+    return Headers.new(_DOWNLOAD_INIT)
+
+
+def preflight_response():
+    return Response.new(None, status=204, headers=_PREFLIGHT_INIT)
+
+
+def json_response(data, status: int = 200):
+    """``data`` is a JS value, or a Python one already passed through ``to_js``."""
+    return Response.json(data, status=status, headers=_CORS_INIT)
+
+
+def json_text_response(body: str, status: int = 200):
+    """A body already serialized with ``json.dumps``: one string crosses into
+    JS instead of an object tree built by ``to_js``."""
+    return Response.new(body, status=status, headers=_JSON_INIT)
+
+
+def error_response(status: int, message: str | None = None):
+    """``{"error": message}``, falling back to the status's stock message."""
+    body = ERROR_BODIES[status] if message is None else json.dumps({"error": message})
+    return Response.new(body, status=status, headers=_JSON_INIT)
+
+
+def empty_response(status: int, headers=None):
+    return Response.new(None, status=status, headers=_CORS_INIT if headers is None else headers)
@@ -0,0 +1,1331 @@
+"""The test_worker.py scenarios run in-process against the local emulator.
+
+Python Workers run on Pyodide's CPython 3.12, so these tests need 3.12+:
+
+    cd workers && python3.12 -m unittest test_emulator
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+from uuid import uuid4
+
+from emulator import BASE_URL, LocalWorker, encode_multipart, load_worker, measure
+
+SECRET = "emulator-secret"
+
+
+def make_api_key(employee_id: str = "test", company_id: str = "test", permission_level: int = 3) -> str:
+    jwt = load_worker("jwt")
+    return jwt.encode_jwt(
+        {
+            "id": employee_id,
+            "company_id": company_id,
+            "exp": time.time() + 86400,
+            "permission_level": permission_level,
+        },
+        SECRET,
+    )
+
+
+@unittest.skipIf(sys.version_info < (3, 12), "Python Workers run Pyodide's Python 3.12")
+class EmulatorTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.worker = LocalWorker.create(self.tmp.name, secret=SECRET, fresh_isolate=True)
+        self.headers = {"X-API-Key": make_api_key()}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def put_file(self, key, content=b"example content", visibility="PUBLIC", headers=None):
+        body, content_type = encode_multipart(
+            {"key": key, "visibility": visibility}, {"file": ("test.txt", content, "text/plain")}
+        )
+        return await self.worker.fetch(
+            "PUT", "/files", {**(headers or self.headers), "content-type": content_type}, body
+        )
+
+
+class TestEmulatedAPI(EmulatorTestCase):
+    async def test_put_and_get_file(self):
+        key = str(uuid4())
+        put = await self.put_file(key)
+        self.assertEqual(put.status, 200)
+        self.assertIn("size", await put.json_py())
+        response = await self.worker.fetch("GET", f"/files?key={key}", self.headers)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers.get("Content-Disposition"), f'attachment; filename="{key}"')
+        self.assertEqual(await response.body.read_all(), b"example content")
+
+    async def test_list_files(self):
+        for _ in range(3):
+            await self.put_file(str(uuid4()))
+        response = await self.worker.fetch("GET", "/files?limit=2", self.headers)
+        self.assertEqual(response.status, 206)
+        self.assertEqual(len((await response.json_py())["objects"]), 2)
+
+    async def test_signed_url_is_single_use(self):
+        key = f"{uuid4()}.txt"
+        await self.put_file(key)
+        token_response = await self.worker.fetch("GET", f"/download/{key}/token", self.headers)
+        self.assertEqual(token_response.status, 200)
+        token = (await token_response.json_py())["token"]
+        download = await self.worker.fetch("GET", f"/download/{key}?token={token}")
+        self.assertEqual(download.status, 200)
+        self.assertEqual(await download.body.read_all(), b"example content")
+        again = await self.worker.fetch("GET", f"/download/{key}?token={token}")
+        self.assertEqual(again.status, 400)
+
+    async def test_multi_part_upload_e2e(self):
+        key = str(uuid4())
+        start = await self.worker.fetch(
+            "POST", "/files", self.headers, json.dumps({"key": key, "visibility": "PUBLIC"}).encode()
+        )
+        self.assertEqual(start.status, 200)
+        upload_id = (await start.json_py())["uploadId"]
+        body, content_type = encode_multipart(
+            {"key": key, "upload_id": upload_id, "part": 1}, {"file": ("part1.txt", b"example content", "text/plain")}
+        )
+        part = await self.worker.fetch("PUT", "/files", {**self.headers, "content-type": content_type}, body)
+        self.assertEqual(part.status, 201)
+        uploaded_part = await part.json_py()
+        self.assertIn("etag", uploaded_part)
+        complete = await self.worker.fetch(
+            "POST",
+            f"/files?upload_id={upload_id}&key={key}&visibility=PUBLIC",
+            self.headers,
+            json.dumps([uploaded_part]).encode(),
+        )
+        self.assertEqual(complete.status, 200)
+        self.assertIn("etag", await complete.json_py())
+
+    async def test_file_isolation(self):
+        other = {"X-API-Key": make_api_key("test2", "test2")}
+        private_key = str(uuid4())
+        await self.put_file(private_key, visibility="PRIVATE", headers=other)
+        public_key = str(uuid4())
+        await self.put_file(public_key, visibility="PUBLIC")
+        await self.put_file(str(uuid4()), visibility="PRIVATE")
+        response = await self.worker.fetch("GET", "/files?limit=4", other)
+        self.assertEqual(response.status, 206)
+        listed = [o["key"] for o in (await response.json_py())["objects"]]
+        self.assertEqual(sorted(listed), sorted([private_key, public_key]))
+
+    async def test_missing_api_key(self):
+        response = await self.worker.fetch("GET", "/files?limit=1")
+        self.assertEqual(response.status, 401)
+
+    async def test_invalid_jwt(self):
+        response = await self.worker.fetch("GET", "/files?limit=1", {"X-API-Key": "invalid_jwt"})
+        self.assertEqual(response.status, 401)
+
+    async def test_invalid_url_path(self):
+        response = await self.worker.fetch("GET", "/invalid", self.headers)
+        self.assertEqual(response.status, 404)
+
+    async def test_errors_are_json_objects_with_cors(self):
+        for method, path, headers, status in (
+            ("GET", "/files?limit=1", {}, 401),
+            ("GET", "/invalid", self.headers, 404),
+            ("POST", "/download/key.txt", self.headers, 405),
+            ("PATCH", "/files", self.headers, 405),
+        ):
+            with self.subTest(method=method, path=path):
+                response = await self.worker.fetch(method, path, headers)
+                self.assertEqual(response.status, status)
+                self.assertIsInstance((await response.json_py())["error"], str)
+                self.assertEqual(response.headers.get("Content-Type"), "application/json")
+                self.assertEqual(response.headers.get("Access-Control-Allow-Origin"), "*")
+
+    async def test_responses_get_their_own_headers(self):
+        key = str(uuid4())
+        await self.put_file(key)
+        head = await self.worker.fetch("HEAD", f"/files?key={key}", self.headers)
+        self.assertEqual(head.headers.get("Content-Length"), "15")
+        error = await self.worker.fetch("GET", "/files", self.headers)
+        self.assertIsNone(error.headers.get("Content-Length"))
+        preflight = await self.worker.fetch("OPTIONS", "/files")
+        self.assertEqual(preflight.status, 204)
+        self.assertEqual(preflight.headers.get("Access-Control-Max-Age"), "86400")
+
+    async def test_get_without_params(self):
+        response = await self.worker.fetch("GET", "/files", self.headers)
+        self.assertEqual(response.status, 400)
+
+    async def test_invalid_list_params(self):
+        for query in ("limit=abc", "limit=0", "source=d1&limit=2000", "fill=1&limit=1.5"):
+            with self.subTest(query):
+                response = await self.worker.fetch("GET", f"/files?{query}", self.headers)
+                self.assertEqual(response.status, 400)
+                self.assertIn("Limit", (await response.json_py())["error"])
+
+    async def test_put_non_multipart(self):
+        response = await self.worker.fetch(
+            "PUT",
+            "/files",
+            {**self.headers, "content-type": "application/json"},
+            json.dumps({"key": str(uuid4()), "visibility": "PUBLIC", "content": "example content"}).encode(),
+        )
+        self.assertEqual(response.status, 400)
+        self.assertEqual((await response.json_py())["error"], "Multipart form-data required")
+
+
+class TestRangeRequests(EmulatorTestCase):
+    content = bytes(range(256)) * 4
+
+    async def asyncSetUp(self):
+        await self.put_file("video.mp4", content=self.content)
+
+    async def get(self, range_header, path="/files?key=video.mp4", headers=None):
+        return await self.worker.fetch("GET", path, {**(headers or self.headers), "Range": range_header})
+
+    async def test_full_object_advertises_ranges(self):
+        response = await self.worker.fetch("GET", "/files?key=video.mp4", self.headers)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers.get("Accept-Ranges"), "bytes")
+        self.assertEqual(response.headers.get("Content-Length"), "1024")
+
+    async def test_byte_ranges(self):
+        cases = [
+            ("bytes=0-99", "bytes 0-99/1024", self.content[:100]),
+            ("bytes=1000-", "bytes 1000-1023/1024", self.content[1000:]),
+            ("bytes=-24", "bytes 1000-1023/1024", self.content[-24:]),
+            ("bytes=1000-5000", "bytes 1000-1023/1024", self.content[1000:]),
+        ]
+        for range_header, content_range, body in cases:
+            with self.subTest(range_header):
+                response = await self.get(range_header)
+                self.assertEqual(response.status, 206)
+                self.assertEqual(response.headers.get("Content-Range"), content_range)
+                self.assertEqual(response.headers.get("Content-Length"), str(len(body)))
+                self.assertEqual(await response.body.read_all(), body)
+
+    async def test_unsupported_ranges_serve_whole_object(self):
+        for range_header in ("bytes=0-1,5-6", "items=0-1", "bytes=9-2"):
+            with self.subTest(range_header):
+                response = await self.get(range_header)
+                self.assertEqual(response.status, 200)
+                self.assertEqual(len(await response.body.read_all()), 1024)
+
+    async def test_unsatisfiable_range(self):
+        response = await self.get("bytes=4096-")
+        self.assertEqual(response.status, 416)
+        self.assertEqual(response.headers.get("Content-Range"), "bytes */1024")
+
+    async def test_ranges_check_file_access(self):
+        await self.put_file("private.mp4", content=self.content, visibility="PRIVATE")
+        other = {"X-API-Key": make_api_key("test2", "test2")}
+        for path, range_header in (
+            ("/files?key=private.mp4", "bytes=0-99"),
+            ("/files?key=private.mp4&range=bytes=0-99", None),
+            ("/files?key=private.mp4", "bytes=4096-"),
+        ):
+            with self.subTest(path=path, range_header=range_header):
+                headers = other if range_header is None else {**other, "Range": range_header}
+                response = await self.worker.fetch("GET", path, headers)
+                self.assertEqual(response.status, 403)
+                self.assertIsNone(response.headers.get("Content-Range"))
+
+    async def test_range_on_signed_download(self):
+        token = await (await self.worker.fetch("GET", "/download/video.mp4/token", self.headers)).json_py()
+        response = await self.get("bytes=10-19", f"/download/video.mp4?token={token['token']}", {})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.headers.get("Content-Range"), "bytes 10-19/1024")
+        self.assertEqual(await response.body.read_all(), self.content[10:20])
+
+
+class TestConditionalRequests(EmulatorTestCase):
+    async def asyncSetUp(self):
+        await self.put_file("dashboard.json", content=b'{"widgets": []}')
+        self.first = await self.worker.fetch("GET", "/files?key=dashboard.json", self.headers)
+        await self.first.body.read_all()
+
+    async def test_validators_are_sent(self):
+        self.assertTrue(self.first.headers.get("ETag").startswith('"'))
+        self.assertIsNotNone(self.first.headers.get("Last-Modified"))
+
+    async def test_if_none_match(self):
+        etag = self.first.headers.get("ETag")
+        response = await self.worker.fetch("GET", "/files?key=dashboard.json", {**self.headers, "If-None-Match": etag})
+        self.assertEqual((response.status, response.body), (304, None))
+        self.assertEqual(response.headers.get("ETag"), etag)
+        changed = await self.worker.fetch("GET", "/files?key=dashboard.json", {**self.headers, "If-None-Match": '"x"'})
+        self.assertEqual(changed.status, 200)
+
+    async def test_if_modified_since(self):
+        headers = {**self.headers, "If-Modified-Since": self.first.headers.get("Last-Modified")}
+        response = await self.worker.fetch("GET", "/files?key=dashboard.json", headers)
+        self.assertEqual(response.status, 304)
+        headers["If-Modified-Since"] = "Mon, 01 Jan 2001 00:00:00 GMT"
+        response = await self.worker.fetch("GET", "/files?key=dashboard.json", headers)
+        self.assertEqual(response.status, 200)
+
+    async def test_conditions_check_file_access(self):
+        await self.put_file("payroll.json", content=b"{}", visibility="PRIVATE")
+        other = {"X-API-Key": make_api_key("test2", "test2")}
+        for condition in ({"If-None-Match": '"x"'}, {"If-Modified-Since": "Mon, 01 Jan 2001 00:00:00 GMT"}):
+            with self.subTest(condition):
+                response = await self.worker.fetch("GET", "/files?key=payroll.json", {**other, **condition})
+                self.assertEqual(response.status, 403)
+                self.assertIsNone(response.headers.get("ETag"))
+                self.assertIsNone(response.headers.get("Last-Modified"))
+
+    async def test_signed_download_revalidation(self):
+        token = await (await self.worker.fetch("GET", "/download/dashboard.json/token", self.headers)).json_py()
+        headers = {"If-None-Match": self.first.headers.get("ETag")}
+        response = await self.worker.fetch("GET", f"/download/dashboard.json?token={token['token']}", headers)
+        self.assertEqual((response.status, response.body), (304, None))
+
+
+class TestFileMetadata(EmulatorTestCase):
+    async def asyncSetUp(self):
+        await self.put_file("report.pdf", content=b"x" * 2048, visibility="PRIVATE")
+
+    async def test_head_returns_headers_without_body(self):
+        response, metrics = await self.worker.fetch_measured("HEAD", "/files?key=report.pdf", self.headers)
+        self.assertEqual((response.status, response.body), (200, None))
+        self.assertEqual(response.headers.get("Content-Length"), "2048")
+        self.assertTrue(response.headers.get("ETag"))
+        self.assertTrue(response.headers.get("Last-Modified"))
+        self.assertEqual((metrics.calls["r2.head"], metrics.calls["r2.get"]), (1, 0))
+
+    async def test_meta_json(self):
+        response = await self.worker.fetch("GET", "/files?key=report.pdf&meta=1", self.headers)
+        self.assertEqual(response.status, 200)
+        meta = await response.json_py()
+        self.assertEqual((meta["key"], meta["size"]), ("report.pdf", 2048))
+        self.assertIn("customMetadata", meta)
+
+    async def test_acl_is_checked(self):
+        other = {"X-API-Key": make_api_key("other", "other")}
+        response = await self.worker.fetch("HEAD", "/files?key=report.pdf", other)
+        self.assertEqual(response.status, 403)
+        response = await self.worker.fetch("GET", "/files?key=report.pdf&meta=1", other)
+        self.assertEqual(response.status, 403)
+
+    async def test_missing_object(self):
+        await self.worker.env.BUCKET.delete("report.pdf")
+        response = await self.worker.fetch("HEAD", "/files?key=report.pdf", self.headers)
+        self.assertEqual(response.status, 404)
+
+
+class TestDownloadPassThrough(EmulatorTestCase):
+    async def asyncSetUp(self):
+        response = await self.worker.fetch(
+            "PUT",
+            "/files/data.csv?visibility=PUBLIC",
+            {**self.headers, "content-type": "text/csv"},
+            b"a,b\n1,2\n",
+        )
+        self.assertEqual(response.status, 200)
+
+    async def test_body_and_metadata_are_not_converted(self):
+        get_result = sys.modules["emulator.r2"].GetResult
+        with mock.patch.object(get_result, "to_py", side_effect=AssertionError("converted")):
+            response = await self.worker.fetch("GET", "/files?key=data.csv", self.headers)
+            token = await (await self.worker.fetch("GET", "/download/data.csv/token", self.headers)).json_py()
+            download = await self.worker.fetch("GET", f"/download/data.csv?token={token['token']}")
+        for served in (response, download):
+            self.assertEqual(served.status, 200)
+            self.assertEqual(served.headers.get("Content-Type"), "text/csv")
+            self.assertEqual(served.headers.get("Content-Length"), "8")
+            self.assertEqual(await served.body.read_all(), b"a,b\n1,2\n")
+
+    async def test_uploaded_html_is_never_rendered(self):
+        await self.worker.fetch(
+            "PUT", '/files/x"y.html?visibility=PUBLIC', {**self.headers, "content-type": "text/html"}, b"<script>"
+        )
+        token = await (await self.worker.fetch("GET", '/download/x"y.html/token', self.headers)).json_py()
+        download = await self.worker.fetch("GET", f'/download/x"y.html?token={token["token"]}')
+        response = await self.worker.fetch("GET", '/files?key=x"y.html', self.headers)
+        for served in (download, response):
+            self.assertEqual(served.headers.get("Content-Disposition"), 'attachment; filename="x\\"y.html"')
+            self.assertEqual(served.headers.get("X-Content-Type-Options"), "nosniff")
+
+    async def test_head_matches_get(self):
+        head = await self.worker.fetch("HEAD", "/files?key=data.csv", self.headers)
+        get = await self.worker.fetch("GET", "/files?key=data.csv", self.headers)
+        for name in ("Content-Type", "ETag", "Last-Modified", "Content-Length"):
+            self.assertEqual(head.headers.get(name), get.headers.get(name), name)
+
+
+class TestStreamingUploads(EmulatorTestCase):
+    BOUNDARY = "streamboundary"
+
+    def file_first_body(self, key, content, trailing=b""):
+        body = (
+            f'--{self.BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{key}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode() + content
+        body += f'\r\n--{self.BOUNDARY}\r\nContent-Disposition: form-data; name="key"\r\n\r\n{key}'.encode()
+        body += f"\r\n--{self.BOUNDARY}--\r\n".encode() + trailing
+        return body
+
+    async def test_upload_is_streamed_without_form_data(self):
+        content = bytes(range(256)) * 4096
+        with mock.patch("emulator.js_shim.Request.formData", side_effect=AssertionError("buffered")):
+            response = await self.put_file("big.bin", content=content)
+        self.assertEqual(response.status, 200)
+        self.assertEqual((await response.json_py())["size"], len(content))
+        stored = await self.worker.env.BUCKET.get("big.bin")
+        self.assertEqual(await stored.body.read_all(), content)
+
+    async def test_reader_holds_about_one_chunk(self):
+        multipart = load_worker("multipart")
+        content = bytes(range(256)) * 4096
+        body, content_type = encode_multipart({"key": "a.bin"}, {"file": ("a.bin", content, "text/plain")})
+        pulled = 0
+
+        async def chunks():
+            nonlocal pulled
+            for start in range(0, len(body), 1000):
+                pulled += 1
+                yield body[start : start + 1000]
+
+        reader = multipart.MultipartReader(chunks(), multipart.multipart_boundary(content_type), len(body))
+        fields, file = await reader.read_fields()
+        self.assertEqual((fields, file.length), ({"key": "a.bin"}, len(content)))
+        received, pulled_at_first_chunk = [], None
+        async for chunk in file.chunks():
+            pulled_at_first_chunk = pulled_at_first_chunk or pulled
+            self.assertLessEqual(len(chunk), 1000)
+            received.append(chunk)
+        self.assertLess(pulled_at_first_chunk, 3)
+        self.assertEqual(b"".join(received), content)
+
+    async def test_fields_after_the_file_are_buffered(self):
+        body = self.file_first_body("late.txt", b"late fields")
+        response = await self.worker.fetch(
+            "PUT", "/files", {**self.headers, "content-type": f"multipart/form-data; boundary={self.BOUNDARY}"}, body
+        )
+        self.assertEqual(response.status, 200)
+        get = await self.worker.fetch("GET", "/files?key=late.txt", self.headers)
+        self.assertEqual(await get.body.read_all(), b"late fields")
+
+    async def test_file_must_be_last_when_streamed(self):
+        body, content_type = encode_multipart({"key": "early.txt"}, {"file": ("early.txt", b"data", "text/plain")})
+        body += b"epilogue"
+        response = await self.worker.fetch("PUT", "/files", {**self.headers, "content-type": content_type}, body)
+        self.assertEqual(response.status, 400)
+        self.assertEqual((await response.json_py())["error"], "The file must be the last form field")
+        self.assertIsNone(await self.worker.env.BUCKET.head("early.txt"))
+        retry = await self.put_file("early.txt")
+        self.assertEqual(retry.status, 200)
+
+
+class TestRawUploads(EmulatorTestCase):
+    async def test_put_raw_body(self):
+        response, metrics = await self.worker.fetch_measured(
+            "PUT", "/files/photos/cat.jpg?visibility=PUBLIC", {**self.headers, "content-type": "image/jpeg"}, b"meow"
+        )
+        self.assertEqual(response.status, 200)
+        self.assertEqual((await response.json_py())["key"], "photos/cat.jpg")
+        stored = await self.worker.env.BUCKET.get("photos/cat.jpg")
+        self.assertEqual(await stored.body.read_all(), b"meow")
+        self.assertEqual(stored.httpMetadata.contentType, "image/jpeg")
+        other = await self.worker.fetch("GET", "/files?key=photos/cat.jpg", {"X-API-Key": make_api_key("b", "b")})
+        self.assertEqual(other.status, 200)
+
+    async def test_raw_multipart_upload(self):
+        start = await self.worker.fetch(
+            "POST", "/files", self.headers, json.dumps({"key": "video/a.mp4", "visibility": "PRIVATE"}).encode()
+        )
+        upload_id = (await start.json_py())["uploadId"]
+        parts = []
+        for number, chunk in ((1, b"first "), (2, b"second")):
+            response = await self.worker.fetch(
+                "PUT", f"/files/video/a.mp4/parts/{number}?upload_id={upload_id}", self.headers, chunk
+            )
+            self.assertEqual(response.status, 201)
+            parts.append(await response.json_py())
+        complete = await self.worker.fetch(
+            "POST",
+            f"/files?upload_id={upload_id}&key=video/a.mp4&visibility=PRIVATE",
+            self.headers,
+            json.dumps(parts).encode(),
+        )
+        self.assertEqual(complete.status, 200)
+        get = await self.worker.fetch("GET", "/files?key=video/a.mp4", self.headers)
+        self.assertEqual(await get.body.read_all(), b"first second")
+
+    async def test_invalid_raw_requests(self):
+        response = await self.worker.fetch("PUT", "/files/a.txt?upload_id=abc", self.headers, b"x")
+        self.assertEqual(response.status, 400)
+        response = await self.worker.fetch("GET", "/files/a.txt", self.headers)
+        self.assertEqual(response.status, 405)
+        await self.worker.fetch("PUT", "/files/a.txt", self.headers, b"x")
+        response = await self.worker.fetch("PUT", "/files/a.txt", self.headers, b"y")
+        self.assertEqual(response.status, 400)
+
+
+class TestUploadSessions(EmulatorTestCase):
+    async def start(self, key="session.bin"):
+        response = await self.worker.fetch(
+            "POST", "/files", self.headers, json.dumps({"key": key, "visibility": "PRIVATE"}).encode()
+        )
+        started = await response.json_py()
+        return started["uploadId"], {"X-Upload-Token": started["uploadToken"]}
+
+    async def test_parts_skip_jwt_and_auth_queries(self):
+        upload_id, session = await self.start()
+        raw, metrics = await self.worker.fetch_measured(
+            "PUT", f"/files/session.bin/parts/1?upload_id={upload_id}", session, b"raw part "
+        )
+        self.assertEqual(raw.status, 201)
+        # the only D1 call records the stored part
+        self.assertEqual(dict(metrics.calls), {"r2.uploadPart": 1, "d1.run": 1})
+        body, content_type = encode_multipart(
+            {"key": "session.bin", "upload_id": upload_id, "part": 2}, {"file": ("p2", b"form part", "text/plain")}
+        )
+        form, metrics = await self.worker.fetch_measured(
+            "PUT", "/files", {**session, "content-type": content_type}, body
+        )
+        self.assertEqual(form.status, 201)
+        self.assertEqual(dict(metrics.calls), {"r2.uploadPart": 1, "d1.run": 1})
+        complete = await self.worker.fetch(
+            "POST",
+            f"/files?upload_id={upload_id}&key=session.bin&visibility=PRIVATE",
+            self.headers,
+            json.dumps([await raw.json_py(), await form.json_py()]).encode(),
+        )
+        self.assertEqual(complete.status, 200)
+        get = await self.worker.fetch("GET", "/files?key=session.bin", self.headers)
+        self.assertEqual(await get.body.read_all(), b"raw part form part")
+
+    async def test_token_is_bound_to_its_upload(self):
+        upload_id, session = await self.start()
+        other_id, _ = await self.start("other.bin")
+        for path in (
+            f"/files/other.bin/parts/1?upload_id={other_id}",
+            f"/files/session.bin/parts/1?upload_id={other_id}",
+            "/files/session.bin",
+        ):
+            with self.subTest(path):
+                response = await self.worker.fetch("PUT", path, session, b"x")
+                self.assertEqual(response.status, 403)
+
+    async def test_invalid_and_expired_tokens(self):
+        upload_id, session = await self.start()
+        path = f"/files/session.bin/parts/1?upload_id={upload_id}"
+        token = session["X-Upload-Token"]
+        tampered = {"X-Upload-Token": token[:-2] + ("AA" if token[-2:] != "AA" else "BB")}
+        response = await self.worker.fetch("PUT", path, tampered, b"x")
+        self.assertEqual(response.status, 401)
+        later = time.time() + self.worker.module.UPLOAD_SESSION_TTL + 5
+        with mock.patch.object(self.worker.module.time, "time", return_value=later):
+            response = await self.worker.fetch("PUT", path, session, b"x")
+        self.assertEqual(response.status, 401)
+        self.worker.env.SIGNED_URL_MODE = "hmac"
+        await self.put_file("public.txt")
+        token_response = await self.worker.fetch("GET", "/download/public.txt/token", self.headers)
+        signed_url_token = (await token_response.json_py())["token"]
+        response = await self.worker.fetch("PUT", path, {"X-Upload-Token": signed_url_token}, b"x")
+        self.assertEqual(response.status, 401)
+
+
+class TestUploadTracking(EmulatorTestCase):
+    async def start(self, key="resume.bin"):
+        response = await self.worker.fetch(
+            "POST", "/files", self.headers, json.dumps({"key": key, "visibility": "INTERNAL"}).encode()
+        )
+        return (await response.json_py())["uploadId"]
+
+    async def put_part(self, upload_id, number, chunk, key="resume.bin"):
+        return await self.worker.fetch("PUT", f"/files/{key}/parts/{number}?upload_id={upload_id}", self.headers, chunk)
+
+    async def test_resume_sends_only_missing_parts(self):
+        upload_id = await self.start()
+        first = await (await self.put_part(upload_id, 1, b"one ")).json_py()
+        await self.put_part(upload_id, 3, b"three")
+        response, metrics = await self.worker.fetch_measured("GET", f"/files/uploads/{upload_id}", self.headers)
+        self.assertEqual(response.status, 200)
+        status = await response.json_py()
+        self.assertEqual((status["key"], status["visibility"]), ("resume.bin", "INTERNAL"))
+        self.assertEqual([part["partNumber"] for part in status["parts"]], [1, 3])
+        self.assertEqual(status["parts"][0]["etag"], first["etag"])
+        self.assertEqual(metrics.calls["d1.all"], 1)
+        missing = await self.worker.fetch(
+            "PUT",
+            f"/files/resume.bin/parts/2?upload_id={upload_id}",
+            {"X-Upload-Token": status["uploadToken"]},
+            b"two ",
+        )
+        self.assertEqual(missing.status, 201)
+        complete = await self.worker.fetch(
+            "POST", f"/files?upload_id={upload_id}&key=resume.bin&visibility=INTERNAL", self.headers, b"[]"
+        )
+        self.assertEqual(complete.status, 200)
+        get = await self.worker.fetch("GET", "/files?key=resume.bin", self.headers)
+        self.assertEqual(await get.body.read_all(), b"one two three")
+        gone = await self.worker.fetch("GET", f"/files/uploads/{upload_id}", self.headers)
+        self.assertEqual(gone.status, 404)
+
+    async def test_reuploaded_part_replaces_etag(self):
+        upload_id = await self.start()
+        await self.put_part(upload_id, 1, b"old")
+        new = await (await self.put_part(upload_id, 1, b"new")).json_py()
+        status = await (await self.worker.fetch("GET", f"/files/uploads/{upload_id}", self.headers)).json_py()
+        self.assertEqual(status["parts"], [{"partNumber": 1, "etag": new["etag"]}])
+
+    async def test_only_the_uploader_sees_the_upload(self):
+        upload_id = await self.start()
+        other = {"X-API-Key": make_api_key("other", "test")}
+        response = await self.worker.fetch("GET", f"/files/uploads/{upload_id}", other)
+        self.assertEqual(response.status, 404)
+        response = await self.worker.fetch("GET", "/files/uploads/unknown", self.headers)
+        self.assertEqual(response.status, 404)
+
+
+class TestGarbageCollection(EmulatorTestCase):
+    def rows(self, query):
+        return [tuple(row) for row in self.worker.env.DB.connection.execute(query)]
+
+    async def collect_at(self, when):
+        with mock.patch.object(self.worker.module.time, "time", return_value=when):
+            return await self.worker.scheduled_measured()
+
+    async def test_stale_uploads_are_aborted(self):
+        response = await self.worker.fetch(
+            "POST", "/files", self.headers, json.dumps({"key": "stale.bin", "visibility": "PUBLIC"}).encode()
+        )
+        stale_id = (await response.json_py())["uploadId"]
+        await self.worker.fetch("PUT", f"/files/stale.bin/parts/1?upload_id={stale_id}", self.headers, b"part")
+        response = await self.worker.fetch(
+            "POST", "/files", self.headers, json.dumps({"key": "fresh.bin", "visibility": "PUBLIC"}).encode()
+        )
+        fresh_id = (await response.json_py())["uploadId"]
+        age = self.worker.module.STALE_UPLOAD_AGE + 60
+        self.rows(f"UPDATE uploads SET created_at = created_at - {age} WHERE upload_id = '{stale_id}'")
+        result, metrics = await self.worker.scheduled_measured()
+        self.assertEqual(result["abortedUploads"], 1)
+        self.assertEqual(metrics.calls["r2.abortMultipartUpload"], 1)
+        self.assertEqual(self.rows("SELECT upload_id FROM uploads"), [(fresh_id,)])
+        self.assertEqual(self.rows("SELECT upload_id FROM upload_parts"), [])
+        gone = await self.worker.fetch("GET", f"/files/uploads/{stale_id}", self.headers)
+        self.assertEqual(gone.status, 404)
+
+    async def test_orphan_rows_are_dropped_after_the_grace_period(self):
+        for key in ("kept.txt", "lost.txt", "back.txt"):
+            await self.put_file(key)
+        for key in ("lost.txt", "back.txt"):
+            await self.worker.env.BUCKET.delete(key)
+        now = time.time()
+        result, _ = await self.collect_at(now)
+        self.assertEqual((result["checkedRows"], result["orphanRows"]), (3, 0))
+        self.assertEqual(self.rows("SELECT name FROM gc_orphans ORDER BY name"), [("back.txt",), ("lost.txt",)])
+        await self.worker.env.BUCKET.put("back.txt", "restored")
+        await self.collect_at(now + 60)
+        self.assertEqual(len(self.rows("SELECT name FROM files")), 3)
+        result, _ = await self.collect_at(now + self.worker.module.GC_ORPHAN_GRACE + 60)
+        self.assertEqual(result["orphanRows"], 1)
+        self.assertEqual(self.rows("SELECT name FROM files ORDER BY name"), [("back.txt",), ("kept.txt",)])
+        self.assertEqual(self.rows("SELECT name FROM gc_orphans"), [])
+
+    async def test_each_run_stays_within_its_page_budget(self):
+        for index in range(5):
+            await self.put_file(f"gc{index}.txt")
+        checked = []
+        with mock.patch.object(self.worker.module, "GC_PAGE_SIZE", 2):
+            with mock.patch.object(self.worker.module, "GC_PAGE_BUDGET", 6):
+                for _ in range(5):
+                    result, metrics = await self.worker.scheduled_measured()
+                    checked.append(result["checkedRows"])
+                    self.assertLessEqual(metrics.calls["d1.all"], 6)
+                    self.assertLessEqual(metrics.calls["r2.head"], 2 * 2)
+        self.assertEqual(checked, [2, 2, 1, 0, 2])
+        self.assertEqual(self.rows("SELECT value FROM gc_state"), [("gc1.txt",)])
+
+    async def test_objects_without_rows_do_not_stall_the_scan(self):
+        for index in range(1001):
+            await self.worker.env.BUCKET.put(f"a{index:04d}.bin", "x")
+        await self.put_file("z.txt")
+        with mock.patch.object(self.worker.module, "GC_PAGE_BUDGET", 6):
+            result, _ = await self.worker.scheduled_measured()
+        self.assertEqual(result["checkedRows"], 1)
+        self.assertEqual(self.rows("SELECT value FROM gc_state"), [("z.txt",)])
+
+    async def test_expired_signed_url_counters_are_pruned(self):
+        now = int(time.time())
+        self.rows(f"INSERT INTO signed_url_uses VALUES ('old', 1, {now - 10}), ('live', 1, {now + 300})")
+        await self.collect_at(now)
+        self.assertEqual(self.rows("SELECT token_id FROM signed_url_uses"), [("live",)])
+
+
+class TestDeferredWork(EmulatorTestCase):
+    async def asyncSetUp(self):
+        await self.put_file("notes.txt", content=b"deferred")
+        response = await self.worker.fetch("GET", "/download/notes.txt/token", self.headers)
+        self.token = (await response.json_py())["token"]
+
+    async def test_token_delete_runs_after_the_response(self):
+        kv = self.worker.env.SIGNED_URL_KEYS
+        released = asyncio.Event()
+        real_delete = kv.delete
+
+        async def gated_delete(key):
+            await released.wait()
+            await real_delete(key)
+
+        with mock.patch.object(kv, "delete", side_effect=gated_delete):
+            response, ctx = await self.worker.fetch_with_context("GET", f"/download/notes.txt?token={self.token}")
+            self.assertEqual(response.status, 200)
+            self.assertEqual(await response.body.read_all(), b"deferred")
+            self.assertIsNotNone(await kv.get(self.token))
+            self.assertEqual(len(ctx.pending), 1)
+            released.set()
+            await ctx.drain()
+        self.assertIsNone(await kv.get(self.token))
+
+    async def test_deferred_failures_do_not_fail_the_request(self):
+        kv = self.worker.env.SIGNED_URL_KEYS
+        with mock.patch.object(kv, "delete", side_effect=RuntimeError("kv unavailable")):
+            response = await self.worker.fetch("GET", f"/download/notes.txt?token={self.token}")
+        self.assertEqual(response.status, 200)
+
+    async def test_handler_runs_without_a_context(self):
+        request = self.worker.request("GET", f"/download/notes.txt?token={self.token}")
+        response = await self.worker.module.on_fetch(request, self.worker.env)
+        self.assertEqual(response.status, 200)
+        await asyncio.sleep(0.01)
+        self.assertIsNone(await self.worker.env.SIGNED_URL_KEYS.get(self.token))
+
+
+class TestHmacSignedUrls(EmulatorTestCase):
+    async def asyncSetUp(self):
+        self.worker.env.SIGNED_URL_MODE = "hmac"
+        await self.put_file("clip.mp4", content=b"frames")
+
+    async def mint(self, key="clip.mp4", query="", headers=None):
+        response = await self.worker.fetch("GET", f"/download/{key}/token{query}", headers or self.headers)
+        return response.status, (await response.json_py()).get("token")
+
+    async def test_download_is_stateless_and_reusable(self):
+        _, token = await self.mint()
+        for _ in range(2):
+            response, metrics = await self.worker.fetch_measured("GET", f"/download/clip.mp4?token={token}")
+            self.assertEqual(response.status, 200)
+            self.assertEqual(await response.body.read_all(), b"frames")
+            self.assertEqual(dict(metrics.calls), {"r2.get": 1})
+
+    async def test_tampered_expired_and_foreign_tokens(self):
+        _, token = await self.mint()
+        payload, signature = token.split(".")
+        forged = payload[:-2] + ("AA" if payload[-2:] != "AA" else "BB") + "." + signature
+        response = await self.worker.fetch("GET", f"/download/clip.mp4?token={forged}")
+        self.assertEqual(response.status, 400)
+        response = await self.worker.fetch("GET", f"/download/clip.mp4?token={self.headers['X-API-Key']}")
+        self.assertEqual(response.status, 400)
+        response = await self.worker.fetch("GET", f"/download/other.mp4?token={token}")
+        self.assertEqual(response.status, 404)
+        later = time.time() + self.worker.module.SIGNED_URL_TTL + 5
+        with mock.patch.object(self.worker.module.time, "time", return_value=later):
+            response = await self.worker.fetch("GET", f"/download/clip.mp4?token={token}")
+        self.assertEqual(response.status, 400)
+
+    async def test_single_use_tokens_stay_in_kv(self):
+        _, token = await self.mint(query="?single_use=1")
+        self.assertNotIn(".", token)
+        first = await self.worker.fetch("GET", f"/download/clip.mp4?token={token}")
+        again = await self.worker.fetch("GET", f"/download/clip.mp4?token={token}")
+        self.assertEqual((first.status, again.status), (200, 400))
+
+    async def test_token_requires_file_access(self):
+        await self.put_file("secret.txt", visibility="PRIVATE")
+        status, _ = await self.mint("secret.txt", headers={"X-API-Key": make_api_key("other", "other")})
+        self.assertEqual(status, 403)
+
+
+class TestCountedSignedUrls(EmulatorTestCase):
+    async def asyncSetUp(self):
+        await self.put_file("movie.mp4", content=bytes(100))
+
+    async def mint(self, query):
+        response = await self.worker.fetch("GET", f"/download/movie.mp4/token?{query}", self.headers)
+        return response.status, (await response.json_py()).get("token")
+
+    async def download(self, token, range_header="bytes=0-9"):
+        return await self.worker.fetch("GET", f"/download/movie.mp4?token={token}", {"Range": range_header})
+
+    async def test_ranged_requests_share_one_url_up_to_max_uses(self):
+        _, token = await self.mint("max_uses=3")
+        statuses = []
+        for offset in range(0, 50, 10):
+            response, metrics = await self.worker.fetch_measured(
+                "GET", f"/download/movie.mp4?token={token}", {"Range": f"bytes={offset}-{offset + 9}"}
+            )
+            statuses.append(response.status)
+        self.assertEqual(statuses, [206, 206, 206, 400, 400])
+        self.assertEqual(metrics.calls["d1.first"], 1)
+
+    async def test_concurrent_uses_never_exceed_max(self):
+        _, token = await self.mint("max_uses=5")
+        responses = await asyncio.gather(*(self.download(token) for _ in range(12)))
+        self.assertEqual(sorted(r.status for r in responses), [206] * 5 + [400] * 7)
+
+    async def test_other_keys_do_not_spend_uses(self):
+        await self.put_file("trailer.mp4", content=bytes(100))
+        _, counted = await self.mint("max_uses=2")
+        _, single = await self.mint("single_use=1")
+        for token in (counted, counted, single):
+            response = await self.worker.fetch("GET", f"/download/trailer.mp4?token={token}")
+            self.assertEqual(response.status, 404)
+        self.assertEqual([(await self.download(counted)).status for _ in range(3)], [206, 206, 400])
+        self.assertEqual((await self.download(single)).status, 206)
+
+    async def test_counted_tokens_ignore_kv_mode(self):
+        _, token = await self.mint("max_uses=2&expires_in=60")
+        self.assertIn(".", token)
+        kv = await self.worker.env.SIGNED_URL_KEYS.list()
+        self.assertEqual(len(kv.keys), 0)
+
+    async def test_invalid_options(self):
+        for query in ("max_uses=0", "max_uses=abc", "expires_in=0", "single_use=1&max_uses=2"):
+            with self.subTest(query):
+                status, _ = await self.mint(query)
+                self.assertEqual(status, 400)
+
+
+class TestBatchSignedUrls(EmulatorTestCase):
+    async def asyncSetUp(self):
+        self.other = {"X-API-Key": make_api_key("other", "other")}
+        await self.put_file("public.txt", content=b"public")
+        await self.put_file("mine.txt", content=b"mine", visibility="PRIVATE")
+        await self.put_file("theirs.txt", visibility="PRIVATE", headers=self.other)
+
+    async def mint(self, keys, query="", headers=None):
+        return await self.worker.fetch_measured(
+            "POST", f"/download/tokens{query}", headers or self.headers, json.dumps(keys).encode()
+        )
+
+    async def test_one_access_query_for_all_keys(self):
+        keys = ["public.txt", "mine.txt", "theirs.txt", "missing.txt"]
+        response, metrics = await self.mint(keys)
+        self.assertEqual(response.status, 200)
+        result = await response.json_py()
+        self.assertEqual(sorted(result["urls"]), ["mine.txt", "public.txt"])
+        self.assertEqual(result["denied"], ["theirs.txt", "missing.txt"])
+        self.assertEqual(metrics.calls["d1.all"], 1)
+        self.assertEqual(metrics.calls["d1.first"], 0)
+        for key, content in (("public.txt", b"public"), ("mine.txt", b"mine")):
+            download = await self.worker.fetch("GET", result["urls"][key].removeprefix(BASE_URL))
+            self.assertEqual(download.status, 200)
+            self.assertEqual(await download.body.read_all(), content)
+
+    async def test_hmac_mode_skips_kv(self):
+        self.worker.env.SIGNED_URL_MODE = "hmac"
+        keys = [f"{i}.jpg" for i in range(20)]
+        for key in keys:
+            await self.put_file(key)
+        response, metrics = await self.mint(keys + ["public.txt"], "?expires_in=60")
+        self.assertEqual(len((await response.json_py())["urls"]), 21)
+        self.assertFalse([call for call in metrics.calls if call.startswith("kv.")])
+
+    async def test_kv_batches_fit_the_kv_operation_limit(self):
+        batch = self.worker.module.MAX_KV_SIGNED_URL_BATCH
+        response, _ = await self.mint([f"{i}.jpg" for i in range(batch + 1)])
+        self.assertEqual(response.status, 400)
+        response, metrics = await self.mint([f"{i}.jpg" for i in range(batch - 1)] + ["public.txt"])
+        self.assertEqual(response.status, 200)
+        self.assertEqual((metrics.calls["kv.put"], metrics.calls["kv.get"]), (1, 0))
+        response, _ = await self.mint([f"{i}.jpg" for i in range(batch + 1)], "?max_uses=2")
+        self.assertEqual(response.status, 200)
+
+    async def test_invalid_bodies(self):
+        too_many = [str(i) for i in range(self.worker.module.MAX_SIGNED_URL_BATCH + 1)]
+        for keys in ([], {"keys": ["public.txt"]}, ["public.txt", 1], too_many):
+            with self.subTest(keys=str(keys)[:40]):
+                response, _ = await self.mint(keys)
+                self.assertEqual(response.status, 400)
+        response, _ = await self.mint(["public.txt"], "?max_uses=0")
+        self.assertEqual(response.status, 400)
+
+    async def test_file_named_tokens_still_downloads(self):
+        await self.put_file("tokens", content=b"still a file")
+        token_response = await self.worker.fetch("GET", "/download/tokens/token", self.headers)
+        token = (await token_response.json_py())["token"]
+        download = await self.worker.fetch("GET", f"/download/tokens?token={token}")
+        self.assertEqual(await download.body.read_all(), b"still a file")
+
+
+class TestDelete(EmulatorTestCase):
+    async def delete(self, keys=None, query="", headers=None):
+        body = json.dumps(keys).encode() if keys is not None else None
+        return await self.worker.fetch_measured("DELETE", f"/files{query}", headers or self.headers, body)
+
+    async def test_single_delete(self):
+        await self.put_file("old.txt")
+        response, _ = await self.delete(query="?key=old.txt")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(await response.json_py(), {"deleted": ["old.txt"], "denied": []})
+        # the ACL row went with the object, so reads are refused like HEAD
+        get = await self.worker.fetch("GET", "/files?key=old.txt", self.headers)
+        self.assertEqual(get.status, 403)
+        self.assertIsNone(await self.worker.env.BUCKET.head("old.txt"))
+        again, _ = await self.delete(query="?key=old.txt")
+        self.assertEqual(again.status, 404)
+
+    async def test_bulk_delete_batches_r2_and_d1(self):
+        keys = [f"{i}.log" for i in range(5)]
+        for key in keys:
+            await self.put_file(key)
+        with mock.patch.object(self.worker.module, "R2_DELETE_BATCH_SIZE", 2):
+            response, metrics = await self.delete(keys + ["missing.log"])
+        self.assertEqual(await response.json_py(), {"deleted": keys, "denied": ["missing.log"]})
+        self.assertEqual(metrics.calls["r2.delete"], 3)
+        self.assertEqual(metrics.calls["d1.all"], 1)
+        self.assertEqual(metrics.calls["d1.batch"], 1)
+        listed = await self.worker.env.BUCKET.list()
+        self.assertEqual(len(listed.objects), 0)
+
+    async def test_only_owners_and_admins_delete(self):
+        colleague = {"X-API-Key": make_api_key("colleague", "test", permission_level=2)}
+        outsider = {"X-API-Key": make_api_key("outsider", "other")}
+        await self.put_file("shared.txt", visibility="PUBLIC", headers=colleague)
+        await self.put_file("mine.txt")
+        response, _ = await self.delete(["shared.txt", "mine.txt"], headers=outsider)
+        self.assertEqual((await response.json_py())["denied"], ["shared.txt", "mine.txt"])
+        response, _ = await self.delete(["mine.txt"], headers=colleague)
+        self.assertEqual((await response.json_py())["denied"], ["mine.txt"])
+        response, _ = await self.delete(["shared.txt"])
+        self.assertEqual((await response.json_py())["deleted"], ["shared.txt"])
+        reader = {"X-API-Key": make_api_key("test", "test", permission_level=1)}
+        response, _ = await self.delete(["mine.txt"], headers=reader)
+        self.assertEqual(response.status, 403)
+
+    async def test_invalid_requests(self):
+        for keys in (None, [], {"keys": ["a"]}, ["a", 2]):
+            with self.subTest(keys=keys):
+                response, _ = await self.delete(keys)
+                self.assertEqual(response.status, 400)
+
+
+class TestFieldProjection(EmulatorTestCase):
+    async def asyncSetUp(self):
+        for name in ("a.txt", "b.txt"):
+            await self.put_file(name)
+
+    async def objects(self, query):
+        response = await self.worker.fetch("GET", f"/files?{query}", self.headers)
+        return response.status, (await response.json_py()).get("objects")
+
+    async def test_list_returns_only_requested_fields(self):
+        for query in ("limit=10&fields=key,size", "fill=1&fields=key,size"):
+            with self.subTest(query):
+                status, objects = await self.objects(query)
+                self.assertEqual(status, 206)
+                self.assertEqual(objects, [{"key": "a.txt", "size": 15}, {"key": "b.txt", "size": 15}])
+
+    async def test_default_shape_is_unchanged(self):
+        _, objects = await self.objects("limit=1")
+        self.assertEqual(list(objects[0]), list(self.worker.module.OBJECT_FIELDS))
+        self.assertEqual(objects[0]["httpMetadata"], {})
+        self.assertEqual(len(objects[0]["checksums"]["md5"]), 32)
+
+    async def test_metadata_fields_are_listed_on_request(self):
+        await self.worker.fetch(
+            "PUT", "/files/0.csv?visibility=PUBLIC", {**self.headers, "content-type": "text/csv"}, b"a,b"
+        )
+        listed = []
+        real_list = self.worker.env.BUCKET.list
+        with mock.patch.object(
+            self.worker.env.BUCKET, "list", side_effect=lambda *a, **kw: listed.append(kw) or real_list(*a, **kw)
+        ):
+            _, objects = await self.objects("limit=1&fields=key,httpMetadata")
+        self.assertEqual(objects[0]["httpMetadata"]["contentType"], "text/csv")
+        self.assertEqual(list(listed[0]["include"]), ["httpMetadata"])
+
+    async def test_meta_and_index_projections(self):
+        response = await self.worker.fetch("GET", "/files?meta=1&key=a.txt&fields=etag,key", self.headers)
+        self.assertEqual(list(await response.json_py()), ["etag", "key"])
+        response = await self.worker.fetch("GET", "/files?meta=1&key=a.txt&source=d1&fields=size", self.headers)
+        self.assertEqual(await response.json_py(), {"size": 15})
+        _, objects = await self.objects("source=d1&fields=visibility")
+        self.assertEqual(objects, [{"visibility": "PUBLIC"}, {"visibility": "PUBLIC"}])
+
+    async def test_unknown_fields(self):
+        for query in (
+            "limit=1&fields=key,owner",
+            "limit=1&fields=,",
+            "source=d1&fields=size",
+            "meta=1&key=a.txt&source=d1&fields=visibility",
+        ):
+            with self.subTest(query):
+                status, _ = await self.objects(query)
+                self.assertEqual(status, 400)
+
+
+class TestFillPagination(EmulatorTestCase):
+    async def asyncSetUp(self):
+        # every third object belongs to the caller; the rest are another company's private files
+        self.other = {"X-API-Key": make_api_key("other", "other")}
+        self.visible = []
+        for i in range(30):
+            key = f"fill/{i:03d}.txt"
+            if i % 3 == 0:
+                await self.put_file(key, visibility="PRIVATE")
+                self.visible.append(key)
+            else:
+                await self.put_file(key, visibility="PRIVATE", headers=self.other)
+
+    async def list_page(self, query):
+        response = await self.worker.fetch("GET", f"/files?fill=1&{query}", self.headers)
+        self.assertEqual(response.status, 206)
+        return await response.json_py()
+
+    async def test_page_is_filled_to_limit(self):
+        page = await self.list_page("limit=4")
+        self.assertEqual([o["key"] for o in page["objects"]], self.visible[:4])
+        self.assertTrue(page["truncated"])
+
+    async def test_cursor_resumes_after_last_examined_object(self):
+        listed, cursor = [], None
+        while True:
+            page = await self.list_page("limit=3" + (f"&cursor={cursor}" if cursor else ""))
+            listed += [o["key"] for o in page["objects"]]
+            cursor = page["cursor"]
+            if not page["truncated"]:
+                break
+        self.assertEqual(listed, self.visible)
+        self.assertIsNone(cursor)
+
+    async def test_scan_cap_returns_short_page_with_cursor(self):
+        with mock.patch.object(self.worker.module, "LIST_FILL_PAGE_SIZE", 1):
+            with mock.patch.object(self.worker.module, "LIST_FILL_MAX_SCAN", 5):
+                page = await self.list_page("limit=10")
+        self.assertEqual(page["scanned"], 5)
+        self.assertEqual([o["key"] for o in page["objects"]], self.visible[:2])
+        self.assertTrue(page["truncated"])
+        rest = await self.list_page(f"limit=10&cursor={page['cursor']}")
+        self.assertEqual([o["key"] for o in rest["objects"]], self.visible[2:])
+
+    async def test_empty_result_is_not_an_error(self):
+        page = await self.list_page("limit=5&cursor=" + self.worker.module.encode_list_cursor("fill/999"))
+        self.assertEqual((page["objects"], page["truncated"], page["cursor"]), ([], False, None))
+
+    async def test_invalid_cursor(self):
+        for query in ("fill=1", "source=d1"):
+            for cursor in ("%FF%FF", "%%%", "!!", "ab.c"):
+                with self.subTest(query=query, cursor=cursor):
+                    response = await self.worker.fetch("GET", f"/files?{query}&cursor={cursor}", self.headers)
+                    self.assertEqual(response.status, 400)
+
+
+class TestIndexedListing(TestFillPagination):
+    async def list_page(self, query):
+        response = await self.worker.fetch("GET", f"/files?source=d1&{query}", self.headers)
+        self.assertEqual(response.status, 206)
+        return await response.json_py()
+
+    async def test_page_is_one_d1_query(self):
+        response, metrics = await self.worker.fetch_measured("GET", "/files?source=d1&limit=4", self.headers)
+        page = await response.json_py()
+        self.assertEqual([o["key"] for o in page["objects"]], self.visible[:4])
+        self.assertEqual(page["objects"][0]["visibility"], "PRIVATE")
+        self.assertEqual(dict(metrics.calls), {"d1.all": 1})
+
+    async def test_every_branch_uses_an_index(self):
+        db_ops = load_worker("db_ops")
+        employee = load_worker("cf_types").Employee(id="test", company_id="test", permission_level=3)
+        statements = []
+        real_prepare = self.worker.env.DB.prepare
+        with mock.patch.object(self.worker.env.DB, "prepare", side_effect=lambda q: statements.append(q) or real_prepare(q)):
+            await db_ops.list_visible_files(self.worker.env.DB, employee, 10, "fill/", "fill0")
+        plan = self.worker.env.DB.connection.execute(
+            "EXPLAIN QUERY PLAN " + statements[0], {"1": "test", "2": "test", "3": "fill/", "4": 10, "5": "fill0"}
+        ).fetchall()
+        details = [row[-1] for row in plan]
+        self.assertFalse([d for d in details if d.startswith("SCAN files")], details)
+
+    async def test_scan_cap_returns_short_page_with_cursor(self):
+        self.skipTest("D1 listing reads only matching rows, there is no scan cap")
+
+    async def test_prefix_mode_lists_own_company_only(self):
+        self.worker.env.KEY_PREFIX_MODE = "company"
+        await self.put_file("prefixed.txt")
+        await self.put_file("elsewhere.txt", headers=self.other)
+        page = await self.list_page("limit=10")
+        self.assertEqual([o["key"] for o in page["objects"]], ["prefixed.txt"])
+        escape = self.worker.module.encode_list_cursor("a")
+        page = await self.list_page(f"limit=10&cursor={escape}")
+        self.assertEqual([o["key"] for o in page["objects"]], ["prefixed.txt"])
+
+
+class TestTenantKeyPrefix(EmulatorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.worker.env.KEY_PREFIX_MODE = "company"
+        self.other = {"X-API-Key": make_api_key("other", "other")}
+
+    async def stored_keys(self):
+        listing = await self.worker.env.BUCKET.list()
+        return sorted(o.key for o in listing.objects)
+
+    async def test_objects_are_stored_under_company_prefix(self):
+        put = await self.put_file("report.txt")
+        self.assertEqual((await put.json_py())["key"], "report.txt")
+        await self.put_file("report.txt", content=b"other content", headers=self.other)
+        self.assertEqual(await self.stored_keys(), ["other/report.txt", "test/report.txt"])
+        response = await self.worker.fetch("GET", "/files?key=report.txt", self.headers)
+        self.assertEqual(response.headers.get("Content-Disposition"), 'attachment; filename="report.txt"')
+        self.assertEqual(await response.body.read_all(), b"example content")
+
+    async def test_list_only_scans_own_company(self):
+        await self.put_file("mine.txt")
+        await self.put_file("theirs.txt", headers=self.other)
+        response = await self.worker.fetch("GET", "/files?fill=1&limit=10", self.headers)
+        page = await response.json_py()
+        self.assertEqual(([o["key"] for o in page["objects"]], page["scanned"]), (["mine.txt"], 1))
+        response = await self.worker.fetch("GET", "/files?limit=10", self.headers)
+        self.assertEqual([o["key"] for o in (await response.json_py())["objects"]], ["mine.txt"])
+
+    async def test_public_files_are_shared_within_the_company(self):
+        await self.put_file("handbook.pdf", visibility="PUBLIC")
+        colleague = {"X-API-Key": make_api_key("colleague", "test")}
+        self.assertEqual((await self.worker.fetch("GET", "/files?key=handbook.pdf", colleague)).status, 200)
+        self.assertEqual((await self.worker.fetch("GET", "/files?key=handbook.pdf", self.other)).status, 403)
+        token = await (await self.worker.fetch("GET", "/download/handbook.pdf/token", self.headers)).json_py()
+        download = await self.worker.fetch("GET", f"/download/handbook.pdf?token={token['token']}")
+        self.assertEqual(await download.body.read_all(), b"example content")
+
+    async def test_signed_url_and_multipart(self):
+        start = await self.worker.fetch(
+            "POST", "/files", self.headers, json.dumps({"key": "big.bin", "visibility": "PRIVATE"}).encode()
+        )
+        upload = await start.json_py()
+        self.assertEqual(upload["key"], "big.bin")
+        body, content_type = encode_multipart(
+            {"key": "big.bin", "upload_id": upload["uploadId"], "part": 1}, {"file": ("p1", b"part one", "text/plain")}
+        )
+        part = await self.worker.fetch("PUT", "/files", {**self.headers, "content-type": content_type}, body)
+        complete = await self.worker.fetch(
+            "POST",
+            f"/files?upload_id={upload['uploadId']}&key=big.bin&visibility=PRIVATE",
+            self.headers,
+            json.dumps([await part.json_py()]).encode(),
+        )
+        self.assertEqual((await complete.json_py())["key"], "big.bin")
+        self.assertEqual(await self.stored_keys(), ["test/big.bin"])
+        token = await (await self.worker.fetch("GET", "/download/big.bin/token", self.headers)).json_py()
+        download = await self.worker.fetch("GET", f"/download/big.bin?token={token['token']}")
+        self.assertEqual(await download.body.read_all(), b"part one")
+
+
+class TestKeyMigration(EmulatorTestCase):
+    async def asyncSetUp(self):
+        self.other = {"X-API-Key": make_api_key("other", "other")}
+        for key in ("a.txt", "b/c.txt", "d.txt"):
+            await self.put_file(key, content=key.encode())
+        await self.put_file("other.txt", headers=self.other)
+        self.worker.env.KEY_PREFIX_MODE = "company"
+
+    async def migrate(self, headers=None):
+        return await self.worker.fetch("POST", "/admin/migrate-keys", headers or self.headers)
+
+    async def test_migration_moves_company_objects(self):
+        with mock.patch.object(self.worker.module, "KEY_MIGRATION_BATCH_SIZE", 2):
+            first = await (await self.migrate()).json_py()
+            second = await (await self.migrate()).json_py()
+        self.assertEqual((first["migrated"], first["remaining"]), (2, True))
+        self.assertEqual((second["migrated"], second["remaining"]), (1, False))
+        listing = await self.worker.env.BUCKET.list()
+        self.assertEqual(
+            sorted(o.key for o in listing.objects), ["other.txt", "test/a.txt", "test/b/c.txt", "test/d.txt"]
+        )
+        response = await self.worker.fetch("GET", "/files?key=b/c.txt", self.headers)
+        self.assertEqual(await response.body.read_all(), b"b/c.txt")
+        again = await (await self.migrate()).json_py()
+        self.assertEqual((again["migrated"], again["remaining"]), (0, False))
+
+    async def test_unmigrated_files_stay_readable(self):
+        response = await self.worker.fetch("GET", "/files?key=a.txt", self.headers)
+        self.assertEqual(await response.body.read_all(), b"a.txt")
+        head = await self.worker.fetch("HEAD", "/files?key=b/c.txt", self.headers)
+        self.assertEqual(head.status, 200)
+        token = await (await self.worker.fetch("GET", "/download/d.txt/token", self.headers)).json_py()
+        download = await self.worker.fetch("GET", f"/download/d.txt?token={token['token']}")
+        self.assertEqual(await download.body.read_all(), b"d.txt")
+        self.assertEqual((await self.worker.fetch("GET", "/files?key=a.txt", self.other)).status, 403)
+        self.assertEqual((await self.worker.fetch("GET", "/files?key=other.txt", self.other)).status, 200)
+
+    async def test_scheduled_runs_migrate_every_company(self):
+        with mock.patch.object(self.worker.module, "SCHEDULED_KEY_MIGRATION_SIZE", 3):
+            first = await self.worker.scheduled()
+            second = await self.worker.scheduled()
+        self.assertEqual((first["migratedKeys"], first["keysRemaining"]), (3, True))
+        self.assertEqual((second["migratedKeys"], second["keysRemaining"]), (1, False))
+        listing = await self.worker.env.BUCKET.list()
+        self.assertEqual(
+            sorted(o.key for o in listing.objects),
+            ["other/other.txt", "test/a.txt", "test/b/c.txt", "test/d.txt"],
+        )
+        response = await self.worker.fetch("GET", "/files?key=other.txt", self.other)
+        self.assertEqual(response.status, 200)
+
+    async def test_scheduled_runs_skip_migration_without_prefix_mode(self):
+        self.worker.env.KEY_PREFIX_MODE = None
+        self.assertNotIn("migratedKeys", await self.worker.scheduled())
+
+    async def test_migration_requires_admin(self):
+        response = await self.migrate({"X-API-Key": make_api_key("reader", "test", permission_level=1)})
+        self.assertEqual(response.status, 403)
+
+    async def test_migration_requires_prefix_mode(self):
+        self.worker.env.KEY_PREFIX_MODE = None
+        response = await self.migrate()
+        self.assertEqual(response.status, 400)
+
+
+class TestEmulatorBindings(EmulatorTestCase):
+    async def test_round_trips_are_counted(self):
+        _, metrics = await self.worker.fetch_measured("GET", "/files?limit=1", self.headers)
+        self.assertEqual(metrics.calls["d1.run"], 1)
+        self.assertEqual(metrics.calls["r2.list"], 1)
+
+    async def test_cpu_of_child_tasks_is_counted(self):
+        def spin():
+            deadline = time.thread_time() + 0.02
+            while time.thread_time() < deadline:
+                pass
+
+        async def child():
+            await asyncio.sleep(0)
+            spin()
+
+        async def request():
+            await asyncio.gather(child(), child())
+
+        _, metrics = await measure(request())
+        self.assertGreaterEqual(metrics.worker_cpu, 0.035)
+        _, put = await self.worker.fetch_measured("PUT", "/files?key=bytes.bin", self.headers, b"x" * 4096)
+        self.assertGreater(put.worker_cpu, 0)
+
+    async def test_python_dict_options_are_rejected(self):
+        with self.assertRaises(Exception):
+            await self.worker.env.BUCKET.list({"limit": 1})
+
+    async def test_d1_bound_parameter_limit(self):
+        with self.assertRaises(Exception):
+            self.worker.env.DB.prepare("SELECT 1").bind(*range(101))
+
+    async def test_bucket_survives_restart(self):
+        key = str(uuid4())
+        await self.put_file(key)
+        reopened = LocalWorker.create(self.tmp.name, secret=SECRET)
+        self.assertIsNotNone(await reopened.env.BUCKET.head(key))
+
+
+class TestJwtCache(EmulatorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.module = self.worker.module
+
+    async def test_repeated_key_is_served_from_cache(self):
+        for _ in range(3):
+            response = await self.worker.fetch("GET", "/files?limit=1", self.headers)
+            self.assertNotEqual(response.status, 401)
+        info = self.module.jwt_cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (2, 1, 1))
+
+    async def test_expired_entry_is_not_served(self):
+        await self.worker.fetch("GET", "/files?limit=1", self.headers)
+        with mock.patch.object(self.module.time, "time", return_value=time.time() + 2 * 86400):
+            with self.assertRaises(AssertionError):
+                await self.module.authenticate_employee(self.headers["X-API-Key"], self.worker.env)
+        self.assertEqual(self.module.jwt_cache_info().hits, 0)
+
+    async def test_cache_is_bounded(self):
+        with mock.patch.object(self.module, "JWT_CACHE_SIZE", 2):
+            for employee_id in ("a", "b", "c"):
+                await self.module.authenticate_employee(make_api_key(employee_id), self.worker.env)
+        self.assertEqual(self.module.jwt_cache_info().currsize, 2)
+
+
+class TestEmployeeCache(EmulatorTestCase):
+    def d1_calls(self, metrics):
+        return sum(n for name, n in metrics.calls.items() if name.startswith("d1."))
+
+    async def test_registration_costs_one_upsert_then_nothing(self):
+        _, first = await self.worker.fetch_measured("GET", "/files", self.headers)
+        self.assertEqual((first.calls["d1.run"], self.d1_calls(first)), (1, 1))
+        _, second = await self.worker.fetch_measured("GET", "/files", self.headers)
+        self.assertEqual(self.d1_calls(second), 0)
+
+    async def test_upload_skips_employee_lookup(self):
+        await self.worker.fetch("GET", "/files?key=missing", self.headers)
+        body, content_type = encode_multipart(
+            {"key": "cached.txt", "visibility": "PUBLIC"}, {"file": ("cached.txt", b"content", "text/plain")}
+        )
+        response, metrics = await self.worker.fetch_measured(
+            "PUT", "/files", {**self.headers, "content-type": content_type}, body
+        )
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.d1_calls(metrics), 1)
+
+    async def test_new_isolate_upserts_existing_employee(self):
+        await self.worker.fetch("GET", "/files?key=missing", self.headers)
+        restarted = LocalWorker(self.worker.env, load_worker(fresh=True))
+        response = await restarted.fetch("GET", "/files?limit=1", self.headers)
+        self.assertEqual(response.status, 404)
+
+    async def test_entries_expire(self):
+        db_ops = load_worker("db_ops")
+        await self.worker.fetch("GET", "/files?key=missing", self.headers)
+        later = db_ops.time.monotonic() + db_ops.EMPLOYEE_CACHE_TTL + 1
+        with mock.patch.object(db_ops.time, "monotonic", return_value=later):
+            _, metrics = await self.worker.fetch_measured("GET", "/files?key=missing", self.headers)
+        self.assertEqual(metrics.calls["d1.run"], 1)
+
+
+class TestAuthorizationQueries(EmulatorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db_ops = load_worker("db_ops")
+        self.cf_types = load_worker("cf_types")
+
+    def employee(self, employee_id="test", company_id="test"):
+        return self.cf_types.Employee(id=employee_id, company_id=company_id, permission_level=3)
+
+    async def test_check_file_access_is_one_round_trip(self):
+        await self.put_file("private.txt", visibility="PRIVATE")
+        await self.worker.fetch("GET", "/files?key=x", {"X-API-Key": make_api_key("other", "other")})
+        self.db_ops.employee_cache_clear()
+        db = self.worker.env.DB
+        cases = [(self.employee(), True), (self.employee("other", "other"), False), (self.employee("ghost"), False)]
+        for employee, expected in cases:
+            allowed, metrics = await measure(self.db_ops.check_file_access(db, "private.txt", employee))
+            self.assertEqual((allowed, metrics.round_trips), (expected, 1))
+
+    async def test_check_multiple_file_access_skips_unregistered_employee(self):
+        await self.put_file("public.txt")
+        db = self.worker.env.DB
+        access, metrics = await measure(
+            self.db_ops.check_multiple_file_access(db, ["public.txt"], self.employee("ghost"))
+        )
+        self.assertEqual((access, metrics.round_trips), ({}, 1))
+
+    async def test_check_multiple_file_access_page_sizes_share_one_statement(self):
+        await self.put_file("public.txt")
+        await self.put_file("private.txt", visibility="PRIVATE")
+        db = self.worker.env.DB
+        db.prepared.clear()
+        for size in (2, 500, 1000):
+            names = ["public.txt", "private.txt"] + [f"missing/{i}" for i in range(size - 2)]
+            access, metrics = await measure(self.db_ops.check_multiple_file_access(db, names, self.employee()))
+            self.assertEqual((access, metrics.round_trips), ({"public.txt": True, "private.txt": True}, 1))
+        self.assertEqual(list(db.prepared.values()), [3])
+
+    async def test_insert_file_access_requires_registered_employee(self):
+        file_access = self.cf_types.FileAccess(
+            key="orphan.txt", visibility="PUBLIC", employee_id="ghost", company_id="test"
+        )
+        inserted, metrics = await measure(self.db_ops.insert_file_access(self.worker.env.DB, file_access))
+        self.assertEqual((inserted, metrics.round_trips), (False, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
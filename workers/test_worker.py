@@ -268,7 +268,7 @@ class TestAPI(unittest.TestCase):
 
     def test_delete_method(self):
         response = requests.delete(f"{self.BASE_URL}/files", headers=self.HEADERS)
-        self.assertEqual(response.status_code, 501)  # Not Implemented
+        self.assertEqual(response.status_code, 400)  # no key or key list
 
 
 if __name__ == "__main__":